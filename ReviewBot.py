@@ -28,7 +28,11 @@ from collections import namedtuple
 from collections import OrderedDict
 from osclib.comments import CommentAPI
 from osclib.conf import Config
+from osclib.connection_pool import ConnectionPool
+from osclib.http_metrics import HTTPMetrics
 from osclib.memoize import memoize
+from osclib.memoize import new_cycle
+from osclib.memoize import session_stats
 from osclib.stagingapi import StagingAPI
 import signal
 import datetime
@@ -506,6 +510,8 @@ class CommandLineInterface(cmdln.Cmdln):
         self.logger = logging.getLogger(self.optparser.prog)
 
         conf.get_config(override_apiurl = self.options.apiurl)
+        ConnectionPool.init()
+        HTTPMetrics.init()
 
         if (self.options.osc_debug):
             conf.config['debug'] = 1
@@ -596,6 +602,7 @@ class CommandLineInterface(cmdln.Cmdln):
                 workfunc()
             except Exception, e:
                 self.logger.exception(e)
+            HTTPMetrics.write()
 
             if interval:
                 self.logger.info("sleeping %d minutes. Press enter to check now ..."%interval)
@@ -606,6 +613,9 @@ class CommandLineInterface(cmdln.Cmdln):
                     pass
                 signal.alarm(0)
                 self.logger.info("recheck at %s"%datetime.datetime.now().isoformat())
+                for name, counters in sorted(session_stats().items()):
+                    self.logger.debug("session cache %s: %s", name, counters)
+                new_cycle()
                 continue
             break
 
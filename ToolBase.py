@@ -26,14 +26,17 @@ import cmdln
 import itertools
 import logging
 import sys
-import time
-import urllib2
 
 import osc.conf
 import osc.core
 from urllib import quote_plus
 
+from osclib.connection_pool import ConnectionPool
+from osclib.http_metrics import HTTPMetrics
 from osclib.memoize import memoize
+from osclib.memoize import new_cycle
+from osclib.memoize import session_stats
+from osclib.retry import Retry
 
 logger = logging.getLogger()
 
@@ -55,7 +58,7 @@ class ToolBase(object):
         self.caching = False
         self.dryrun = False
 
-    @memoize(add_invalidate=True)
+    @memoize(add_invalidate=True, stale_ttl=60*60)
     def _cached_GET(self, url):
         return self.retried_GET(url).read()
 
@@ -65,14 +68,7 @@ class ToolBase(object):
         return self.retried_GET(url).read()
 
     def retried_GET(self, url):
-        try:
-            return http_GET(url)
-        except urllib2.HTTPError, e:
-            if 500 <= e.code <= 599:
-                print 'Retrying {}'.format(url)
-                time.sleep(1)
-                return self.retried_GET(url)
-            raise e
+        return Retry.request(http_GET, url)
 
     def http_PUT(self, *args, **kwargs):
         if self.dryrun:
@@ -156,6 +152,8 @@ class CommandLineInterface(cmdln.Cmdln):
         logging.basicConfig(level=level)
 
         osc.conf.get_config(override_apiurl = self.options.apiurl)
+        ConnectionPool.init()
+        HTTPMetrics.init()
 
         if self.options.osc_debug:
             osc.conf.config['debug'] = 1
@@ -196,6 +194,7 @@ class CommandLineInterface(cmdln.Cmdln):
                 workfunc()
             except Exception, e:
                 logger.exception(e)
+            HTTPMetrics.write()
 
             if interval:
                 logger.info("sleeping %d minutes. Press enter to check now ..."%interval)
@@ -206,6 +205,9 @@ class CommandLineInterface(cmdln.Cmdln):
                     pass
                 signal.alarm(0)
                 logger.info("recheck at %s"%datetime.datetime.now().isoformat())
+                for name, counters in sorted(session_stats().items()):
+                    logger.debug("session cache %s: %s", name, counters)
+                new_cycle()
                 continue
             break
 
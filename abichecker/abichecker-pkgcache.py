@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# Copyright (c) 2017 SUSE LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import logging
+import cmdln
+
+from osclib.pkgcache import PkgCache
+
+# Same as in abichecker.py
+BINCACHE = os.path.expanduser('~/co')
+
+GiB = 1024 ** 3
+
+
+def format_bytes(size):
+    return '%.2f GiB' % (float(size) / GiB)
+
+
+class CommandLineInterface(cmdln.Cmdln):
+    def __init__(self, *args, **kwargs):
+        cmdln.Cmdln.__init__(self, args, kwargs)
+
+    def get_optparser(self):
+        parser = cmdln.CmdlnOptionParser(self)
+        parser.add_option("--cachedir", default=BINCACHE, help="directory containing the pkgcache (default %default)")
+        parser.add_option("--debug", action="store_true", help="debug output")
+        return parser
+
+    def postoptparse(self):
+        logging.basicConfig()
+        self.logger = logging.getLogger(self.optparser.prog)
+        if (self.options.debug):
+            self.logger.setLevel(logging.DEBUG)
+
+    def do_stats(self, subcmd, opts):
+        """${cmd_name}: show size, deduplication and hit rate of the cache
+
+        ${cmd_usage}
+        ${cmd_option_list}
+        """
+
+        # Only inspected, entries are neither expired nor evicted.
+        cache = PkgCache(self.options.cachedir, clean=False)
+        try:
+            stats = cache.stats()
+        finally:
+            cache.close()
+        lookups = stats.get('hit', 0) + stats.get('miss', 0)
+
+        print('entries:     %d' % stats['entries'])
+        print('files:       %d (%d references, %d hard links)' % (
+            stats['contents'], stats['references'], stats['links']))
+        print('size:        %s' % format_bytes(stats['bytes']))
+        print('linked:      %s' % format_bytes(stats['bytes_linked']))
+        print('dedupe:      %s' % ('%.2f' % (float(stats['bytes_linked']) / stats['bytes'])
+                                   if stats['bytes'] else '-'))
+        print('hit rate:    %s (%d of %d)' % ('%.1f%%' % (100.0 * stats.get('hit', 0) / lookups)
+                                             if lookups else '-', stats.get('hit', 0), lookups))
+        print('evicted:     %d' % stats.get('evicted', 0))
+
+    @cmdln.option('--ttl', metavar='days', type='int', default=14, help='expire entries older than days')
+    @cmdln.option('--quota', metavar='GiB', type='float', help='evict least recently used entries beyond quota')
+    def do_gc(self, subcmd, opts):
+        """${cmd_name}: expire and evict entries and repair the cache index
+
+        Files deleted from the cache directory directly are dropped from the
+        index and files unknown to the index are removed.
+
+        ${cmd_usage}
+        ${cmd_option_list}
+        """
+
+        quota = int(opts.quota * GiB) if opts.quota else None
+        # Expired and evicted by gc() to report them.
+        cache = PkgCache(self.options.cachedir, quota=quota, clean=False)
+        try:
+            result = cache.gc(ttl=opts.ttl * 24 * 60 * 60)
+            for name in ('expired', 'missing', 'orphaned', 'evicted'):
+                print('%-10s %d' % (name, result[name]))
+            print('size:      %s' % format_bytes(cache.stats()['bytes']))
+        finally:
+            cache.close()
+
+if __name__ == "__main__":
+    app = CommandLineInterface()
+    sys.exit( app.main() )
+
+# vim: sw=4 et
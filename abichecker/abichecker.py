@@ -23,7 +23,9 @@ from optparse import OptionParser
 from pprint import pformat, pprint
 from stat import S_ISREG, S_ISLNK
 from tempfile import NamedTemporaryFile
+import atexit
 import cmdln
+import functools
 import logging
 import os
 import re
@@ -171,6 +173,7 @@ class ABIChecker(ReviewBot.ReviewBot):
     """
 
     def __init__(self, *args, **kwargs):
+        cache_quota = kwargs.pop('cache_quota', None)
         ReviewBot.ReviewBot.__init__(self, *args, **kwargs)
 
         self.no_review = False
@@ -179,7 +182,8 @@ class ABIChecker(ReviewBot.ReviewBot):
         self.ts = rpm.TransactionSet()
         self.ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
 
-        self.pkgcache = PkgCache(BINCACHE)
+        self.pkgcache = PkgCache(BINCACHE, quota=cache_quota)
+        atexit.register(self.pkgcache.close)
 
         # reports of source submission
         self.reports = []
@@ -760,12 +764,17 @@ class ABIChecker(ReviewBot.ReviewBot):
                 os.unlink(target)
             except:
                 pass
-            self.pkgcache.linkto(key, target)
-        else:
-            osc.core.get_binary_file(self.apiurl, project, repository, arch,
-                            filename, package=package,
-                            target_filename=target)
-            self.pkgcache[key] = target
+            try:
+                self.pkgcache.linkto(key, target)
+                return
+            except KeyError:
+                # Removed from the cache by another process meanwhile.
+                pass
+
+        osc.core.get_binary_file(self.apiurl, project, repository, arch,
+                        filename, package=package,
+                        target_filename=target)
+        self.pkgcache[key] = target
 
     def readRpmHeaderFD(self, fd):
         h = None
@@ -1060,6 +1069,7 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         parser.add_option("--force", action="store_true", help="recheck requests that are already considered done")
         parser.add_option("--no-review", action="store_true", help="don't actually accept or decline, just comment")
         parser.add_option("--web-url", metavar="URL", help="URL of web service")
+        parser.add_option("--cache-quota", metavar="GiB", type="float", help="size limit of the package cache")
         return parser
 
     def postoptparse(self):
@@ -1073,6 +1083,8 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         return ret
 
     def setup_checker(self):
+        if self.options.cache_quota:
+            self.clazz = functools.partial(ABIChecker, cache_quota=int(self.options.cache_quota * 1024 ** 3))
         bot = ReviewBot.CommandLineInterface.setup_checker(self)
 
         if self.options.no_review:
@@ -29,6 +29,8 @@ import urllib2
 import osc.core
 
 import ToolBase
+from osclib.bulk_fetch import bulk_fetch
+from osclib.xmlstream import iterelements
 
 logger = logging.getLogger()
 
@@ -54,15 +56,27 @@ class BiArchTool(ToolBase.ToolBase):
         if package in self._has_baselibs:
             return self._has_baselibs[package]
 
-        ret = False
         files = ET.fromstring(self.cached_GET(self.makeurl(['source', self.project, package])))
+        return self._has_baselibs_files(package, files)
+
+    def _has_baselibs_files(self, package, files):
+        ret = False
         for n in files.findall("./entry[@name='baselibs.conf']"):
             logger.debug('%s has baselibs', package)
             ret = True
-            return True
         self._has_baselibs[package] = ret
         return ret
 
+    def prefetch_baselibs(self, packages):
+        """Look up has_baselibs() for packages concurrently."""
+        urls = {}
+        for package in packages:
+            if package not in self._has_baselibs:
+                urls[self.makeurl(['source', self.project, package])] = package
+
+        for (func, url), files in bulk_fetch([(self.cached_GET, url) for url in urls]):
+            self._has_baselibs_files(urls[url], ET.fromstring(files))
+
     def has_baselibs_recursive(self, package):
         r = self.has_baselibs(package)
         if not r and package in self.rdeps:
@@ -84,8 +98,7 @@ class BiArchTool(ToolBase.ToolBase):
             return
         self.rdeps = dict()
         url = self.makeurl(['build', self.project, 'standard', self.arch, '_builddepinfo' ], {'view':'revpkgnames'})
-        x = ET.fromstring(self.cached_GET(url))
-        for pnode in x.findall('package'):
+        for pnode in iterelements(self.cached_GET(url), 'package'):
             name = pnode.get('name')
             for depnode in pnode.findall('pkgdep'):
                 depname = depnode.text
@@ -187,6 +200,8 @@ class BiArchTool(ToolBase.ToolBase):
 
     def enable_baselibs_packages(self, force=False, wipebinaries=False):
         self._init_biarch_packages()
+        self.prefetch_baselibs([pkg for pkg in self.packages
+                                if pkg not in self.biarch_packages and pkg not in self.whitelist[self.arch]])
         for pkg in self.packages:
             logger.debug("processing %s", pkg)
             pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
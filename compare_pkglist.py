@@ -31,6 +31,7 @@ import osc.conf
 import osc.core
 
 from osc import oscerr
+from osclib.bulk_fetch import prefetch
 
 OPENSUSE = 'openSUSE:Leap:42.2'
 SLE = 'SUSE:SLE-12-SP2:GA'
@@ -90,20 +91,25 @@ class CompareList(object):
         print 'Gathering the package list from %s' % self.new_prj
         new_packages = self.get_source_packages(self.new_prj)
 
+        def compare(pkg):
+            # ignore the second specfile package
+            linked = self.is_linked_package(self.old_prj, pkg)
+            if linked is not None:
+                return False
+            return self.check_diff(pkg, self.old_prj, self.new_prj)
+
+        specs = []
         for pkg in old_packages:
             if pkg not in new_packages:
                 logging.debug('%s is not in %s' % (pkg, self.new_prj))
             else:
-                # ignore the second specfile package
-                linked = self.is_linked_package(self.old_prj, pkg)
-                if linked is not None:
-                    continue
-
-                diff = self.check_diff(pkg, self.old_prj, self.new_prj)
-                if diff is not False:
-                    print '%s/%s has different source than %s' % (self.new_prj, pkg, self.old_prj)
-                    if self.verbose:
-                        print diff
+                specs.append((compare, pkg))
+
+        for (_, pkg), diff in prefetch(specs):
+            if diff is not False:
+                print '%s/%s has different source than %s' % (self.new_prj, pkg, self.old_prj)
+                if self.verbose:
+                    print diff
 
 def main(args):
     # Configure OSC
@@ -67,6 +67,7 @@ Requires:       python-urlgrabber
 
 # Spec related requirements.
 Requires:       osclib = %{version}
+Requires(pre):  shadow
 
 %description
 Tools to aid in staging and release work for openSUSE/SUSE
@@ -122,6 +123,8 @@ BuildArch:      noarch
 # TODO Update requirements, but for now base deps.
 Requires:       %{name} = %{version}
 Requires:       osc
+# Compress cached responses with zstd rather than gzip.
+Recommends:     python-zstandard
 
 %description -n osclib
 Supplemental osc libraries utilized by release tools.
@@ -171,6 +174,13 @@ make check
 # TODO Correct makefile to actually install source.
 mkdir -p %{buildroot}%{_datadir}/%{source_dir}/%{announcer_filename}
 
+%pre
+# Group of the units writing to the node_exporter textfile collector.
+getent group _opensuse.org-metrics > /dev/null || groupadd -r _opensuse.org-metrics
+
+%post
+%tmpfiles_create %{_tmpfilesdir}/%{name}.conf
+
 %pre announcer
 %service_add_pre %{announcer_filename}.service
 
@@ -208,6 +218,7 @@ mkdir -p %{buildroot}%{_datadir}/%{source_dir}/%{announcer_filename}
 %exclude %{_datadir}/%{source_dir}/osc-staging.py
 # Should be in osc package, but ironically it is using its deprecated directory.
 %dir %{osc_plugin_dir}
+%{_tmpfilesdir}/%{name}.conf
 
 %files devel
 %defattr(-,root,root,-)
@@ -254,5 +265,7 @@ mkdir -p %{buildroot}%{_datadir}/%{source_dir}/%{announcer_filename}
 %defattr(-,root,root,-)
 %{_datadir}/%{source_dir}/osc-staging.py
 %{osc_plugin_dir}/osc-staging.py
+%{_unitdir}/osc-staging-cache-warm@.service
+%{_unitdir}/osc-staging-cache-warm@.timer
 
 %changelog
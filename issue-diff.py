@@ -21,6 +21,7 @@ import osc.conf
 import osc.core
 
 from osclib.cache import Cache
+from osclib.bulk_fetch import prefetch
 from osclib.core import package_list
 
 # Issue summary can contain unicode characters and therefore a string containing
@@ -301,15 +302,23 @@ def main(args):
     packages = set(packages_project).intersection(set(packages_factory))
     new = 0
     shuffle(list(packages))
-    for index, package in enumerate(packages, start=1):
-        if index % 50 == 0:
-            print('Checked {} of {}'.format(index, len(packages)))
+
+    def issues_both(package):
+        return (issues_get(apiurl, args.project, package, trackers, db),
+                issues_get(apiurl_default, args.factory, package, trackers, db))
+
+    specs = []
+    for package in packages:
         if package in db and db[package] == 'whitelist':
             print('Skipping package {}'.format(package))
             continue
+        specs.append((issues_both, package))
 
-        issues_project = issues_get(apiurl, args.project, package, trackers, db)
-        issues_factory = issues_get(apiurl_default, args.factory, package, trackers, db)
+    # Issues of the next packages are fetched while the user is prompted.
+    results = prefetch(specs)
+    for index, ((_, package), (issues_project, issues_factory)) in enumerate(results, start=1):
+        if index % 50 == 0:
+            print('Checked {} of {}'.format(index, len(specs)))
 
         missing_from_factory = set(issues_project.keys()) - set(issues_factory.keys())
 
@@ -28,13 +28,15 @@ from xml.etree import cElementTree as ET
 
 import osc.conf
 import osc.core
+import threading
 import urllib2
 import sys
-import time
 import yaml
 from collections import namedtuple
 
+from osclib.bulk_fetch import bulk_fetch
 from osclib.memoize import memoize
+from osclib.retry import Retry
 
 logger = logging.getLogger()
 
@@ -57,6 +59,7 @@ class Manager42(object):
         self.apiurl = osc.conf.config['apiurl']
         self.config = self._load_config(configfh)
         self.force = False
+        self.lookup_lock = threading.Lock()
 
         self.parse_lookup(self.config.from_prj)
         self.fill_package_meta()
@@ -103,9 +106,19 @@ class Manager42(object):
         if self.lookup_changes == 0:
             logger.info('no change to lookup.yml')
             return
-        data = yaml.dump(self.lookup, default_flow_style=False, explicit_start=True)
+        with self.lookup_lock:
+            data = yaml.dump(self.lookup, default_flow_style=False, explicit_start=True)
+            self.lookup_changes = 0
         self._put_lookup_file(self.config.from_prj, data)
-        self.lookup_changes = 0
+
+    def lookup_set(self, package, value):
+        """Change the lookup of package or remove it if value is None."""
+        with self.lookup_lock:
+            if value is None:
+                del self.lookup[package]
+            else:
+                self.lookup[package] = value
+            self.lookup_changes += 1
 
     @memoize()
     def _cached_GET(self, url):
@@ -117,14 +130,7 @@ class Manager42(object):
         return self.retried_GET(url).read()
 
     def retried_GET(self, url):
-        try:
-            return http_GET(url)
-        except urllib2.HTTPError, e:
-            if 500 <= e.code <= 599:
-                logger.warn('Retrying {}'.format(url))
-                time.sleep(1)
-                return self.retried_GET(url)
-            raise e
+        return Retry.request(http_GET, url, log=logger.warning)
 
     def get_source_packages(self, project, expand=False):
         """Return the list of packages in a project."""
@@ -158,13 +164,14 @@ class Manager42(object):
 
         packages = given_packages or self.packages[self.config.from_prj]
 
-        for package in sorted(packages):
+        def check(package):
             try:
                 self.check_one_package(package)
             except urllib2.HTTPError, e:
                 logger.error("Failed to check {}: {}".format(package, e))
-                pass
 
+        # Packages are checked concurrently, see lookup_set().
+        for spec, result in bulk_fetch([(check, package) for package in sorted(packages)]):
             # avoid loosing too much work
             if self.lookup_changes > 50:
                 self.store_lookup()
@@ -219,8 +226,7 @@ class Manager42(object):
         if not package in self.packages[self.config.from_prj]:
             logger.info("{} vanished".format(package))
             if self.lookup.get(package):
-                del self.lookup[package]
-                self.lookup_changes += 1
+                self.lookup_set(package, None)
             return
 
         root = ET.fromstring(self._get_source_package(self.config.from_prj, package, None))
@@ -229,8 +235,7 @@ class Manager42(object):
             lstring = 'subpackage of {}'.format(linked.get('package'))
             if lstring != lproject:
                 logger.warn("{} links to {} (was {})".format(package, linked.get('package'), lproject))
-                self.lookup[package] = lstring
-                self.lookup_changes += 1
+                self.lookup_set(package, lstring)
             else:
                 logger.debug("{} correctly marked as subpackage of {}".format(package, linked.get('package')))
             return
@@ -252,8 +257,7 @@ class Manager42(object):
                 lstring = 'Devel;{};{}'.format(develprj, develpkg)
                 if not package in self.lookup or lstring != self.lookup[package]:
                     logger.debug("{} from devel {}/{} (was {})".format(package, develprj, develpkg, lproject))
-                    self.lookup[package] = lstring
-                    self.lookup_changes += 1
+                    self.lookup_set(package, lstring)
                 else:
                     logger.debug("{} lookup from {}/{} is correct".format(package, develprj, develpkg))
                 return
@@ -280,8 +284,7 @@ class Manager42(object):
                         logger.info('{} is from {} but should come from {}'.format(package, project, lproject))
                     else:
                         logger.info('{} -> {} (was {})'.format(package, project, lproject))
-                        self.lookup[package] = project
-                        self.lookup_changes += 1
+                        self.lookup_set(package, project)
                 else:
                     logger.debug('{} still coming from {}'.format(package, project))
                 foundit = True
@@ -292,8 +295,7 @@ class Manager42(object):
                 logger.debug("{}: lookup is correctly marked as fork".format(package))
             else:
                 logger.info('{} is a fork (was {})'.format(package, lproject))
-                self.lookup[package] = 'FORK'
-                self.lookup_changes += 1
+                self.lookup_set(package, 'FORK')
 
     def get_link(self, project, package):
         try:
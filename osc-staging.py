@@ -34,6 +34,8 @@ from osc import oscerr
 
 from osclib.accept_command import AcceptCommand
 from osclib.adi_command import AdiCommand
+from osclib.cache_stats_command import CacheStatsCommand
+from osclib.cache_warm_command import CacheWarmCommand
 from osclib.check_command import CheckCommand
 from osclib.check_duplicate_binaries_command import CheckDuplicateBinariesCommand
 from osclib.cleanup_rings import CleanupRings
@@ -79,7 +81,7 @@ def _full_project_name(self, project):
 
 def lock_needed(cmd, opts):
     return not(
-        cmd in ('acheck', 'check', 'check_duplicate_binaries', 'frozenage', 'rebuild', 'unlock') or
+        cmd in ('acheck', 'cache_stats', 'cache_warm', 'check', 'check_duplicate_binaries', 'frozenage', 'rebuild', 'unlock') or
         (cmd == 'list' and not opts.supersede)
     )
 
@@ -126,6 +128,9 @@ def clean_args(args):
               help='do not update bootstrap-copy when freezing')
 @cmdln.option('--wipe-cache', dest='wipe_cache', action='store_true', default=False,
               help='wipe GET request cache before executing')
+@cmdln.option('--reset', action='store_true', help='reset the cache statistics')
+@cmdln.option('--threads', type='int', default=CacheWarmCommand.THREADS,
+              help='number of concurrent requests made by cache_warm')
 @cmdln.option('-m', '--message', help='message used by ignore command')
 @cmdln.option('--filter-by', action='append', help='xpath by which to filter requests')
 @cmdln.option('--group-by', action='append', help='xpath by which to group requests')
@@ -157,6 +162,13 @@ def do_staging(self, subcmd, opts, *args):
         source project. When adi stagings are ready the request will be marked
         ready, unstaged, and the adi staging deleted.
 
+    "cache_stats" will print the GET request cache hit and miss counters by
+        pattern and project along with the largest entries and the age
+        distribution of the entries. Use --reset to start counting anew.
+
+    "cache_warm" will fetch the rings, staging projects and dashboard files
+        used by most commands concurrently to fill the GET request cache
+
     "check" will check if all packages are links without changes
 
     "check_duplicate_binaries" list binaries provided by multiple packages
@@ -286,6 +298,8 @@ def do_staging(self, subcmd, opts, *args):
         osc staging accept [--force] [--no-cleanup] [LETTER...]
         osc staging acheck
         osc staging adi [--move] [--by-develproject] [--split] [REQUEST...]
+        osc staging cache_stats [--reset]
+        osc staging cache_warm [--threads THREADS]
         osc staging check [--old] [STAGING...]
         osc staging check_duplicate_binaries
         osc staging cleanup_rings
@@ -337,6 +351,8 @@ def do_staging(self, subcmd, opts, *args):
         min_args, max_args = 1, None
     elif cmd in (
         'acheck',
+        'cache_stats',
+        'cache_warm',
         'check_duplicate_binaries',
         'cleanup_rings',
         'list',
@@ -584,6 +600,10 @@ def do_staging(self, subcmd, opts, *args):
                         .perform(requests, opts.move, opts.from_, opts.no_freeze)
         elif cmd == 'cleanup_rings':
             CleanupRings(api).perform()
+        elif cmd == 'cache_stats':
+            CacheStatsCommand(api).perform(opts.reset)
+        elif cmd == 'cache_warm':
+            CacheWarmCommand(api).perform(opts.threads)
         elif cmd == 'ignore':
             IgnoreCommand(api).perform(args[1:], opts.message)
         elif cmd == 'unignore':
@@ -0,0 +1,98 @@
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import threading
+import urlparse
+
+from osc import conf
+import osc.core
+from osclib.retry import Retry
+
+try:
+    from xml.etree import cElementTree as ET
+except ImportError:
+    import cElementTree as ET
+
+
+THREADS = 8
+# Requests in flight to a single host across all bulk_fetch() calls.
+HOST_LIMIT = 8
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+def _parse_xml(response):
+    return ET.parse(response).getroot()
+
+
+def _host(spec):
+    if isinstance(spec, basestring):
+        return urlparse.urlparse(spec).netloc
+
+    for arg in spec[1:]:
+        if isinstance(arg, basestring) and arg.startswith(('http://', 'https://')):
+            return urlparse.urlparse(arg).netloc
+    # Most calls are made against the configured API.
+    return urlparse.urlparse(conf.config['apiurl']).netloc
+
+
+def _host_semaphore(host):
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = threading.BoundedSemaphore(HOST_LIMIT)
+        return _hosts[host]
+
+
+def _fetch(args):
+    spec, parse = args
+    with _host_semaphore(_host(spec)):
+        if isinstance(spec, basestring):
+            return spec, parse(Retry.request(osc.core.http_GET, spec))
+        return spec, spec[0](*spec[1:])
+
+
+def bulk_fetch(specs, parse=_parse_xml, threads=THREADS):
+    """
+    Fetch specs concurrently and yield (spec, result) as each one completes.
+
+    A spec is either a URL, requested through http_GET() and thus the cache,
+    retried according to Retry and its response passed to parse (by default
+    returning the root of the XML document), or a tuple of a function and its
+    arguments like (get_binarylist, apiurl, project, ...) for the calls that
+    are not a plain GET. Such functions are called as is so they should do
+    their own retrying where needed.
+
+    Requests to one host are limited to HOST_LIMIT at a time across all
+    concurrent bulk_fetch() calls, the host of a function call being that of
+    its first URL argument or the configured API. The first error raised is
+    raised to the caller which stops the remaining fetches.
+    """
+    pool = ThreadPool(threads)
+    try:
+        for result in pool.imap_unordered(_fetch, ((spec, parse) for spec in specs)):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def prefetch(specs, lookahead=THREADS, parse=_parse_xml, threads=THREADS):
+    """
+    Fetch specs like bulk_fetch() but yield (spec, result) in order of specs.
+
+    Only the lookahead specs following the one last yielded are fetched, so
+    a caller that is slow to consume, like one prompting the user, does not
+    have every spec fetched up front.
+    """
+    pool = ThreadPool(min(threads, lookahead))
+    pending = deque()
+    try:
+        for spec in specs:
+            pending.append(pool.apply_async(_fetch, ((spec, parse),)))
+            if len(pending) > lookahead:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
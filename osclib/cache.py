@@ -1,5 +1,8 @@
 from __future__ import print_function
 
+import atexit
+from collections import defaultdict
+from contextlib import contextmanager
 import datetime
 import hashlib
 import os
@@ -7,11 +10,22 @@ import osc.core
 import re
 import shutil
 import sys
+import threading
+import urllib2
 import urlparse
 import urllib
+from httplib import HTTPMessage
 from StringIO import StringIO
 from osc import conf
-from osc.core import urlopen
+from osclib.cache_store import MemoryStore
+from osclib.cache_store import SQLiteStore
+from osclib.cache_store import SingleFlight
+from osclib.cache_store import compress
+from osclib.cache_store import compression_supported
+from osclib.cache_store import decompress_stream
+from osclib.cache_store import zstandard
+from osclib.connection_pool import ConnectionPool
+from osclib.http_metrics import HTTPMetrics
 from time import time
 
 try:
@@ -25,22 +39,54 @@ def http_request(method, url, headers={}, data=None, file=None):
     Wrapper for osc.core.http_request() to provide GET request caching.
     """
 
-    if method == 'GET':
-        ret = Cache.get(url)
-        if ret:
-            return ret
-    else:
+    if method != 'GET':
         # Logically, seems to make more sense after real call, but practically
         # it should not matter and makes the apitests happy when dealing with
         # request acceptance which causes a GET to determine target project.
         Cache.delete(url)
+        return osc.core._http_request(method, url, headers, data, file)
+
+    ret = Cache.get(url)
+    if ret:
+        return ret
+
+    # Only one thread or process fetches a given URL at a time while the others
+    # wait and then read the result from the cache.
+    with Cache.single_flight(url) as waited:
+        if waited:
+            ret = Cache.get(url, coalesced=True)
+            if ret:
+                return ret
+
+        try:
+            return http_request_get(url, headers, data, file)
+        except urllib2.HTTPError as e:
+            if e.code != 404 or e.fp is None or not Cache.match(urllib.unquote(url), negative=True)[0]:
+                raise
+            # Cache the not found response and raise it with a fresh body.
+            raise urllib2.HTTPError(e.url, e.code, e.msg, e.hdrs, Cache.put(url, e, e.code))
+
+
+def http_request_get(url, headers, data, file):
+    # Revalidate an expired entry using the validators from the server rather
+    # than downloading the entire response again.
+    validators = Cache.validators(url)
+    if validators:
+        try:
+            ret = osc.core._http_request('GET', url, dict(headers, **validators), data, file)
+            return Cache.put(url, ret)
+        except urllib2.HTTPError as e:
+            if e.code != 304:
+                raise
+
+        # Entry may have been removed by another process in the meantime in
+        # which case fall through to an unconditional request.
+        ret = Cache.refresh(url)
+        if ret:
+            return ret
 
-    ret = osc.core._http_request(method, url, headers, data, file)
-
-    if method == 'GET':
-        ret = Cache.put(url, ret)
-
-    return ret
+    ret = osc.core._http_request('GET', url, headers, data, file)
+    return Cache.put(url, ret)
 
 
 class Cache(object):
@@ -62,6 +108,33 @@ class Cache(object):
 
     Any paths without a project context will be cleared when updated using this
     cache, but obviously not for other contributors.
+
+    Paths that also provide a package context (second group of the pattern) are
+    tracked per package. Changes to a package only expire the entries of that
+    package and the project level entries (like package lists) of its project
+    rather than the entire project.
+
+    Entries are kept by a storage backend (see osclib.cache_store) which can be
+    replaced by assigning a different class to STORE before first use. Recently
+    used entries are also kept in memory, up to MEMORY_SIZE bytes, to avoid
+    reading the same entries from the backend repeatedly. The memory tier is
+    kept coherent with changes made by this process, but not other processes.
+
+    Responses of at least COMPRESS_THRESHOLD bytes are stored compressed using
+    COMPRESSION (zstd when available, otherwise gzip, or None to disable) and
+    decompressed as they are read.
+
+    Not found responses for PATTERNS_NEGATIVE are cached with their own ttl
+    and expire along with the project just like other entries.
+
+    Concurrent misses for the same URL are coalesced across threads and
+    processes: the first one fetches while the others wait up to
+    SINGLE_FLIGHT_TIMEOUT seconds and then read the stored result.
+
+    Counters (see COUNTERS) are kept per pattern and project and are added to
+    the store when the process exits. They can be inspected using
+    osc staging cache_stats. How each request was served is also reported to
+    HTTPMetrics when enabled.
     """
 
     CACHE_DIR = os.path.expanduser('~/.cache/osc-plugin-factory')
@@ -80,40 +153,111 @@ class Cache(object):
         "/search/project/id\?match=starts-with\(@name,'([^']+)\:'\)$": TTL_DUPLICATE,
         # List of all projects may change, but relevant ones rarely.
         '/source$': TTL_LONG,
-        # Sources will be expired with project, could be done on package level.
+        # Sources will be expired with any package in the project.
         '/source/([^/?]+)(?:\?.*)?$': TTL_LONG,
         # Project will be marked changed when packages are added/removed.
         '/source/([^/]+)/_meta$': TTL_LONG,
-        '/source/([^/]+)/(?:[^/]+)/(?:_meta|_link)$': TTL_LONG,
-        '/source/([^/]+)/dashboard/[^/]+': TTL_LONG,
+        '/source/([^/]+)/([^/]+)/(?:_meta|_link)$': TTL_LONG,
+        '/source/([^/]+)/(dashboard)/[^/]+': TTL_LONG,
         # Handles clearing local cache on package deletes. Lots of queries like
         # updating project info, comment, and package additions.
-        '/source/([^/]+)/(?:[^/?]+)(?:\?[^/]+)?$': TTL_LONG,
+        '/source/([^/]+)/([^/?]+)(?:\?[^/]+)?$': TTL_LONG,
         # Presumably users are not interweaving in short windows.
         '/statistics/latest_updated': TTL_SHORT,
+        # Expensive requests made by several bots in bursts.
+        '/build/([^/]+)/[^/]+/[^/]+/_builddepinfo': TTL_DUPLICATE,
+        '/project/staging_projects/([^/?]+)': TTL_DUPLICATE,
+    }
+    # Paths for which not found responses are cached. Tools probe for packages
+    # and files that frequently do not exist. Set to {} to disable.
+    PATTERNS_NEGATIVE = {
+        '/source/([^/]+)/_meta$': TTL_SHORT,
+        '/source/([^/]+)/([^/]+)/(?:_meta|_link)$': TTL_SHORT,
+        '/source/([^/]+)/([^/]+)/_history(?:\?[^/]+)?$': TTL_SHORT,
+        '/source/([^/]+)/(dashboard)/[^/]+': TTL_SHORT,
+        '/source/([^/]+)/([^/?]+)(?:\?[^/]+)?$': TTL_SHORT,
     }
 
+    # Pseudo packages that represent the project itself.
+    PROJECT_FILES = frozenset(['_attribute', '_config', '_meta', '_project', '_pubkey'])
+
+    STORE = SQLiteStore
+    MEMORY_SIZE = 64 * 1024 * 1024
+    COMPRESSION = 'zstd' if zstandard else 'gzip'
+    COMPRESS_THRESHOLD = 16 * 1024
+    SINGLE_FLIGHT_TIMEOUT = 30
+    # Number of latest_updated records requested for a full and incremental
+    # load and the number of records to retain between processes.
+    LAST_UPDATED_LIMIT = 5000
+    LAST_UPDATED_INCREMENT = 100
+    LAST_UPDATED_HISTORY = 20000
+
+    COUNTERS = (
+        'hit_memory',
+        'hit_store',
+        'miss',
+        'coalesced',
+        'negative',
+        'expired',
+        'invalidated',
+        'revalidated',
+        'bytes_served',
+        'bytes_fetched',
+    )
+
     last_updated = {}
+    store = None
+    memory = None
+    flights = None
+    counters = defaultdict(int)
+    counters_lock = threading.Lock()
 
     @staticmethod
     def init():
         Cache.patterns = []
         for pattern in Cache.PATTERNS:
             Cache.patterns.append(re.compile(pattern))
+        Cache.patterns_negative = []
+        for pattern in Cache.PATTERNS_NEGATIVE:
+            Cache.patterns_negative.append(re.compile(pattern))
 
         # Replace http_request with wrapper function which needs a stored
         # version of the original function to call.
         if not hasattr(osc.core, '_http_request'):
             osc.core._http_request = osc.core.http_request
             osc.core.http_request = http_request
+            atexit.register(Cache.stats_flush)
+
+        # Requests made through the cache reuse connections as well.
+        ConnectionPool.init()
+        HTTPMetrics.init()
+
+    @staticmethod
+    def store_get():
+        if Cache.store is None:
+            Cache.store = Cache.STORE(Cache.CACHE_DIR)
+            Cache.memory = MemoryStore(Cache.MEMORY_SIZE)
+            Cache.flights = SingleFlight(Cache.CACHE_DIR)
+        return Cache.store
 
     @staticmethod
-    def get(url):
+    def get(url, coalesced=False):
+        """
+        Return the cached response for url or None. A cached not found
+        response is raised as HTTPError.
+
+        A coalesced lookup follows a miss after waiting on another fetch of
+        the same url and is counted as such rather than as another request.
+        """
         url = urllib.unquote(url)
-        match, project = Cache.match(url)
+        negative, project_negative, package_negative = Cache.match(url, negative=True)
+        match, project, package = Cache.match(url)
+        if not match:
+            match, project, package = negative, project_negative, package_negative
         if match:
-            path = Cache.path(url, project, include_file=True)
-            ttl = Cache.PATTERNS[match]
+            store = Cache.store_get()
+            ttl = Cache.PATTERNS.get(match) or Cache.PATTERNS_NEGATIVE[match]
+            ttl_negative = Cache.PATTERNS_NEGATIVE.get(negative, 0)
 
             if project:
                 # Given project context check to see if project has been updated
@@ -121,13 +265,10 @@ class Cache(object):
                 apiurl, _ = Cache.spliturl(url)
                 Cache.last_updated_load(apiurl)
 
-                # Use the project last updated timestamp if availabe, otherwise
-                # the oldest record indicates the longest period that can be
-                # guaranteed to have no changes.
-                if project in Cache.last_updated[apiurl]:
-                    unchanged_since = Cache.last_updated[apiurl][project]
-                else:
-                    unchanged_since = Cache.last_updated[apiurl]['__oldest']
+                # Use the project (or package) last updated timestamp if
+                # availabe, otherwise the oldest record indicates the longest
+                # period that can be guaranteed to have no changes.
+                unchanged_since = Cache.unchanged_since(apiurl, project, package)
 
                 now = datetime.datetime.utcnow()
                 unchanged_since = datetime.datetime.strptime(unchanged_since, '%Y-%m-%dT%H:%M:%SZ')
@@ -136,9 +277,9 @@ class Cache(object):
                 # Treat non-existant cache as brand new for the sake of history
                 # span check since it behaves as desired.
                 age = 0
-                directory = Cache.path(url, project)
-                if os.path.exists(directory):
-                    age = time() - os.path.getmtime(directory)
+                mtime = store.project_mtime(Cache.host(url), project, package)
+                if mtime is not None:
+                    age = time() - mtime
 
                 # If history span is shorter than allowed cache life and the age
                 # of the current cache is older than history span with no
@@ -150,57 +291,178 @@ class Cache(object):
                 ttl_delta = datetime.timedelta(seconds=ttl)
                 age_delta = datetime.timedelta(seconds=age)
                 if history_span < ttl_delta and age_delta > history_span:
-                    Cache.delete_project(apiurl, project)
-
-            if os.path.exists(path) and time() - os.path.getmtime(path) <= ttl:
+                    if Cache.delete_package(apiurl, project, package):
+                        Cache.count(match, project, 'invalidated')
+
+            key = Cache.key(url)
+            now = time()
+            fresh = lambda entry: now - entry['mtime'] <= (ttl if entry['status'] == 200 else ttl_negative)
+            entry = Cache.memory.get(key)
+            if entry and fresh(entry):
+                Cache.count(match, project, 'coalesced' if coalesced else 'hit_memory')
+                Cache.count(match, project, 'bytes_served', entry['size'])
+                if conf.config['debug']: print('CACHE_GET', url, '(memory)', file=sys.stderr)
+                return Cache.entry_response(url, entry, match, project)
+
+            entry = store.get(key)
+            if entry and fresh(entry) and compression_supported(entry['encoding']):
+                Cache.count(match, project, 'coalesced' if coalesced else 'hit_store')
+                Cache.count(match, project, 'bytes_served', entry['size'])
+                Cache.memory.put(key, entry)
                 if conf.config['debug']: print('CACHE_GET', url, file=sys.stderr)
-                return urlopen('file://' + path)
+                return Cache.entry_response(url, entry, match, project)
             else:
-                reason = '(' + ('expired' if os.path.exists(path) else 'does not exist') + ')'
+                if not coalesced:
+                    Cache.count(match, project, 'miss')
+                if entry and not coalesced:
+                    Cache.count(match, project, 'expired')
+                reason = '(' + ('expired' if entry else 'does not exist') + ')'
                 if conf.config['debug']: print('CACHE_MISS', url, reason, file=sys.stderr)
 
         return None
 
     @staticmethod
-    def put(url, data):
+    @contextmanager
+    def single_flight(url):
+        """
+        Hold the fetch lock for url while within the context and yield True if
+        another thread or process held it in the meantime.
+        """
         url = urllib.unquote(url)
-        match, project = Cache.match(url)
+        if not Cache.match(url)[0]:
+            # Nothing will be stored for others to read.
+            yield False
+            return
+
+        Cache.store_get()
+        with Cache.flights.acquire(Cache.key(url), Cache.SINGLE_FLIGHT_TIMEOUT) as waited:
+            yield waited
+
+    @staticmethod
+    def validators(url):
+        """
+        Return conditional request headers for an expired entry or an empty
+        dictionary if the entry does not exist or has no validators.
+        """
+        url = urllib.unquote(url)
+        match, project, package = Cache.match(url)
+        headers = {}
         if match:
-            path = Cache.path(url, project, include_file=True, makedirs=True)
+            entry = Cache.store_get().get(Cache.key(url))
+            if entry:
+                if entry['etag']:
+                    headers['If-None-Match'] = entry['etag']
+                if entry['last_modified']:
+                    headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    @staticmethod
+    def refresh(url):
+        """Restart the time to live of an entry the server indicated is unchanged."""
+        url = urllib.unquote(url)
+        key = Cache.key(url)
+        store = Cache.store_get()
+        entry = store.get(key)
+        if entry is None or entry['status'] != 200 or not compression_supported(entry['encoding']):
+            return None
+
+        if conf.config['debug']: print('CACHE_REFRESH', url, file=sys.stderr)
+        Cache.count(entry['pattern'], entry['project'], 'revalidated')
+        Cache.count(entry['pattern'], entry['project'], 'bytes_served', entry['size'])
+        HTTPMetrics.cache_status('revalidated', entry['size'])
+        mtime = time()
+        store.touch(key, mtime)
+        Cache.memory.put(key, entry)
+        Cache.memory.touch(key, mtime)
+        return Cache.entry_stream(entry)
+
+    @staticmethod
+    def entry_response(url, entry, pattern, project):
+        HTTPMetrics.cache_status('hit', entry['size'])
+        stream = Cache.entry_stream(entry)
+        if entry['status'] != 200:
+            Cache.count(pattern, project, 'negative')
+            raise urllib2.HTTPError(url, entry['status'], 'Not Found (cached)',
+                                    HTTPMessage(StringIO()), stream)
+        return stream
+
+    @staticmethod
+    def entry_stream(entry):
+        if entry['encoding'] is None:
+            return StringIO(str(entry['data']))
+        return decompress_stream(str(entry['data']), entry['encoding'])
+
+    @staticmethod
+    def put(url, data, status=200):
+        """
+        Store the response data, or the body of a not found error, for url and
+        return a stream of the data.
+        """
+        url = urllib.unquote(url)
+        match, project, package = Cache.match(url, negative=status != 200)
+        if match:
+            # Validators are only available on real responses and not when
+            # data has already been wrapped.
+            etag = last_modified = None
+            if hasattr(data, 'info') and status == 200:
+                info = data.info()
+                etag = info.getheader('ETag')
+                last_modified = info.getheader('Last-Modified')
 
             # Since urlopen does not return a seekable stream it cannot be reset
-            # after writing to cache. As such a wrapper must be used. This could
-            # be replaced with urlopen('file://...') to be consistent, but until
-            # the need arrises StringIO has less overhead.
+            # after writing to cache. As such a wrapper must be used.
             text = data.read()
             data = StringIO(text)
 
             if conf.config['debug']: print('CACHE_PUT', url, project, file=sys.stderr)
-            f = open(path,'w')
-            f.write(text)
-            f.close()
+            Cache.count(match, project, 'bytes_fetched', len(text))
+            HTTPMetrics.cache_status('miss', len(text))
+            encoding = Cache.COMPRESSION if len(text) >= Cache.COMPRESS_THRESHOLD else None
+            key = Cache.key(url)
+            entry = {
+                'host': Cache.host(url),
+                'project': project,
+                'package': package,
+                'status': status,
+                'mtime': time(),
+                'etag': etag,
+                'last_modified': last_modified,
+                'encoding': encoding,
+                'size': len(text),
+                'data': compress(text, encoding),
+            }
+            Cache.store_get().put(key, url, entry['host'], project, package, match,
+                                  entry['mtime'], entry['data'], etag, last_modified,
+                                  len(text), encoding, status)
+            Cache.memory.put(key, entry)
 
         return data
 
     @staticmethod
     def delete(url):
         url = urllib.unquote(url)
-        match, project = Cache.match(url)
+        match, project, package = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
-
             # Rather then wait for last updated statistics to expire, remove the
-            # project cache if applicable.
+            # project or package cache if applicable.
             if project:
                 apiurl, _ = Cache.spliturl(url)
                 if project.isdigit():
-                    # Clear target project cache upon request acceptance.
-                    project = osc.core.get_request(apiurl, project).actions[0].tgt_project
-                Cache.delete_project(apiurl, project)
+                    # Clear target package cache upon request acceptance.
+                    for action in osc.core.get_request(apiurl, project).actions:
+                        if action.tgt_package:
+                            Cache.delete_package(apiurl, action.tgt_project, action.tgt_package)
+                        else:
+                            Cache.delete_project(apiurl, action.tgt_project)
+                elif package:
+                    Cache.delete_package(apiurl, project, package)
+                else:
+                    Cache.delete_project(apiurl, project)
 
-            if os.path.exists(path):
+            key = Cache.key(url)
+            Cache.memory.delete(key)
+            if Cache.store_get().delete(key):
                 if conf.config['debug']: print('CACHE_DELETE', url, file=sys.stderr)
-                os.remove(path)
 
         # Also delete version without query. This does not handle other
         # variations using different query strings. Handy for PUT with ?force=1.
@@ -211,26 +473,87 @@ class Cache(object):
 
     @staticmethod
     def delete_project(apiurl, project):
-        path = Cache.path(apiurl, project)
-
-        if os.path.exists(path):
+        host = Cache.host(apiurl)
+        Cache.store_get()
+        Cache.memory.delete_project(host, project)
+        if Cache.store.delete_project(host, project):
             if conf.config['debug']: print('CACHE_DELETE_PROJECT', apiurl, project, file=sys.stderr)
-            shutil.rmtree(path)
+
+    @staticmethod
+    def delete_package(apiurl, project, package):
+        """
+        Delete the entries of package along with the project level entries of
+        project which may include information about the package. If package is
+        None only the project level entries are deleted.
+        """
+        store = Cache.store_get()
+        host = Cache.host(apiurl)
+        with store.transaction():
+            Cache.memory.delete_package(host, project, None)
+            count = store.delete_package(host, project, None)
+            if package:
+                Cache.memory.delete_package(host, project, package)
+                count += store.delete_package(host, project, package)
+
+        if count:
+            if conf.config['debug']: print('CACHE_DELETE_PACKAGE', apiurl, project, package, file=sys.stderr)
+        return count
 
     @staticmethod
     def delete_all():
+        if Cache.store is not None:
+            Cache.store.close()
+            Cache.store = None
+            Cache.memory = None
+            Cache.flights.close()
+            Cache.flights = None
+
         if os.path.exists(Cache.CACHE_DIR):
             shutil.rmtree(Cache.CACHE_DIR)
 
     @staticmethod
-    def match(url):
+    def count(pattern, project, name, value=1):
+        with Cache.counters_lock:
+            Cache.counters[(pattern, project, name)] += value
+
+    @staticmethod
+    def stats():
+        """Return hit and miss counts per tier for this process."""
+        totals = defaultdict(int)
+        with Cache.counters_lock:
+            for (pattern, project, name), value in Cache.counters.items():
+                totals[name] += value
+
+        return {
+            'memory': {'hits': totals['hit_memory'], 'misses': totals['hit_store'] + totals['miss']},
+            'store': {'hits': totals['hit_store'], 'misses': totals['miss']},
+        }
+
+    @staticmethod
+    def stats_flush():
+        """Add the counters of this process to those persisted in the store."""
+        with Cache.counters_lock:
+            counters = dict(Cache.counters)
+            Cache.counters.clear()
+
+        if counters:
+            store = Cache.store_get()
+            with store.transaction():
+                store.stats_add(counters)
+
+    @staticmethod
+    def match(url, negative=False):
         apiurl, path = Cache.spliturl(url)
-        for pattern in Cache.patterns:
+        for pattern in (Cache.patterns_negative if negative else Cache.patterns):
             match = pattern.match(path)
             if match:
-                return (pattern.pattern,
-                        match.group(1) if len(match.groups()) > 0 else None)
-        return (False, None)
+                groups = match.groups()
+                project = groups[0] if len(groups) > 0 else None
+                package = groups[1] if len(groups) > 1 else None
+                if package in Cache.PROJECT_FILES:
+                    package = None
+                return (pattern.pattern, project, package)
+        return (False, None, None)
 
     @staticmethod
     def spliturl(url):
@@ -240,39 +563,125 @@ class Cache(object):
         return (apiurl, path)
 
     @staticmethod
-    def path(url, project, include_file=False, makedirs=False):
-        parts = [Cache.CACHE_DIR]
+    def host(url):
+        return urlparse.urlsplit(url).hostname
 
-        o = urlparse.urlsplit(url)
-        parts.append(o.hostname)
-
-        if project:
-            parts.append(project)
-
-        directory = os.path.join(*parts)
-        if not os.path.exists(directory) and makedirs:
-            os.makedirs(directory)
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url).hexdigest()
 
-        if include_file:
-            parts.append(hashlib.sha1(url).hexdigest())
-            return os.path.join(*parts)
+    @staticmethod
+    def unchanged_since(apiurl, project, package=None):
+        """
+        Return the timestamp since which project (or package) is known to be
+        unchanged. A package is unchanged unless either the package or the
+        project itself (not other packages) was updated.
+        """
+        last_updated = Cache.last_updated[apiurl]
+        if package is None:
+            return last_updated.get(project, last_updated['__oldest'])
+
+        updated = [last_updated.get(name) for name in
+                   (Cache.last_updated_name(project, package),
+                    Cache.last_updated_name(project, '_project'))]
+        updated = [timestamp for timestamp in updated if timestamp]
+        return max(updated) if updated else last_updated['__oldest']
 
-        return directory
+    @staticmethod
+    def last_updated_name(project, package):
+        return '/'.join([project, package])
 
     @staticmethod
     def last_updated_load(apiurl):
+        """
+        Load the latest_updated statistics for apiurl.
+
+        The parsed statistics are persisted along with a watermark (the newest
+        timestamp seen) so that later processes only need to fetch the entries
+        newer than the watermark, or nothing at all if checked within the
+        latest_updated TTL. The persisted history is bounded to
+        LAST_UPDATED_HISTORY records and __oldest is moved forward as records
+        are dropped so that it still marks the span with complete information.
+        """
         if apiurl in Cache.last_updated:
             return
 
-        url = osc.core.makeurl(apiurl, ['statistics', 'latest_updated'], {'limit': 5000})
+        store = Cache.store_get()
+        host = Cache.host(apiurl)
+        watermark = store.watermark_get(host)
+        if watermark is None or time() - watermark['checked'] > Cache.TTL_SHORT:
+            watermark = Cache.last_updated_update(apiurl, host, watermark)
+
+        last_updated = store.last_updated_get(host)
+
+        last_updated['__oldest'] = watermark['oldest']
+        Cache.last_updated[apiurl] = last_updated
+
+    @staticmethod
+    def last_updated_update(apiurl, host, watermark):
+        store = Cache.store_get()
+        limit = Cache.LAST_UPDATED_INCREMENT if watermark else Cache.LAST_UPDATED_LIMIT
+        reset = False
+        while True:
+            last_updated, newest, oldest, count = Cache.last_updated_fetch(apiurl, limit)
+
+            # Complete history was returned or the watermark was reached.
+            complete = count < limit
+            if watermark and (complete or oldest <= watermark['updated']):
+                break
+
+            if limit >= Cache.LAST_UPDATED_LIMIT:
+                # Unable to bridge the gap to the watermark so start over.
+                reset = True
+                break
+
+            limit = min(limit * 10, Cache.LAST_UPDATED_LIMIT)
+
+        if not reset:
+            oldest = watermark['oldest']
+            newest = newest or watermark['updated']
+        elif oldest is None:
+            # Without any history nothing can be guaranteed.
+            oldest = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        with store.transaction():
+            if reset:
+                store.last_updated_reset(host)
+            store.last_updated_merge(host, last_updated)
+            dropped = store.last_updated_trim(host, Cache.LAST_UPDATED_HISTORY)
+            if dropped and dropped > oldest:
+                oldest = dropped
+
+            store.watermark_set(host, newest, oldest, time())
+
+        return store.watermark_get(host)
+
+    @staticmethod
+    def last_updated_fetch(apiurl, limit):
+        url = osc.core.makeurl(apiurl, ['statistics', 'latest_updated'], {'limit': limit})
         root = ET.parse(osc.core.http_GET(url)).getroot()
         last_updated = {}
+        newest = oldest = None
+        count = 0
         for entity in root:
-            # Entities repesent either a project or package.
-            key = 'name' if entity.tag == 'project' else 'project'
-            if entity.attrib[key] not in last_updated:
-                last_updated[entity.attrib[key]] = entity.attrib['updated']
+            # Entities repesent either a project or package. Track the project
+            # as a whole in addition to the individual package or the project
+            # itself (as the _project pseudo package).
+            if entity.tag == 'project':
+                project = entity.attrib['name']
+                package = '_project'
+            else:
+                project = entity.attrib['project']
+                package = entity.attrib['name']
 
-        # Keep track of the last entry to indicate the covered timespan.
-        last_updated['__oldest'] = entity.attrib['updated']
-        Cache.last_updated[apiurl] = last_updated
+            for name in (project, Cache.last_updated_name(project, package)):
+                if name not in last_updated:
+                    last_updated[name] = entity.attrib['updated']
+
+            # Keep track of the first and last entry to indicate the covered timespan.
+            if newest is None:
+                newest = entity.attrib['updated']
+            oldest = entity.attrib['updated']
+            count += 1
+
+        return last_updated, newest, oldest, count
@@ -0,0 +1,120 @@
+from __future__ import print_function
+
+from collections import defaultdict
+import time
+
+from osclib.cache import Cache
+
+
+class CacheStatsCommand(object):
+    AGE_BUCKETS = [
+        ('5m', 5 * 60),
+        ('1h', 60 * 60),
+        ('12h', 12 * 60 * 60),
+        ('1d', 24 * 60 * 60),
+        ('1w', 7 * 24 * 60 * 60),
+    ]
+    LIMIT = 10
+
+    def __init__(self, api):
+        self.api = api
+
+    def perform(self, reset=False):
+        """
+        Print the cache counters, the largest entries and the age distribution.
+        """
+        # Include the requests made by this process.
+        Cache.stats_flush()
+        store = Cache.store_get()
+
+        if reset:
+            with store.transaction():
+                store.stats_reset()
+            print('cache statistics reset')
+            return
+
+        totals = defaultdict(int)
+        patterns = defaultdict(lambda: defaultdict(int))
+        projects = defaultdict(lambda: defaultdict(int))
+        for pattern, project, name, value in store.stats_get():
+            totals[name] += value
+            patterns[pattern][name] += value
+            projects[project][name] += value
+
+        print('counters:')
+        for name in Cache.COUNTERS:
+            print('  {:<14} {:>12}'.format(name, self.format(name, totals[name])))
+        print('  {:<14} {:>12}'.format('hit ratio', self.ratio(totals)))
+
+        print('\nby pattern:')
+        self.print_breakdown(patterns)
+
+        print('\nby project (top {}):'.format(self.LIMIT))
+        top = sorted(projects.items(), key=lambda item: self.requests(item[1]), reverse=True)
+        self.print_breakdown(dict(top[:self.LIMIT]))
+
+        count, size, stored_size = store.entries_summary()
+        print('\nentries: {} using {} ({} stored)'.format(
+            count, self.format_bytes(size), self.format_bytes(stored_size)))
+
+        print('\nlargest entries:')
+        for url, size, stored_size, mtime in store.entries_largest(self.LIMIT):
+            print('  {:>10} {:>10}  {}'.format(
+                self.format_bytes(size), self.format_bytes(stored_size), url))
+
+        print('\nage distribution:')
+        self.print_ages(store.entries_mtime())
+
+    def print_breakdown(self, groups):
+        for key, counters in sorted(groups.items(), key=lambda item: item[0]):
+            print('  {}'.format(key if key else '(none)'))
+            print('    requests {}, hit ratio {}, served {}, fetched {}'.format(
+                self.requests(counters), self.ratio(counters),
+                self.format_bytes(counters['bytes_served']),
+                self.format_bytes(counters['bytes_fetched'])))
+
+    def print_ages(self, entries):
+        now = time.time()
+        buckets = [[0, 0] for i in range(len(self.AGE_BUCKETS) + 1)]
+        for mtime, stored_size in entries:
+            age = now - mtime
+            for i, (label, seconds) in enumerate(self.AGE_BUCKETS):
+                if age < seconds:
+                    break
+            else:
+                i = len(self.AGE_BUCKETS)
+            buckets[i][0] += 1
+            buckets[i][1] += stored_size or 0
+
+        labels = ['<' + label for label, seconds in self.AGE_BUCKETS]
+        labels.append('>=' + self.AGE_BUCKETS[-1][0])
+        for label, (count, stored_size) in zip(labels, buckets):
+            print('  {:<6} {:>8} {:>10}'.format(label, count, self.format_bytes(stored_size)))
+
+    @staticmethod
+    def requests(counters):
+        return counters['hit_memory'] + counters['hit_store'] + counters['miss']
+
+    @staticmethod
+    def ratio(counters):
+        requests = CacheStatsCommand.requests(counters)
+        if not requests:
+            return '-'
+        hits = (counters['hit_memory'] + counters['hit_store'] +
+                counters['coalesced'] + counters['revalidated'])
+        return '{:.1%}'.format(float(hits) / requests)
+
+    @staticmethod
+    def format(name, value):
+        if name.startswith('bytes_'):
+            return CacheStatsCommand.format_bytes(value)
+        return str(value)
+
+    @staticmethod
+    def format_bytes(size):
+        size = float(size or 0)
+        for unit in ('B', 'KiB', 'MiB', 'GiB'):
+            if size < 1024 or unit == 'GiB':
+                break
+            size /= 1024
+        return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{:.0f} B'.format(size)
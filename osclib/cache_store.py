@@ -0,0 +1,598 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import errno
+import fcntl
+import io
+import os
+import sqlite3
+import threading
+from time import sleep
+from time import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Size of the chunks in which compressed entries are decompressed on read.
+CHUNK_SIZE = 64 * 1024
+
+
+def compression_supported(encoding):
+    return encoding in (None, 'gzip') or (encoding == 'zstd' and zstandard is not None)
+
+
+def compress(data, encoding):
+    """Compress data using encoding (None, gzip or zstd)."""
+    if encoding is None:
+        return data
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+
+    # Use the gzip container so the data can be inspected with standard tools.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_stream(data, encoding):
+    """Return a file object that decompresses data as it is read."""
+    if encoding is None:
+        return io.BytesIO(data)
+    if encoding == 'zstd':
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return io.BufferedReader(DecompressReader(io.BytesIO(data), decompressor), CHUNK_SIZE)
+
+
+class DecompressReader(io.RawIOBase):
+    """Raw stream feeding chunks of fileobj through a zlib style decompressor."""
+
+    def __init__(self, fileobj, decompressor):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            chunk = self.fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                if hasattr(self.decompressor, 'flush'):
+                    self.buffer = self.decompressor.flush() or b''
+                    self.decompressor = None
+                break
+            self.buffer = self.decompressor.decompress(chunk)
+
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+class CacheStore(object):
+    """
+    Storage backend interface used by osclib.cache.Cache.
+
+    Entries are keyed by the hash of the URL and carry the host, project,
+    package, modification time and size of the cached response as well as the
+    validators (ETag and Last-Modified) returned by the server. Data is stored
+    as given along with its encoding (see compress()) and both the raw size and
+    stored size are recorded. Backends are selected by assigning a subclass to
+    Cache.STORE.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, key):
+        """Return the entry for key (with data, mtime, ... attributes) or None."""
+        raise NotImplementedError()
+
+    def put(self, key, url, host, project, package, pattern, mtime, data,
+            etag=None, last_modified=None, size=None, encoding=None, status=200):
+        """Store data of the response, or the error body if status is not 200."""
+        raise NotImplementedError()
+
+    def touch(self, key, mtime):
+        """Update the modification time of an entry that was revalidated."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Delete entry for key and return True if one existed."""
+        raise NotImplementedError()
+
+    def delete_project(self, host, project):
+        """Delete all entries for project and return the number deleted."""
+        raise NotImplementedError()
+
+    def delete_package(self, host, project, package):
+        """
+        Delete all entries for package, or the project level entries if package
+        is None, and return the number deleted.
+        """
+        raise NotImplementedError()
+
+    def project_mtime(self, host, project, package=None):
+        """
+        Return the most recent modification time of any entry for package, or
+        of the project level entries if package is None.
+        """
+        raise NotImplementedError()
+
+    @contextmanager
+    def transaction(self):
+        """Group several operations so they are applied atomically."""
+        yield
+
+    def watermark_get(self, host):
+        """
+        Return the latest_updated watermark for host as a dictionary containing
+        updated (newest timestamp seen), oldest (start of the covered history)
+        and checked (when the server was last queried) or None.
+        """
+        raise NotImplementedError()
+
+    def watermark_set(self, host, updated, oldest, checked):
+        raise NotImplementedError()
+
+    def last_updated_get(self, host):
+        """Return the persisted latest_updated map of host."""
+        raise NotImplementedError()
+
+    def last_updated_merge(self, host, last_updated):
+        """Merge last_updated map into the persisted one keeping the newest."""
+        raise NotImplementedError()
+
+    def last_updated_trim(self, host, limit):
+        """
+        Drop all but the newest limit records and return the newest timestamp
+        dropped or None.
+        """
+        raise NotImplementedError()
+
+    def last_updated_reset(self, host):
+        raise NotImplementedError()
+
+    def stats_add(self, counters):
+        """Add counters keyed by (pattern, project, name) to the persisted ones."""
+        raise NotImplementedError()
+
+    def stats_get(self):
+        """Return the persisted counters as (pattern, project, name, value) rows."""
+        raise NotImplementedError()
+
+    def stats_reset(self):
+        raise NotImplementedError()
+
+    def entries_summary(self):
+        """Return the number of entries, the raw size and the stored size."""
+        raise NotImplementedError()
+
+    def entries_largest(self, limit):
+        """Return the limit largest entries with url, size, stored_size and mtime."""
+        raise NotImplementedError()
+
+    def entries_mtime(self):
+        """Return (mtime, stored_size) of all entries."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class SQLiteStore(CacheStore):
+    """
+    Store all cache entries in a single SQLite database in WAL mode.
+
+    WAL allows readers to continue while another process writes so multiple
+    bots on the same host can share the cache without blocking each other. All
+    lookups and project invalidations are indexed.
+    """
+
+    FILENAME = 'cache.db'
+    # Bump when the schema changes, the cache is then recreated from scratch.
+    SCHEMA_VERSION = 7
+    SCHEMA = [
+        """CREATE TABLE entry (
+            key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            host TEXT NOT NULL,
+            project TEXT,
+            package TEXT,
+            pattern TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            encoding TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            data BLOB NOT NULL
+        )""",
+        'CREATE INDEX entry_project ON entry (host, project, package, mtime)',
+        'CREATE INDEX entry_pattern ON entry (pattern)',
+        'CREATE INDEX entry_size ON entry (size)',
+        """CREATE TABLE last_updated (
+            host TEXT NOT NULL,
+            name TEXT NOT NULL,
+            updated TEXT NOT NULL,
+            PRIMARY KEY (host, name)
+        )""",
+        'CREATE INDEX last_updated_updated ON last_updated (host, updated)',
+        """CREATE TABLE watermark (
+            host TEXT PRIMARY KEY,
+            updated TEXT,
+            oldest TEXT NOT NULL,
+            checked REAL NOT NULL
+        )""",
+        """CREATE TABLE stats (
+            pattern TEXT NOT NULL,
+            project TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (pattern, project, name)
+        )""",
+    ]
+    TIMEOUT = 60
+
+    def __init__(self, directory):
+        super(SQLiteStore, self).__init__(directory)
+        self.path = os.path.join(directory, self.FILENAME)
+        self.local = threading.local()
+
+    def connection(self):
+        # Connections cannot be shared between threads nor survive a fork.
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None and self.local.pid == os.getpid():
+            return conn
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        conn = sqlite3.connect(self.path, timeout=self.TIMEOUT, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = str
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self.schema_ensure(conn)
+
+        self.local.conn = conn
+        self.local.pid = os.getpid()
+        return conn
+
+    def schema_ensure(self, conn):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == self.SCHEMA_VERSION:
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have won the race to create the schema.
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+                for table in tables:
+                    conn.execute('DROP TABLE IF EXISTS {}'.format(table[0]))
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+                conn.execute('PRAGMA user_version = {}'.format(self.SCHEMA_VERSION))
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, key):
+        return self.connection().execute(
+            'SELECT * FROM entry WHERE key = ?', (key,)).fetchone()
+
+    def put(self, key, url, host, project, package, pattern, mtime, data,
+            etag=None, last_modified=None, size=None, encoding=None, status=200):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO entry '
+            '(key, url, host, project, package, pattern, status, mtime, size, stored_size, '
+            'encoding, etag, last_modified, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, url, host, project, package, pattern, status, mtime,
+             len(data) if size is None else size, len(data), encoding,
+             etag, last_modified, sqlite3.Binary(data)))
+
+    def touch(self, key, mtime):
+        self.connection().execute('UPDATE entry SET mtime = ? WHERE key = ?', (mtime, key))
+
+    def delete(self, key):
+        cursor = self.connection().execute('DELETE FROM entry WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def delete_project(self, host, project):
+        cursor = self.connection().execute(
+            'DELETE FROM entry WHERE host = ? AND project = ?', (host, project))
+        return cursor.rowcount
+
+    def delete_package(self, host, project, package):
+        cursor = self.connection().execute(
+            'DELETE FROM entry WHERE host = ? AND project = ? AND package IS ?',
+            (host, project, package))
+        return cursor.rowcount
+
+    def project_mtime(self, host, project, package=None):
+        return self.connection().execute(
+            'SELECT MAX(mtime) FROM entry WHERE host = ? AND project = ? AND package IS ?',
+            (host, project, package)).fetchone()[0]
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        # Nested transactions simply join the outer one.
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        try:
+            if depth:
+                yield
+                return
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            self.local.depth = depth
+
+    def watermark_get(self, host):
+        row = self.connection().execute(
+            'SELECT updated, oldest, checked FROM watermark WHERE host = ?', (host,)).fetchone()
+        return dict(row) if row else None
+
+    def watermark_set(self, host, updated, oldest, checked):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO watermark (host, updated, oldest, checked) VALUES (?, ?, ?, ?)',
+            (host, updated, oldest, checked))
+
+    def last_updated_get(self, host):
+        return dict(self.connection().execute(
+            'SELECT name, updated FROM last_updated WHERE host = ?', (host,)).fetchall())
+
+    def last_updated_merge(self, host, last_updated):
+        conn = self.connection()
+        for name, updated in last_updated.items():
+            # Insert unless a newer timestamp is already known.
+            conn.execute(
+                'INSERT OR REPLACE INTO last_updated (host, name, updated) '
+                'SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM last_updated '
+                'WHERE host = ? AND name = ? AND updated >= ?)',
+                (host, name, updated, host, name, updated))
+
+    def last_updated_trim(self, host, limit):
+        conn = self.connection()
+        row = conn.execute(
+            'SELECT updated FROM last_updated WHERE host = ? ORDER BY updated DESC LIMIT 1 OFFSET ?',
+            (host, limit)).fetchone()
+        if row is None:
+            return None
+
+        conn.execute(
+            'DELETE FROM last_updated WHERE host = ? AND name IN (SELECT name FROM last_updated '
+            'WHERE host = ? ORDER BY updated DESC LIMIT -1 OFFSET ?)', (host, host, limit))
+        return row[0]
+
+    def last_updated_reset(self, host):
+        self.connection().execute('DELETE FROM last_updated WHERE host = ?', (host,))
+
+    def stats_add(self, counters):
+        conn = self.connection()
+        for (pattern, project, name), value in counters.items():
+            # Project is part of the primary key which does not play well with NULL.
+            key = (pattern, project or '', name)
+            conn.execute('INSERT OR IGNORE INTO stats (pattern, project, name, value) '
+                         'VALUES (?, ?, ?, 0)', key)
+            conn.execute('UPDATE stats SET value = value + ? '
+                         'WHERE pattern = ? AND project = ? AND name = ?', (value,) + key)
+
+    def stats_get(self):
+        return [(pattern, project or None, name, value) for pattern, project, name, value in
+                self.connection().execute('SELECT pattern, project, name, value FROM stats')]
+
+    def stats_reset(self):
+        self.connection().execute('DELETE FROM stats')
+
+    def entries_summary(self):
+        count, size, stored_size = self.connection().execute(
+            'SELECT COUNT(*), SUM(size), SUM(stored_size) FROM entry').fetchone()
+        return count, size or 0, stored_size or 0
+
+    def entries_largest(self, limit):
+        return self.connection().execute(
+            'SELECT url, size, stored_size, mtime FROM entry ORDER BY size DESC LIMIT ?',
+            (limit,)).fetchall()
+
+    def entries_mtime(self):
+        return self.connection().execute('SELECT mtime, stored_size FROM entry').fetchall()
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+class MemoryStore(object):
+    """
+    Bounded in-process LRU tier kept in front of a CacheStore.
+
+    Entries are plain dictionaries with the same fields as the persistent
+    store and hold the data as stored (possibly compressed). The total size
+    of the cached data is limited to max_bytes and the least recently used
+    entries are evicted first. An index by project allows project and package
+    invalidation without scanning all entries.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.projects = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def put(self, key, entry):
+        # Copy the fields to avoid holding on to database rows.
+        entry = {name: entry[name] for name in
+                 ('host', 'project', 'package', 'status', 'mtime', 'etag', 'last_modified',
+                  'encoding', 'size', 'data')}
+        entry['data'] = str(entry['data'])
+        with self.lock:
+            self._delete(key)
+            if len(entry['data']) > self.max_bytes:
+                return
+
+            self.entries[key] = entry
+            self.bytes += len(entry['data'])
+            self.projects.setdefault((entry['host'], entry['project']), set()).add(key)
+
+            while self.bytes > self.max_bytes:
+                self._delete(next(iter(self.entries)))
+
+    def touch(self, key, mtime):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key]['mtime'] = mtime
+
+    def delete(self, key):
+        with self.lock:
+            self._delete(key)
+
+    def delete_project(self, host, project):
+        with self.lock:
+            for key in list(self.projects.get((host, project), [])):
+                self._delete(key)
+
+    def delete_package(self, host, project, package):
+        with self.lock:
+            for key in list(self.projects.get((host, project), [])):
+                if self.entries[key]['package'] == package:
+                    self._delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.projects.clear()
+            self.bytes = 0
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.bytes -= len(entry['data'])
+        keys = self.projects[(entry['host'], entry['project'])]
+        keys.discard(key)
+        if not keys:
+            del self.projects[(entry['host'], entry['project'])]
+
+
+class SingleFlight(object):
+    """
+    Serialize work on the same key across threads and processes.
+
+    A single byte of a shared lock file is locked per key using fcntl record
+    locks which the kernel releases should the holder die. Record locks are
+    owned by the process so threads are first serialized by an in-process lock
+    per byte, otherwise two threads with keys sharing a byte would both hold
+    the record lock and the first done would release it for the other.
+    Distinct keys may share a byte which merely serializes them.
+    """
+
+    FILENAME = 'flight.lock'
+    # Number of bytes among which the keys are spread.
+    RANGE = 2 ** 24
+    POLL = 0.05
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILENAME)
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.fd = None
+        self.pid = None
+
+    def file(self):
+        # Closing any descriptor of the file would release all record locks of
+        # the process so a single descriptor is kept open.
+        with self.lock:
+            if self.pid != os.getpid():
+                if not os.path.exists(self.directory):
+                    os.makedirs(self.directory)
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self.pid = os.getpid()
+            return self.fd
+
+    @contextmanager
+    def acquire(self, key, timeout):
+        """
+        Hold the lock for the hex digest key for the duration of the context.
+
+        Yields True if the lock was held by another thread or process in the
+        meantime, which presumably did the work. After waiting for timeout
+        seconds the context is entered without holding the lock.
+        """
+        offset = int(key[:8], 16) % self.RANGE
+        with self.lock:
+            local = self.locks.setdefault(offset, [threading.Lock(), 0])
+            local[1] += 1
+
+        deadline = time() + timeout
+        held_file = False
+        held_local, waited = self._wait(lambda: local[0].acquire(False), deadline)
+        if held_local:
+            held_file, waited_file = self._wait(lambda: self._lockf(offset), deadline)
+            waited = waited or waited_file
+
+        try:
+            yield waited
+        finally:
+            if held_file:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offset)
+            if held_local:
+                local[0].release()
+            with self.lock:
+                local[1] -= 1
+                if not local[1]:
+                    del self.locks[offset]
+
+    def _wait(self, attempt, deadline):
+        waited = False
+        while not attempt():
+            waited = True
+            if time() >= deadline:
+                return False, waited
+            sleep(self.POLL)
+        return True, waited
+
+    def _lockf(self, offset):
+        try:
+            fcntl.lockf(self.file(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+        except IOError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        return True
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None and self.pid == os.getpid():
+                os.close(self.fd)
+            self.fd = None
+            self.pid = None
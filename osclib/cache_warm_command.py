@@ -0,0 +1,88 @@
+from __future__ import print_function
+
+from multiprocessing.pool import ThreadPool
+import sys
+import urllib2
+
+from osc import conf
+from osc.core import http_GET
+
+try:
+    from xml.etree import cElementTree as ET
+except ImportError:
+    import cElementTree as ET
+
+
+class CacheWarmCommand(object):
+    """
+    Fill the GET request cache with the working set of the staging commands.
+
+    The requests are made concurrently through the regular http_GET() so that
+    they populate the cache exactly as the commands would. Only URLs matching
+    one of Cache.PATTERNS kept for TTL_LONG are built: the source info of the
+    rings, the _meta of the project, rings and stagings and the staging
+    dashboard files. Anything kept for less, like the staging group (TTL_SHORT)
+    or the staging status (TTL_DUPLICATE), would mostly expire between the
+    runs of the timer before being read.
+    """
+    THREADS = 8
+
+    def __init__(self, api):
+        self.api = api
+
+    def perform(self, threads=THREADS):
+        pool = ThreadPool(threads)
+        try:
+            # Listings from which the rest of the working set is derived.
+            stagings = pool.apply_async(self.api.get_staging_projects)
+            files = pool.apply_async(self.dashboard_files)
+            stagings, files = stagings.get(), files.get()
+
+            urls = self.urls(stagings, files)
+            results = pool.map(self.fetch, urls)
+        finally:
+            pool.close()
+            pool.join()
+
+        failed = [url for url, success in zip(urls, results) if not success]
+        print('warmed {} of {} cacheable URLs'.format(len(urls) - len(failed), len(urls)))
+        for url in failed:
+            print('  failed:', url)
+
+        return not failed
+
+    def urls(self, stagings, files):
+        api = self.api
+        urls = []
+
+        for project in api.rings:
+            urls.append(api.makeurl(['source', project], {'view': 'info', 'nofilename': '1'}))
+
+        for project in [api.project, api.cstaging] + list(api.rings) + stagings:
+            urls.append(api.makeurl(['source', project, '_meta']))
+
+        for filename in files:
+            urls.append(api.makeurl(['source', api.cstaging, 'dashboard', '{}?expand=1'.format(filename)]))
+
+        return urls
+
+    def dashboard_files(self):
+        url = self.api.makeurl(['source', self.api.cstaging, 'dashboard'])
+        try:
+            root = ET.parse(http_GET(url)).getroot()
+        except urllib2.HTTPError as e:
+            if e.code == 404:
+                return []
+            raise
+
+        return [entry.get('name') for entry in root.findall('entry')]
+
+    def fetch(self, url):
+        try:
+            # Cache.put() reads the complete response.
+            http_GET(url)
+        except urllib2.URLError as e:
+            if conf.config['debug']: print('CACHE_WARM', url, e, file=sys.stderr)
+            return False
+
+        return True
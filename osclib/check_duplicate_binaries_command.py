@@ -1,10 +1,16 @@
 from __future__ import print_function
-from osc.core import get_binarylist
+from osc.core import makeurl
+from osclib.bulk_fetch import bulk_fetch
 from osclib.core import package_list
 from osclib.core import target_archs
 import re
 import yaml
 
+try:
+    from xml.etree import cElementTree as ET
+except ImportError:
+    import cElementTree as ET
+
 
 class CheckDuplicateBinariesCommand(object):
     def __init__(self, api):
@@ -12,14 +18,20 @@ class CheckDuplicateBinariesCommand(object):
 
     def perform(self, save=False):
         duplicates = {}
+        packages = package_list(self.api.apiurl, self.api.project)
         for arch in sorted(target_archs(self.api.apiurl, self.api.project), reverse=True):
             print('arch {}'.format(arch))
 
+            # Same requests as get_binarylist(), but made concurrently.
+            urls = {}
+            for package in packages:
+                urls[package] = makeurl(self.api.apiurl, ['build', self.api.project, 'standard', arch, package])
+            binarylists = dict(bulk_fetch(urls.values(), parse=self.binarylist_parse))
+
             binaries = {}
             duplicates[arch] = {}
-            for package in package_list(self.api.apiurl, self.api.project):
-                for binary in get_binarylist(self.api.apiurl, self.api.project,
-                                             'standard', arch, package):
+            for package in packages:
+                for binary in binarylists[urls[package]]:
                     # StagingAPI.fileinfo_ext(), but requires lots of calls.
                     match = re.match(r'(.*)-([^-]+)-([^-]+)\.([^-\.]+)\.rpm', binary)
                     if not match or match.group(4) == 'src': continue
@@ -45,3 +57,7 @@ class CheckDuplicateBinariesCommand(object):
             if current != previous:
                 args.append(current)
                 self.api.save_file_content(*args)
+
+    @staticmethod
+    def binarylist_parse(response):
+        return [node.get('filename') for node in ET.parse(response).getroot().findall('binary')]
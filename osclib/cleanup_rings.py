@@ -3,6 +3,8 @@ from xml.etree import cElementTree as ET
 from osc.core import makeurl
 from osc.core import http_GET
 
+from osclib.xmlstream import iterelements
+
 
 class CleanupRings(object):
     def __init__(self, api):
@@ -68,11 +70,10 @@ class CleanupRings(object):
 
     def fill_pkgdeps(self, prj, repo, arch):
         url = makeurl(self.api.apiurl, ['build', prj, repo, arch, '_builddepinfo'])
-        f = http_GET(url)
-        root = ET.parse(f).getroot()
-
-        for package in root.findall('package'):
+        pkgdeps = []
+        for package in iterelements(http_GET(url), 'package'):
             source = package.find('source').text
+            pkgdeps.append((source, [pkg.text for pkg in package.findall('pkgdep')]))
             if package.attrib['name'].startswith('preinstall'):
                 continue
             self.sources.add(source)
@@ -86,14 +87,13 @@ class CleanupRings(object):
                     print('Binary {} is defined twice: {}/{}'.format(subpkg, prj, source))
                 self.bin2src[subpkg] = source
 
-        for package in root.findall('package'):
-            source = package.find('source').text
-            for pkg in package.findall('pkgdep'):
-                if pkg.text not in self.bin2src:
-                    if not pkg.text.startswith('texlive-'): # XXX: texlive bullshit packaging
-                        print('Package {} not found in place'.format(pkg.text))
+        for source, deps in pkgdeps:
+            for pkg in deps:
+                if pkg not in self.bin2src:
+                    if not pkg.startswith('texlive-'): # XXX: texlive bullshit packaging
+                        print('Package {} not found in place'.format(pkg))
                     continue
-                b = self.bin2src[pkg.text]
+                b = self.bin2src[pkg]
                 self.pkgdeps[b] = source
 
     def repo_state_acceptable(self, project):
@@ -0,0 +1,252 @@
+from __future__ import print_function
+
+import atexit
+from collections import defaultdict
+import httplib
+import socket
+import sys
+import threading
+from time import time
+import urllib2
+
+import osc.conf
+
+
+class PooledResponse(object):
+    """
+    Response which hands its connection back to the pool once fully read.
+
+    A response closed before being read completely leaves the connection in
+    an unknown state so the connection is closed instead.
+    """
+
+    def __init__(self, response, release):
+        self.response = response
+        self.release = release
+        if response.length == 0:
+            # Nothing to read, like HEAD or 304 responses.
+            response.close()
+        self.check()
+
+    def check(self):
+        if self.release and self.response.isclosed():
+            release, self.release = self.release, None
+            release(reusable=not self.response.will_close)
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.check()
+        return data
+
+    # Used by socket._fileobject.
+    recv = read
+
+    def readline(self, limit=-1):
+        data = self.response.readline(limit)
+        self.check()
+        return data
+
+    def close(self):
+        self.response.close()
+        if self.release:
+            release, self.release = self.release, None
+            release(reusable=False)
+
+
+class PooledHandler(urllib2.BaseHandler):
+    """
+    Handler reusing keep-alive connections from ConnectionPool.
+
+    Placed before the default handlers so that https requests are made using
+    the connection class and SSL context of the HTTPS handler it replaces.
+    Requests through a proxy are left to the default handlers.
+    """
+
+    handler_order = 400
+
+    def __init__(self, https_connection):
+        self.https_connection = https_connection
+
+    def http_open(self, req):
+        return self.do_open(lambda host, timeout: httplib.HTTPConnection(host, timeout=timeout), req)
+
+    def https_open(self, req):
+        if self.https_connection is None:
+            return None
+        return self.do_open(self.https_connection, req)
+
+    def do_open(self, connection, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        if req.has_proxy() or req._tunnel_host:
+            return None
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items() if k not in headers)
+        headers = dict((name.title(), value) for name, value in headers.items())
+
+        key = (req.get_type(), host)
+        conn = ConnectionPool.get(key)
+        while True:
+            reused = conn is not None
+            if not reused:
+                conn = connection(host, req.timeout)
+                ConnectionPool.count('created')
+
+            try:
+                conn.request(req.get_method(), req.get_selector(), req.data, headers)
+                try:
+                    response = conn.getresponse(buffering=True)
+                except TypeError:
+                    response = conn.getresponse()
+                break
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                conn = None
+                if reused:
+                    # Closed by the server while idle, before any response.
+                    ConnectionPool.count('retried')
+                    continue
+                raise urllib2.URLError(e)
+
+        if reused:
+            ConnectionPool.count('reused')
+        ConnectionPool.count('requests')
+
+        def release(reusable):
+            if reusable:
+                ConnectionPool.put(key, conn)
+            else:
+                conn.close()
+
+        fp = socket._fileobject(PooledResponse(response, release), close=True)
+        resp = urllib2.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+
+def https_connection(opener):
+    """
+    Return a function creating connections like the https handler of opener.
+    """
+    for handler in opener.handlers:
+        if hasattr(handler, 'appname') and hasattr(handler, 'ctx'):
+            # osc.oscssl.myHTTPSHandler which subclasses the M2Crypto handler
+            # rather than urllib2.HTTPSHandler.
+            from osc import oscssl
+            appname, ssl_context = handler.appname, handler.ctx
+            return lambda host, timeout: oscssl.myHTTPSConnection(
+                host, appname=appname, ssl_context=ssl_context)
+
+        if isinstance(handler, urllib2.HTTPSHandler):
+            context = getattr(handler, '_context', None)
+            return lambda host, timeout: httplib.HTTPSConnection(host, timeout=timeout, context=context)
+
+    return None
+
+
+def _build_opener(apiurl):
+    """
+    Wrapper for osc.conf._build_opener() adding PooledHandler to the opener.
+    """
+    opener = osc.conf._pool_build_opener(apiurl)
+    if not any(isinstance(handler, PooledHandler) for handler in opener.handlers):
+        opener.add_handler(PooledHandler(https_connection(opener)))
+    return opener
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive connections shared by all requests made through osc.
+
+    Up to SIZE idle connections are kept per host and reused by the next
+    requests to the same host which avoids a TCP and TLS handshake for each
+    request. Connections idle for longer than IDLE_TIMEOUT are closed since
+    the server will have likely closed them already.
+    """
+
+    SIZE = 8
+    IDLE_TIMEOUT = 30
+
+    COUNTERS = (
+        'requests',
+        'created',
+        'reused',
+        'retried',
+        'expired',
+        'discarded',
+    )
+
+    idle = defaultdict(list)
+    lock = threading.Lock()
+    counters = defaultdict(int)
+
+    @staticmethod
+    def init(size=None, idle_timeout=None):
+        if size is not None:
+            ConnectionPool.SIZE = size
+        if idle_timeout is not None:
+            ConnectionPool.IDLE_TIMEOUT = idle_timeout
+
+        # Replace _build_opener with wrapper function which needs a stored
+        # version of the original function to call.
+        if not hasattr(osc.conf, '_pool_build_opener'):
+            osc.conf._pool_build_opener = osc.conf._build_opener
+            osc.conf._build_opener = _build_opener
+            atexit.register(ConnectionPool.stats_print)
+
+    @staticmethod
+    def get(key):
+        """Return an idle connection for key or None."""
+        now = time()
+        with ConnectionPool.lock:
+            idle = ConnectionPool.idle[key]
+            while idle:
+                conn, released = idle.pop()
+                if now - released < ConnectionPool.IDLE_TIMEOUT:
+                    return conn
+                ConnectionPool.counters['expired'] += 1
+                conn.close()
+        return None
+
+    @staticmethod
+    def put(key, conn):
+        with ConnectionPool.lock:
+            idle = ConnectionPool.idle[key]
+            if len(idle) < ConnectionPool.SIZE:
+                idle.append((conn, time()))
+                return
+            ConnectionPool.counters['discarded'] += 1
+        conn.close()
+
+    @staticmethod
+    def count(name):
+        with ConnectionPool.lock:
+            ConnectionPool.counters[name] += 1
+
+    @staticmethod
+    def stats():
+        """
+        Return the counters and the number of idle connections.
+        """
+        with ConnectionPool.lock:
+            stats = dict((name, ConnectionPool.counters[name]) for name in ConnectionPool.COUNTERS)
+            stats['idle'] = sum(len(idle) for idle in ConnectionPool.idle.values())
+        requests = stats['requests']
+        stats['reuse_ratio'] = float(stats['reused']) / requests if requests else 0.0
+        return stats
+
+    @staticmethod
+    def close():
+        with ConnectionPool.lock:
+            for idle in ConnectionPool.idle.values():
+                for conn, released in idle:
+                    conn.close()
+            ConnectionPool.idle.clear()
+
+    @staticmethod
+    def stats_print():
+        if osc.conf.config['debug']:
+            print('CONNECTION_POOL', ConnectionPool.stats(), file=sys.stderr)
@@ -15,12 +15,12 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import urllib2
-from xml.etree import cElementTree as ET
 
 from osc.core import http_GET
 from osc.core import makeurl
 
 from .memoize import memoize
+from .xmlstream import iterelements
 
 
 class Graph(dict):
@@ -150,12 +150,13 @@ class CycleDetector(object):
         # Store packages prevoiusly ignored. Don't pollute the screen.
         self._ignore_packages = set()
 
-    @memoize(ttl=60*60*6)
+    # Large responses, but only one per project, repository and architecture.
+    @memoize(ttl=60*60*6, slots=32, stale_ttl=60*60*6)
     def _builddepinfo(self, project, repository, arch):
         root = None
         try:
             # print('Generating _builddepinfo for (%s, %s, %s)' % (project, repository, arch))
-            url = makeurl(self.api.apiurl, ['/build/%s/%s/%s/_builddepinfo' % (project, repository, arch)])
+            url = makeurl(self.api.apiurl, ['build', project, repository, arch, '_builddepinfo'])
             root = http_GET(url).read()
         except urllib2.HTTPError, e:
             print('ERROR in URL %s [%s]' % (url, e))
@@ -163,10 +164,10 @@ class CycleDetector(object):
 
     def _get_builddepinfo(self, project, repository, arch, package):
         """Get the builddep info for a single package"""
-        root = ET.fromstring(self._builddepinfo(project, repository, arch))
-        packages = [Package(element=e) for e in root.findall('package')]
-        package = [p for p in packages if p.pkg == package]
-        return package[0] if package else None
+        for e in iterelements(self._builddepinfo(project, repository, arch), 'package'):
+            if e.get('name') == package:
+                return Package(element=e)
+        return None
 
     def _get_builddepinfo_graph(self, project, repository, arch):
         """Generate the buildepinfo graph for a given architecture."""
@@ -178,10 +179,10 @@ class CycleDetector(object):
         #   project = 'Base:System'
         #   repository = 'openSUSE_Factory'
 
-        root = ET.fromstring(self._builddepinfo(project, repository, arch))
         # Reset the subpackages dict here, so for every graph is a
         # different object.
-        packages = [Package(element=e) for e in root.findall('package')]
+        packages = [Package(element=e) for e in
+                    iterelements(self._builddepinfo(project, repository, arch), 'package')]
 
         # XXX - Ugly Exception. We need to ignore branding packages and
         # packages that one of his dependencies do not exist. Also ignore
@@ -223,9 +224,8 @@ class CycleDetector(object):
 
     def _get_builddepinfo_cycles(self, package, repository, arch):
         """Generate the buildepinfo cycle list for a given architecture."""
-        root = ET.fromstring(self._builddepinfo(package, repository, arch))
         return frozenset(frozenset(e.text for e in cycle.findall('package'))
-                         for cycle in root.findall('cycle'))
+                         for cycle in iterelements(self._builddepinfo(package, repository, arch), 'cycle'))
 
     def cycles(self, group, project=None, repository='standard', arch='x86_64'):
         """Detect cycles in a specific repository."""
@@ -0,0 +1,285 @@
+from __future__ import print_function
+
+import atexit
+from bisect import bisect_left
+from collections import defaultdict
+import json
+import os
+import sys
+import threading
+from time import time
+import urlparse
+
+import osc.core
+
+
+# Path segments after the first by route, None keeping the segment as is.
+# Segments starting with an underscore (_meta, _history, _builddepinfo, ...)
+# are always kept and further segments collapse into the last name.
+TEMPLATES = {
+    'build': ('project', 'repository', 'arch', 'package', 'file'),
+    'comments': (None, 'name', 'package'),
+    'group': ('group',),
+    'person': ('login',),
+    'project': (None, 'project'),
+    'published': ('project', 'repository', 'arch', 'file'),
+    'request': ('id',),
+    'search': (None, None),
+    'source': ('project', 'package', 'file'),
+    'staging': ('project', None, 'name'),
+    'statistics': (None, 'project'),
+}
+# Query parameters that select a different kind of response.
+QUERY_KEEP = ('cmd', 'view', 'deleted', 'expand')
+
+
+def template(url):
+    """
+    Return the path template of url, like /source/{project}/{package}/_meta,
+    under which requests are grouped.
+    """
+    o = urlparse.urlsplit(url)
+    segments = [segment for segment in o.path.split('/') if segment]
+    if not segments:
+        return '/'
+
+    names = TEMPLATES.get(segments[0], ())
+    path = [segments[0]]
+    for i, segment in enumerate(segments[1:]):
+        name = names[min(i, len(names) - 1)] if names else 'name'
+        if segment.startswith('_') or name is None:
+            path.append(segment)
+        elif i >= len(names) and path[-1] == '{' + name + '}':
+            # Files in subdirectories.
+            continue
+        else:
+            path.append('{' + name + '}')
+
+    query = urlparse.parse_qsl(o.query, keep_blank_values=True)
+    query = sorted('='.join((key, value)) for key, value in query if key in QUERY_KEEP)
+    return '/' + '/'.join(path) + ('?' + '&'.join(query) if query else '')
+
+
+def _wrap(func):
+    def http_request(method, url, *args, **kwargs):
+        local = HTTPMetrics.local
+        if getattr(local, 'active', False):
+            # Made by an outer request, like the cache expiring a request.
+            return func(method, url, *args, **kwargs)
+
+        local.active = True
+        local.cache = None
+        local.size = None
+        start = time()
+        ret = None
+        error = True
+        try:
+            ret = func(method, url, *args, **kwargs)
+            error = False
+            return ret
+        finally:
+            local.active = False
+            size = local.size
+            if size is None and ret is not None and hasattr(ret, 'info'):
+                size = int(ret.info().getheader('Content-Length') or 0)
+            HTTPMetrics.record(method, url, time() - start, local.cache or 'uncached', size or 0, error)
+
+    http_request._http_metrics = True
+    return http_request
+
+
+class HTTPMetrics(object):
+    """
+    Per endpoint counters and latency of requests made through osc.
+
+    Opt-in by setting the OSC_HTTP_METRICS environment variable. Requests are
+    grouped by method and path template (see template()) and counted by cache
+    status, as reported by osclib.cache, along with the response bytes and a
+    histogram of the time until the response is returned, which is a whole
+    read for requests passing through the cache.
+
+    A summary table is printed at exit. When the variable is a path, other
+    than 1, the metrics are also written to it in the Prometheus textfile
+    format, or as JSON for paths ending in .json, at exit and by the bots
+    after each cycle.
+    """
+
+    ENVIRONMENT = 'OSC_HTTP_METRICS'
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    output = None
+    enabled = False
+    endpoints = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    @staticmethod
+    def init(output=None):
+        if output is None:
+            output = os.environ.get(HTTPMetrics.ENVIRONMENT)
+        if not output:
+            return
+
+        HTTPMetrics.output = None if output == '1' else output
+
+        # Only the outermost wrapper records requests so placing another one
+        # around a wrapper installed since, like the cache, is harmless.
+        if not getattr(osc.core.http_request, '_http_metrics', False):
+            osc.core.http_request = _wrap(osc.core.http_request)
+
+        if not HTTPMetrics.enabled:
+            HTTPMetrics.enabled = True
+            atexit.register(HTTPMetrics.exit)
+
+    @staticmethod
+    def cache_status(status, size=None):
+        """Report how the cache served the current request."""
+        HTTPMetrics.local.cache = status
+        HTTPMetrics.local.size = size
+
+    @staticmethod
+    def record(method, url, elapsed, cache, size, error=False):
+        key = (method, template(url))
+        with HTTPMetrics.lock:
+            endpoint = HTTPMetrics.endpoints.get(key)
+            if endpoint is None:
+                endpoint = HTTPMetrics.endpoints[key] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'bytes': 0,
+                    'seconds': 0.0,
+                    'cache': defaultdict(int),
+                    'buckets': [0] * (len(HTTPMetrics.BUCKETS) + 1),
+                }
+
+            endpoint['requests'] += 1
+            endpoint['errors'] += int(error)
+            endpoint['bytes'] += size
+            endpoint['seconds'] += elapsed
+            endpoint['cache'][cache] += 1
+            endpoint['buckets'][bisect_left(HTTPMetrics.BUCKETS, elapsed)] += 1
+
+    @staticmethod
+    def reset():
+        with HTTPMetrics.lock:
+            HTTPMetrics.endpoints.clear()
+
+    @staticmethod
+    def snapshot():
+        """Return a sorted list of (method, template, endpoint) tuples."""
+        with HTTPMetrics.lock:
+            return sorted((method, path, dict(endpoint, cache=dict(endpoint['cache']),
+                                              buckets=list(endpoint['buckets'])))
+                          for (method, path), endpoint in HTTPMetrics.endpoints.items())
+
+    @staticmethod
+    def percentile(endpoint, percent):
+        """Return the upper bound of the bucket containing the percentile."""
+        rank = endpoint['requests'] * percent / 100.0
+        count = 0
+        for bound, bucket in zip(HTTPMetrics.BUCKETS + (float('inf'),), endpoint['buckets']):
+            count += bucket
+            if count >= rank:
+                return bound
+        return float('inf')
+
+    @staticmethod
+    def summary(file=sys.stderr):
+        endpoints = HTTPMetrics.snapshot()
+        if not endpoints:
+            return
+
+        endpoints.sort(key=lambda item: item[2]['seconds'], reverse=True)
+        width = max(len(path) for method, path, endpoint in endpoints)
+        row = '{:<6} {:<' + str(width) + '} {:>8} {:>6} {:>7} {:>10} {:>9} {:>9} {:>9}'
+        print(row.format('method', 'endpoint', 'requests', 'errors', 'cached', 'MiB', 'seconds', 'mean ms', 'p95 ms'),
+              file=file)
+        for method, path, endpoint in endpoints:
+            requests = endpoint['requests']
+            cached = requests - endpoint['cache'].get('miss', 0) - endpoint['cache'].get('uncached', 0)
+            print(row.format(
+                method, path, requests, endpoint['errors'],
+                '{:.0%}'.format(float(cached) / requests),
+                '{:.2f}'.format(endpoint['bytes'] / 1024.0 ** 2),
+                '{:.2f}'.format(endpoint['seconds']),
+                '{:.0f}'.format(endpoint['seconds'] / requests * 1000),
+                '{:.0f}'.format(HTTPMetrics.percentile(endpoint, 95) * 1000)), file=file)
+
+    @staticmethod
+    def program():
+        """
+        Return the name identifying this process in the metrics, the name of
+        the output file if any so that several instances of a program writing
+        to a shared textfile directory do not export conflicting series.
+        """
+        if HTTPMetrics.output:
+            return os.path.splitext(os.path.basename(HTTPMetrics.output))[0]
+        return os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python'
+
+    @staticmethod
+    def format_json():
+        return json.dumps({
+            'program': HTTPMetrics.program(),
+            'buckets': HTTPMetrics.BUCKETS,
+            'endpoints': [dict(endpoint, method=method, endpoint=path)
+                          for method, path, endpoint in HTTPMetrics.snapshot()],
+        }, indent=2, sort_keys=True)
+
+    @staticmethod
+    def format_prometheus():
+        def labels(**labels):
+            labels['program'] = HTTPMetrics.program()
+            return '{' + ','.join('{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"')
+                                                   .replace('\n', '\\n'))
+                                  for key, value in sorted(labels.items())) + '}'
+
+        lines = {
+            'requests': ['# TYPE osc_http_requests_total counter'],
+            'errors': ['# TYPE osc_http_errors_total counter'],
+            'bytes': ['# TYPE osc_http_response_bytes_total counter'],
+            'duration': ['# TYPE osc_http_request_duration_seconds histogram'],
+        }
+        for method, path, endpoint in HTTPMetrics.snapshot():
+            for cache, count in sorted(endpoint['cache'].items()):
+                lines['requests'].append('osc_http_requests_total{} {}'.format(
+                    labels(method=method, endpoint=path, cache=cache), count))
+            lines['errors'].append('osc_http_errors_total{} {}'.format(
+                labels(method=method, endpoint=path), endpoint['errors']))
+            lines['bytes'].append('osc_http_response_bytes_total{} {}'.format(
+                labels(method=method, endpoint=path), endpoint['bytes']))
+
+            count = 0
+            for bound, bucket in zip(HTTPMetrics.BUCKETS + ('+Inf',), endpoint['buckets']):
+                count += bucket
+                lines['duration'].append('osc_http_request_duration_seconds_bucket{} {}'.format(
+                    labels(method=method, endpoint=path, le=str(bound)), count))
+            lines['duration'].append('osc_http_request_duration_seconds_sum{} {}'.format(
+                labels(method=method, endpoint=path), repr(endpoint['seconds'])))
+            lines['duration'].append('osc_http_request_duration_seconds_count{} {}'.format(
+                labels(method=method, endpoint=path), endpoint['requests']))
+
+        return '\n'.join(sum((lines[name] for name in ('requests', 'errors', 'bytes', 'duration')), [])) + '\n'
+
+    @staticmethod
+    def write(output=None):
+        """
+        Write the metrics to output, by default the configured path, replacing
+        the file atomically so that collectors never read a partial file.
+        """
+        output = output or HTTPMetrics.output
+        if not output:
+            return
+
+        text = HTTPMetrics.format_json() if output.endswith('.json') else HTTPMetrics.format_prometheus()
+        temporary = '{}.{}.tmp'.format(output, os.getpid())
+        try:
+            with open(temporary, 'w') as f:
+                f.write(text)
+            os.rename(temporary, output)
+        except (IOError, OSError) as e:
+            print('Failed to write HTTP metrics to {}: {}'.format(output, e), file=sys.stderr)
+
+    @staticmethod
+    def exit():
+        HTTPMetrics.summary()
+        HTTPMetrics.write()
@@ -14,11 +14,18 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from datetime import datetime
-import fcntl
+from collections import OrderedDict
+from collections import defaultdict
+from contextlib import contextmanager
 from functools import wraps
+import hashlib
+import marshal
 import os
-import shelve
+import sqlite3
+import threading
+from time import time
+import warnings
+import weakref
 try:
     import cPickle as pickle
 except:
@@ -39,60 +46,225 @@ except ImportError:
 # Where the cache files are stored
 CACHEDIR = save_cache_path('opensuse-repo-checker')
 
+# Functions memoized with a session cache, see new_cycle().
+_SESSIONS = weakref.WeakSet()
 
-def memoize(ttl=None, session=False, add_invalidate=False):
+
+def _key(obj):
+    """
+    Return a fixed width key for obj, the (args, kwargs) of a call.
+
+    Calls are serialized using marshal (version 0 which does not depend on
+    string interning), which keeps the type of every value and is cheaper than
+    pickle, while calls with arguments marshal refuses, like instances, fall
+    back to pickle. Equal dicts or sets may marshal in a different order which
+    only costs a miss.
+    """
+    args, kwargs = obj
+    if kwargs:
+        kwargs = sorted(kwargs.items())
+    try:
+        return hashlib.sha1('m' + marshal.dumps((args, kwargs), 0)).digest()
+    except ValueError:
+        pass
+
+    # Pickle doesn't guarantee that there is a single representation for
+    # every serialization. We can try to picke / depickle twice to have a
+    # canonical representation.
+    key = pickle.dumps((args, kwargs), protocol=-1)
+    key = pickle.dumps(pickle.loads(key), protocol=-1)
+    return hashlib.sha1('p' + key).digest()
+
+
+class MemoizeStore(object):
+    """
+    Persistent cache of a memoized function backed by SQLite in WAL mode.
+
+    Readers never block and are not blocked by a writer so concurrent processes
+    only serialize on the short transactions that store a value. The number of
+    entries is maintained by triggers and entries are evicted in timestamp
+    order using an index so that storing a value never scans the cache.
+    """
+
+    TIMEOUT = 60
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.local = threading.local()
+
+    def connection(self):
+        # Connections cannot be shared between threads nor survive a fork.
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None and self.local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.filename, timeout=self.TIMEOUT, isolation_level=None)
+        conn.text_factory = str
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS memoize '
+                     '(key BLOB PRIMARY KEY, timestamp REAL NOT NULL, value BLOB NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS memoize_timestamp ON memoize (timestamp)')
+        conn.execute('CREATE TABLE IF NOT EXISTS memoize_count (count INTEGER NOT NULL)')
+        conn.execute('INSERT INTO memoize_count SELECT COUNT(*) FROM memoize '
+                     'WHERE NOT EXISTS (SELECT 1 FROM memoize_count)')
+        conn.execute('CREATE TRIGGER IF NOT EXISTS memoize_insert AFTER INSERT ON memoize '
+                     'BEGIN UPDATE memoize_count SET count = count + 1; END')
+        conn.execute('CREATE TRIGGER IF NOT EXISTS memoize_delete AFTER DELETE ON memoize '
+                     'BEGIN UPDATE memoize_count SET count = count - 1; END')
+
+        self.local.conn = conn
+        self.local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def get(self, key):
+        """Return (timestamp, value) for key or None."""
+        row = self.connection().execute(
+            'SELECT timestamp, value FROM memoize WHERE key = ?', (sqlite3.Binary(key),)).fetchone()
+        if row is None:
+            return None
+        return row[0], pickle.loads(str(row[1]))
+
+    def set(self, key, timestamp, value, slots, nclean):
+        """
+        Store value for key and remove the oldest entries beyond slots.
+
+        Return the number of entries evicted.
+        """
+        key = sqlite3.Binary(key)
+        value = sqlite3.Binary(pickle.dumps(value, protocol=-1))
+        with self.transaction() as conn:
+            cursor = conn.execute('INSERT OR IGNORE INTO memoize (key, timestamp, value) '
+                                  'VALUES (?, ?, ?)', (key, timestamp, value))
+            if not cursor.rowcount:
+                # Expired entry being refreshed.
+                conn.execute('UPDATE memoize SET timestamp = ?, value = ? WHERE key = ?',
+                             (timestamp, value, key))
+                return 0
+
+            count = conn.execute('SELECT count FROM memoize_count').fetchone()[0]
+            if count >= slots:
+                return conn.execute('DELETE FROM memoize WHERE key IN '
+                                    '(SELECT key FROM memoize ORDER BY timestamp LIMIT ?)',
+                                    (nclean + count - slots,)).rowcount
+            return 0
+
+    def delete(self, key):
+        self.connection().execute('DELETE FROM memoize WHERE key = ?', (sqlite3.Binary(key),))
+
+    def clear(self):
+        self.connection().execute('DELETE FROM memoize')
+
+    def __len__(self):
+        return self.connection().execute('SELECT count FROM memoize_count').fetchone()[0]
+
+
+class SessionStore(object):
+    """
+    Cache of a memoized function kept for the lifetime of the process.
+
+    Entries are kept in least recently used order so the ones to evict are
+    always at the front. A lock guards the entries since values may be
+    refreshed in the background.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def set(self, key, timestamp, value, slots, nclean):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (timestamp, value)
+            if len(self.entries) < slots:
+                return 0
+
+            evict = nclean + len(self.entries) - slots
+            for i in range(evict):
+                self.entries.popitem(last=False)
+            return evict
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def memoize(ttl=None, session=False, add_invalidate=False, slots=None, nclean=None,
+            stale_ttl=None):
     """Decorator function to implement a persistent cache.
 
+    At most slots entries are kept, removing nclean of the oldest (or least
+    recently used for a session cache) when full. By default nclean is a
+    quarter of slots.
+
+    For stale_ttl seconds after ttl has passed the expired value is still
+    returned immediately while a background thread refreshes it. Should the
+    refresh fail a warning is issued and the stale value continues to be
+    served until stale_ttl passes as well.
+
     >>> @memoize()
-    ... def test_func(a):
+    ... def test_func(self, a):
     ...     return a
 
     Internally, the memoized function has a cache:
 
-    >>> cache = [c.cell_contents for c in test_func.func_closure if 'sync' in dir(c.cell_contents)][0]
-    >>> 'sync' in dir(cache)
-    True
-
-    There is a limit of the size of the cache
-
-    >>> for k in cache:
-    ...     del cache[k]
+    >>> cache = test_func._memoize_cache
+    >>> cache.clear()
     >>> len(cache)
     0
 
+    There is a limit of the size of the cache
+
     >>> for i in range(4095):
-    ...     test_func(i)
-    ... len(cache)
+    ...     _ = test_func(None, i)
+    >>> len(cache)
     4095
 
-    >>> test_func(0)
+    >>> test_func(None, 0)
     0
 
     >>> len(cache)
     4095
 
-    >>> test_func(4095)
+    >>> test_func(None, 4095)
     4095
 
     >>> len(cache)
     3072
 
-    >>> test_func(0)
-    0
+    Persistent caches are stored in a SQLite database per function in
+    CACHEDIR, session caches in memory. Session caches are bounded by slots
+    and ttl like persistent ones and are additionally cleared by new_cycle().
 
-    >>> len(cache)
-    3073
-
-    >>> from datetime import timedelta
-    >>> k = [k for k in cache if cPickle.loads(k) == ((0,), {})][0]
-    >>> t, v = cache[k]
-    >>> t = t - timedelta(days=10)
-    >>> cache[k] = (t, v)
-    >>> test_func(0)
-    0
-    >>> t2, v = cache[k]
-    >>> t != t2
-    True
+    Hits, misses, stale values served and evictions are counted per function:
+
+    >>> sorted(test_func._memoize_counters.items())
+    [('evicted', 1024), ('hit', 1), ('miss', 4096)]
 
     """
 
@@ -102,61 +274,35 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     TIMEOUT = 60*60*2       # Time to live for every cache slot (seconds)
 
     def _memoize(fn):
-        # Implement a POSIX lock / unlock extension for shelves. Inspired
-        # on ActiveState Code recipe #576591
-        def _lock(filename):
-            lckfile = open(filename + '.lck', 'w')
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-            return lckfile
-
-        def _unlock(lckfile):
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-            lckfile.close()
-
-        def _open_cache(cache_name):
-            if not session:
-                lckfile = _lock(cache_name)
-                cache = shelve.open(cache_name, protocol=-1)
-                # Store a reference to the lckfile to avoid to be
-                # closed by gc
-                cache.lckfile = lckfile
-            else:
-                if not hasattr(fn, '_memoize_session_cache'):
-                    fn._memoize_session_cache = {}
-                cache = fn._memoize_session_cache
-            return cache
-
-        def _close_cache(cache):
-            if not session:
-                cache.close()
-                _unlock(cache.lckfile)
-
-        def _clean_cache(cache):
-            len_cache = len(cache)
-            if len_cache >= SLOTS:
-                nclean = NCLEAN + len_cache - SLOTS
-                keys_to_delete = sorted(cache, key=lambda k: cache[k][0])[:nclean]
-                for key in keys_to_delete:
-                    del cache[key]
-
-        def _key(obj):
-            # Pickle doesn't guarantee that there is a single
-            # representation for every serialization.  We can try to
-            # picke / depickle twice to have a canonical
-            # representation.
-            key = pickle.dumps(obj, protocol=-1)
-            key = pickle.dumps(pickle.loads(key), protocol=-1)
-            return key
-
         def _invalidate(*args, **kwargs):
             key = _key((args, kwargs))
-            cache = _open_cache(cache_name)
-            if key in cache:
-                del cache[key]
+            with generation_lock:
+                generation[0] += 1
+                cache.delete(key)
 
         def _invalidate_all():
-            cache = _open_cache(cache_name)
-            cache.clear()
+            with generation_lock:
+                generation[0] += 1
+                cache.clear()
+
+        def _refresh(key, args, kwargs):
+            with refreshing_lock:
+                if key in refreshing:
+                    return
+                refreshing.add(key)
+
+            thread = threading.Thread(target=_refresh_thread, args=(key, args, kwargs, generation[0]))
+            thread.daemon = True
+            thread.start()
+
+        def _refresh_thread(key, args, kwargs, since):
+            try:
+                _set(key, time(), fn(*args, **kwargs), since)
+            except Exception as e:
+                warnings.warn('Refreshing {} failed, serving stale value: {}'.format(fn.__name__, e))
+            finally:
+                with refreshing_lock:
+                    refreshing.discard(key)
 
         def _add_invalidate_method(_self):
             name = '_invalidate_%s' % fn.__name__
@@ -169,30 +315,85 @@ def memoize(ttl=None, session=False, add_invalidate=False):
 
         @wraps(fn)
         def _fn(*args, **kwargs):
-            def total_seconds(td):
-                return (td.microseconds + (td.seconds + td.days * 24 * 3600.) * 10**6) / 10**6
-            now = datetime.now()
+            now = time()
             if add_invalidate:
                 _self = args[0]
                 _add_invalidate_method(_self)
             key = _key((args[1:], kwargs))
-            updated = False
-            cache = _open_cache(cache_name)
-            if key in cache:
-                timestamp, value = cache[key]
-                updated = True if total_seconds(now-timestamp) < ttl else False
-            if not updated:
-                value = fn(*args, **kwargs)
-                cache[key] = (now, value)
-            _clean_cache(cache)
-            _close_cache(cache)
+            entry = cache.get(key)
+            if entry is not None:
+                timestamp, value = entry
+                if now - timestamp < ttl:
+                    counters['hit'] += 1
+                    return value
+                if now - timestamp < ttl + stale_ttl:
+                    counters['stale'] += 1
+                    _refresh(key, args, kwargs)
+                    return value
+            counters['miss'] += 1
+            since = generation[0]
+            value = fn(*args, **kwargs)
+            _set(key, now, value, since)
             return value
 
-        cache_dir = os.path.expanduser(CACHEDIR)
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        cache_name = os.path.join(cache_dir, fn.__name__)
+        def _set(key, timestamp, value, since):
+            # A value fetched before an invalidation may predate the change
+            # that caused it, so it is not stored.
+            with generation_lock:
+                if generation[0] != since:
+                    return
+                evicted = cache.set(key, timestamp, value, slots, nclean)
+            if evicted:
+                counters['evicted'] += evicted
+
+        if session:
+            cache = SessionStore()
+            _SESSIONS.add(_fn)
+        else:
+            cache_dir = os.path.expanduser(CACHEDIR)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # Distinct from the name used by the former shelve files.
+            cache = MemoizeStore(os.path.join(cache_dir, fn.__name__ + '.sqlite'))
+        # Keys currently being refreshed in the background.
+        refreshing = set()
+        refreshing_lock = threading.Lock()
+        # Bumped by every invalidation, see _set().
+        generation = [0]
+        generation_lock = threading.Lock()
+        counters = defaultdict(int)
+
+        _fn._memoize_cache = cache
+        _fn._memoize_counters = counters
+        _fn._memoize_key = _key
+        _fn._memoize_refreshing = refreshing
         return _fn
 
     ttl = ttl if ttl else TIMEOUT
+    nclean = nclean if nclean else (slots / 4 if slots else NCLEAN)
+    slots = slots if slots else SLOTS
+    stale_ttl = stale_ttl if stale_ttl else 0
     return _memoize
+
+
+def new_cycle():
+    """
+    Start a new cycle of a long running process, like a bot with --interval.
+
+    All session caches are cleared so values are fetched again at least once
+    per cycle. Counters are kept, see session_stats().
+    """
+    for fn in list(_SESSIONS):
+        fn._memoize_cache.clear()
+
+
+def session_stats():
+    """
+    Return the counters and size of session caches by function name.
+    """
+    stats = {}
+    for fn in list(_SESSIONS):
+        counters = dict(fn._memoize_counters)
+        counters['size'] = len(fn._memoize_cache)
+        stats['{}.{}'.format(fn.__module__, fn.__name__)] = counters
+    return stats
@@ -14,6 +14,8 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import anydbm
+from contextlib import contextmanager
 import fcntl
 import glob
 import hashlib
@@ -24,14 +26,61 @@ except:
     import pickle
 import shelve
 import shutil
+import sqlite3
 import time
 from UserDict import DictMixin
+import whichdb
+
+
+def _digest(filename, chunk_size=1024*1024):
+    """Return the sha256 of filename reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _dumps(obj):
+    # Pickle does not guarantee the same serialization for equal objects,
+    # but the result of a round trip is stable.
+    return pickle.dumps(pickle.loads(pickle.dumps(obj, protocol=-1)), protocol=-1)
 
 
 class PkgCache(DictMixin):
-    def __init__(self, basecachedir, force_clean=False):
+    """
+    Container of files, like downloaded RPMs, stored by content.
+
+    A SQLite index maps each key to the sha256 of the content and every
+    content to the number of keys referencing it, so files are shared between
+    keys and removed once the last reference is gone without looking at the
+    directory. Keys are tuples like (project, repository, arch, package,
+    filename, mtime); only the latest mtime is kept for the same prefix.
+
+    A cache from before the SQLite index is imported on first use. Its
+    entries stay addressed by md5 in the same layout and remain readable until
+    they expire or are replaced.
+
+    With a quota, in bytes, the least recently accessed entries are evicted
+    once the contents exceed it. Expired entries are removed and the quota
+    enforced on construction unless clean is False, like for inspecting the
+    cache.
+
+    Reads do not write to the index. Access times and hit / miss counters are
+    kept in memory and written with the next change, eviction or close().
+    """
+
+    TIMEOUT = 60
+
+    def __init__(self, basecachedir, force_clean=False, quota=None, clean=True):
         self.cachedir = os.path.join(basecachedir, 'pkgcache')
-        self.index_fn = os.path.join(self.cachedir, 'index.db')
+        self.index_fn = os.path.join(self.cachedir, 'index.sqlite')
+        # Index of caches from before SQLite.
+        self.shelve_fn = os.path.join(self.cachedir, 'index.db')
+        self.quota = quota
+        # Pending writes, see _flush().
+        self.atimes = {}
+        self.counters = {}
 
         if force_clean:
             try:
@@ -42,160 +91,365 @@ class PkgCache(DictMixin):
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
 
-        self._clean_cache()
+        # Another process starting meanwhile waits for a complete index.
+        with self._locked():
+            legacy = self._legacy()
+            self._open_index()
+            if legacy:
+                self._migrate()
+
+        if clean:
+            self._clean_cache()
+            if self.quota:
+                with self._transaction() as conn:
+                    self._evict(conn)
+
+    @contextmanager
+    def _locked(self):
+        """Lock the cache directory while setting it up."""
+        fd = os.open(self.cachedir, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _legacy(self):
+        """Return True if the cache directory has the layout before SQLite."""
+        if whichdb.whichdb(self.shelve_fn) is not None:
+            return True
+        # Contents left without any index.
+        return not os.path.exists(self.index_fn) and \
+            any(len(dirname) == 2 for dirname in os.listdir(self.cachedir))
 
-    def _lock(self, filename):
-        """Get a lock for the index file."""
-        lckfile = open(filename + '.lck', 'w')
-        fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-        return lckfile
+    def _open_index(self):
+        self.conn = sqlite3.connect(self.index_fn, timeout=self.TIMEOUT, isolation_level=None)
+        self.conn.text_factory = str
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entry '
+                          '(key BLOB PRIMARY KEY, prefix BLOB NOT NULL, mtime INTEGER NOT NULL, '
+                          'hash TEXT NOT NULL, filename TEXT NOT NULL, atime REAL NOT NULL)')
+        if 'atime' not in [column[1] for column in self.conn.execute('PRAGMA table_info(entry)')]:
+            # Index created before the quota.
+            self.conn.execute('ALTER TABLE entry ADD COLUMN atime REAL NOT NULL DEFAULT 0')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entry_prefix ON entry (prefix, mtime)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entry_mtime ON entry (mtime)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entry_atime ON entry (atime)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS content '
+                          '(hash TEXT PRIMARY KEY, refcount INTEGER NOT NULL, size INTEGER NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS content_size (total INTEGER NOT NULL)')
+        self.conn.execute('INSERT INTO content_size SELECT COALESCE(SUM(size), 0) FROM content '
+                          'WHERE NOT EXISTS (SELECT 1 FROM content_size)')
+        self.conn.execute('CREATE TRIGGER IF NOT EXISTS content_insert AFTER INSERT ON content '
+                          'BEGIN UPDATE content_size SET total = total + NEW.size; END')
+        self.conn.execute('CREATE TRIGGER IF NOT EXISTS content_delete AFTER DELETE ON content '
+                          'BEGIN UPDATE content_size SET total = total - OLD.size; END')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _migrate(self):
+        """Import the shelve index used before SQLite and drop the rest.
+
+        Contents stay addressed by md5 and the hard links suffixed by a
+        refcount for collisions are removed in favor of the content table.
 
-    def _unlock(self, lckfile):
-        """Release the lock for the index file."""
-        fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-        lckfile.close()
+        """
+        entries = {}
+        try:
+            index = shelve.open(self.shelve_fn, flag='r', protocol=-1)
+        except anydbm.error:
+            # Missing or unreadable, the contents are orphans.
+            index = None
+        if index is not None:
+            for skey in index.keys():
+                key = pickle.loads(skey)
+                md5, filename = pickle.loads(index[skey])
+                # Keep only the latest mtime for the same prefix.
+                latest = entries.get(key[:-1])
+                if latest and int(latest[0][-1]) >= int(key[-1]):
+                    continue
+                if os.path.exists(self._cache_fn(md5)):
+                    entries[key[:-1]] = (key, md5, filename)
+            index.close()
+
+        with self._transaction() as conn:
+            for key, md5, filename in entries.values():
+                cursor = conn.execute('UPDATE content SET refcount = refcount + 1 WHERE hash = ?', (md5,))
+                if not cursor.rowcount:
+                    conn.execute('INSERT INTO content (hash, refcount, size) VALUES (?, 1, ?)',
+                                 (md5, os.path.getsize(self._cache_fn(md5))))
+                # Never accessed, so evicted first.
+                conn.execute('INSERT INTO entry (key, prefix, mtime, hash, filename, atime) '
+                             'VALUES (?, ?, ?, ?, ?, 0)',
+                             (sqlite3.Binary(_dumps(key)), sqlite3.Binary(_dumps(key[:-1])),
+                              int(key[-1]), md5, filename))
+            self._remove_orphans(conn)
+            for filename in glob.glob(self.shelve_fn + '*'):
+                os.unlink(filename)
+
+    @contextmanager
+    def _transaction(self):
+        """Serialize changes to the index and files with other processes."""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except:
+            self.conn.execute('ROLLBACK')
+            raise
+        self._flush(self.conn)
+        self.conn.execute('COMMIT')
+
+    def _flush(self, conn):
+        """Write the access times and counters accumulated by reads."""
+        if self.atimes:
+            conn.executemany('UPDATE entry SET atime = ? WHERE key = ?',
+                             [(atime, sqlite3.Binary(skey)) for skey, atime in self.atimes.items()])
+            self.atimes.clear()
+        for name, value in self.counters.items():
+            conn.execute('INSERT OR REPLACE INTO stats (name, value) VALUES '
+                         '(?, COALESCE((SELECT value FROM stats WHERE name = ?), 0) + ?)',
+                         (name, name, value))
+        self.counters.clear()
+
+    def close(self):
+        """Write pending access times and counters and close the index."""
+        if self.atimes or self.counters:
+            with self._transaction():
+                pass
+        self.conn.close()
 
-    def _open_index(self):
-        """Open the index file for the cache / container."""
-        lckfile = self._lock(self.index_fn)
-        index = shelve.open(self.index_fn, protocol=-1)
-        # Store a reference to the lckfile to avoid to be closed by gc
-        index.lckfile = lckfile
-        return index
-
-    def _close_index(self, index):
-        """Close the index file for the cache / container."""
-        index.close()
-        self._unlock(index.lckfile)
-
-    def _clean_cache(self, ttl=14*24*60*60, index=None):
-        """Remove elements in the cache that share the same prefix of the key
-        (all except the mtime), and keep the latest one.  Also remove
-        old entries based on the TTL.
+    def _cache_fn(self, digest):
+        return os.path.join(self.cachedir, digest[:2], digest[2:])
+
+    def _acquire(self, conn, digest, filename):
+        """Reference the content digest, storing filename if it is new."""
+        cursor = conn.execute('UPDATE content SET refcount = refcount + 1 WHERE hash = ?', (digest,))
+        if cursor.rowcount:
+            return
+
+        cache_fn = self._cache_fn(digest)
+        dirname = os.path.dirname(cache_fn)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        os.link(filename, cache_fn)
+        conn.execute('INSERT INTO content (hash, refcount, size) VALUES (?, 1, ?)',
+                     (digest, os.path.getsize(cache_fn)))
+
+    def _release(self, conn, digest):
+        """Drop a reference to the content digest removing the file if unused."""
+        conn.execute('UPDATE content SET refcount = refcount - 1 WHERE hash = ?', (digest,))
+        if conn.execute('SELECT refcount FROM content WHERE hash = ?', (digest,)).fetchone()[0] > 0:
+            return
+
+        conn.execute('DELETE FROM content WHERE hash = ?', (digest,))
+        cache_fn = self._cache_fn(digest)
+        try:
+            os.unlink(cache_fn)
+        except OSError:
+            # Already removed behind the back of the index.
+            pass
+        try:
+            # Only succeeds if the directory is empty.
+            os.rmdir(os.path.dirname(cache_fn))
+        except OSError:
+            pass
+
+    def _delete(self, conn, skey, digest):
+        conn.execute('DELETE FROM entry WHERE key = ?', (sqlite3.Binary(skey),))
+        self._release(conn, digest)
+
+    def _evict(self, conn):
+        """Remove the least recently accessed entries beyond the quota."""
+        self._flush(conn)
+        evicted = 0
+        while conn.execute('SELECT total FROM content_size').fetchone()[0] > self.quota:
+            row = conn.execute('SELECT key, hash FROM entry ORDER BY atime LIMIT 1').fetchone()
+            if row is None:
+                break
+            self._delete(conn, str(row[0]), row[1])
+            evicted += 1
+
+        if evicted:
+            self._count('evicted', evicted)
+        return evicted
+
+    def _remove_orphans(self, conn):
+        """Remove files unknown to the index and return how many."""
+        orphaned = 0
+        for dirname in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, dirname)
+            if len(dirname) != 2 or not os.path.isdir(path):
+                continue
+            for filename in os.listdir(path):
+                if not conn.execute('SELECT 1 FROM content WHERE hash = ?',
+                                    (dirname + filename,)).fetchone():
+                    os.unlink(os.path.join(path, filename))
+                    orphaned += 1
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        return orphaned
+
+    def _count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def _lookup(self, key):
+        """Return (digest, filename) for key and mark it as accessed."""
+        skey = _dumps(key)
+        row = self.conn.execute('SELECT hash, filename FROM entry WHERE key = ?',
+                                (sqlite3.Binary(skey),)).fetchone()
+        if row is not None:
+            self.atimes[skey] = time.time()
+        return row
+
+    def _clean_cache(self, ttl=14*24*60*60):
+        """Remove old entries based on the TTL.
+
+        Entries sharing the same prefix of the key (all except the mtime)
+        are already replaced by the latest one when added.
 
         """
-        _i = self._open_index() if index is None else index
-
-        # Ugly hack to assure that the key is serialized always with
-        # the same pickle format.  Pickle do not guarantee that the
-        # same object is serialized always in the same string.
-        skeys = {pickle.loads(key): key for key in _i}
-        keys = sorted(skeys)
-
-        now = int(time.time())
-        last = None
-        for key in keys:
-            if last and last[:-1] == key[:-1]:
-                self.__delitem__(key=skeys[last], skey=True, index=_i)
-                last = key
-            elif now - int(key[-1]) >= ttl:
-                self.__delitem__(key=skeys[key], skey=True, index=_i)
-            else:
-                last = key
-
-        if index is None:
-            self._close_index(_i)
-
-    def __getitem__(self, key, index=None):
+        expire = int(time.time()) - ttl
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT key, hash FROM entry WHERE mtime <= ?', (expire,)).fetchall()
+            for skey, digest in rows:
+                self._delete(conn, str(skey), digest)
+
+    def __getitem__(self, key):
         """Get a element in the cache.
 
         For the container perspective, the key is a tuple like this:
         (project, repository, arch, package, filename, mtime)
 
         """
-        _i = self._open_index() if index is None else index
-
-        key = pickle.dumps(key, protocol=-1)
-        value = pickle.loads(_i[key])
-
-        if index is None:
-            self._close_index(_i)
-
-        return value
-
-    def __setitem__(self, key, value, index=None):
+        row = self._lookup(key)
+        self._count('hit' if row else 'miss')
+        if row is None:
+            raise KeyError(key)
+        return tuple(row)
+
+    def __contains__(self, key):
+        row = self._lookup(key)
+        self._count('hit' if row else 'miss')
+        return row is not None
+
+    def __setitem__(self, key, value):
         """Add a new file in the cache. 'value' is expected to contains the
         path of file.
 
         """
-        _i = self._open_index() if index is None else index
-
-        key = pickle.dumps(key, protocol=-1)
-
-        original_value = value
-
-        md5 = hashlib.md5(open(value, 'rb').read()).hexdigest()
-        filename = os.path.basename(value)
-        value = (md5, filename)
-        value = pickle.dumps(value, protocol=-1)
-        _i[key] = value
-
-        # Move the file into the container using a hard link
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        if os.path.exists(cache_fn):
-            # Manage collisions using hard links and refcount
-            collisions = sorted(glob.glob(cache_fn + '-*'))
-            next_refcount = 1
-            if collisions:
-                next_refcount = int(collisions[-1][-3:]) + 1
-            next_cache_fn = cache_fn + '-%03d' % next_refcount
-            os.link(cache_fn, next_cache_fn)
-        else:
-            dirname = os.path.dirname(cache_fn)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            os.link(original_value, cache_fn)
-
-        if index is None:
-            self._close_index(_i)
-
-    def __delitem__(self, key, skey=False, index=None):
+        digest = _digest(value)
+        skey = _dumps(key)
+        prefix = sqlite3.Binary(_dumps(key[:-1]))
+
+        with self._transaction() as conn:
+            # Move the file into the container using a hard link, before
+            # releasing a previous value which may be the same content.
+            self._acquire(conn, digest, value)
+
+            row = conn.execute('SELECT hash FROM entry WHERE key = ?', (sqlite3.Binary(skey),)).fetchone()
+            if row:
+                self._delete(conn, skey, row[0])
+
+            # Keep only the latest mtime for the same prefix.
+            rows = conn.execute('SELECT key, hash, mtime FROM entry WHERE prefix = ?', (prefix,)).fetchall()
+            if any(mtime > int(key[-1]) for _, _, mtime in rows):
+                self._release(conn, digest)
+                return
+            for old_skey, old_digest, _ in rows:
+                self._delete(conn, str(old_skey), old_digest)
+
+            conn.execute('INSERT INTO entry (key, prefix, mtime, hash, filename, atime) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (sqlite3.Binary(skey), prefix, int(key[-1]), digest,
+                          os.path.basename(value), time.time()))
+
+            if self.quota:
+                self._evict(conn)
+
+    def __delitem__(self, key):
         """Remove a file from the cache."""
-        _i = self._open_index() if index is None else index
+        skey = _dumps(key)
+        with self._transaction() as conn:
+            row = conn.execute('SELECT hash FROM entry WHERE key = ?', (sqlite3.Binary(skey),)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            self._delete(conn, skey, row[0])
 
-        key = pickle.dumps(key, protocol=-1) if not skey else key
-        value = pickle.loads(_i[key])
+    def keys(self):
+        return [pickle.loads(str(row[0])) for row in self.conn.execute('SELECT key FROM entry')]
 
-        md5, _ = value
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM entry').fetchone()[0]
 
-        # Remove the file (taking care of collision) and the directory
-        # if it is empty
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        collisions = sorted(glob.glob(cache_fn + '-*'))
-        if collisions:
-            os.unlink(collisions[-1])
-        else:
-            os.unlink(cache_fn)
+    def linkto(self, key, target):
+        """Create a link between the cached object and the target
 
-        dirname = os.path.dirname(cache_fn)
-        if not os.listdir(dirname):
-            os.rmdir(dirname)
+        The link is made in a transaction so that other processes cannot
+        remove the content meanwhile. Content removed behind the back of the
+        index is dropped and raises KeyError like a missing key.
+
+        """
+        with self._transaction() as conn:
+            row = self._lookup(key)
+            if row is None:
+                raise KeyError(key)
+            digest = row[0]
+            if os.path.exists(self._cache_fn(digest)):
+                os.link(self._cache_fn(digest), target)
+                return
+            conn.execute('DELETE FROM entry WHERE hash = ?', (digest,))
+            conn.execute('DELETE FROM content WHERE hash = ?', (digest,))
+        raise KeyError(key)
+
+    def gc(self, ttl=14*24*60*60):
+        """Expire entries, enforce the quota and repair the index.
+
+        Files removed behind the back of the index, like by find -delete,
+        are dropped together with the entries referencing them while files
+        unknown to the index are removed. Return a dictionary of counts.
 
-        del _i[key]
+        """
+        result = {'expired': len(self), 'missing': 0, 'orphaned': 0, 'evicted': 0}
+        self._clean_cache(ttl)
+        result['expired'] -= len(self)
 
-        if index is None:
-            self._close_index(_i)
+        with self._transaction() as conn:
+            for digest, in conn.execute('SELECT hash FROM content').fetchall():
+                if not os.path.exists(self._cache_fn(digest)):
+                    conn.execute('DELETE FROM entry WHERE hash = ?', (digest,))
+                    conn.execute('DELETE FROM content WHERE hash = ?', (digest,))
+                    result['missing'] += 1
 
-    def keys(self, index=None):
-        _i = self._open_index() if index is None else index
+            result['orphaned'] = self._remove_orphans(conn)
 
-        keys = [pickle.loads(key) for key in _i]
+            if self.quota:
+                result['evicted'] = self._evict(conn)
 
-        if index is None:
-            self._close_index(_i)
+        return result
 
-        return keys
+    def stats(self):
+        """Return a dictionary describing the contents and their use.
 
-    def linkto(self, key, target, index=None):
-        """Create a link between the cached object and the target"""
-        _i = self._open_index() if index is None else index
+        The number of hard links is taken from the files so links made by
+        linkto() are included in the bytes referenced.
 
-        md5, filename = self.__getitem__(key, index=_i)
-        if filename != target:
-            pass
-            # print 'Warning. The target name (%s) is different from the original name (%s)' % (target, filename)
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        os.link(cache_fn, target)
+        """
+        stats = dict(self.conn.execute('SELECT name, value FROM stats'))
+        for name, value in self.counters.items():
+            stats[name] = stats.get(name, 0) + value
+        stats['entries'] = len(self)
+        stats['contents'], stats['references'] = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(refcount), 0) FROM content').fetchone()
+        stats['bytes'] = self.conn.execute('SELECT total FROM content_size').fetchone()[0]
+
+        stats['links'] = stats['bytes_linked'] = 0
+        for digest, size in self.conn.execute('SELECT hash, size FROM content'):
+            try:
+                nlink = os.stat(self._cache_fn(digest)).st_nlink
+            except OSError:
+                continue
+            stats['links'] += nlink
+            stats['bytes_linked'] += nlink * size
 
-        if index is None:
-            self._close_index(_i)
+        return stats
@@ -0,0 +1,151 @@
+from __future__ import print_function
+
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+import random
+import sys
+import threading
+import time
+import urllib2
+import urlparse
+
+
+class CircuitOpenError(urllib2.URLError):
+    """
+    Raised instead of making a request to a host which keeps failing.
+    """
+
+    def __init__(self, host, retry_in):
+        urllib2.URLError.__init__(self, 'too many failures for {}, retry in {:.0f}s'.format(host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+class Retry(object):
+    """
+    Retry requests failing due to server errors or the server being
+    unreachable.
+
+    Attempts are spaced by a capped exponential backoff with full jitter so
+    that bots running in parallel do not retry in lockstep, unless the server
+    provides a Retry-After header. After ATTEMPTS the last error is raised.
+
+    Requests which are not idempotent, like POST and PUT, are only retried on
+    server errors since the server may have acted on a request whose
+    connection failed.
+
+    Consecutive failures are counted per host. Once FAILURE_THRESHOLD is
+    reached the circuit for the host opens and requests fail immediately with
+    CircuitOpenError for RESET_TIMEOUT seconds, after which a single request
+    is let through to probe whether the server recovered.
+    """
+
+    ATTEMPTS = 8
+    BACKOFF_BASE = 1
+    BACKOFF_CAP = 60
+    RETRY_AFTER_CAP = 300
+    FAILURE_THRESHOLD = 10
+    RESET_TIMEOUT = 60
+
+    # host: [consecutive failures, time circuit opened or None]
+    circuits = {}
+    lock = threading.Lock()
+    sleep = staticmethod(time.sleep)
+
+    @staticmethod
+    def request(func, url, data=None, log=None, idempotent=True):
+        """
+        Call func(url) or func(url, data=data) retrying on failure.
+        """
+        host = urlparse.urlparse(url).netloc
+        attempt = 0
+        while True:
+            Retry.circuit_check(host)
+            attempt += 1
+            try:
+                if data is not None:
+                    ret = func(url, data=data)
+                else:
+                    ret = func(url)
+            except urllib2.URLError as e:
+                if not Retry.retryable(e, idempotent):
+                    raise
+                Retry.circuit_failure(host)
+                if attempt >= Retry.ATTEMPTS:
+                    raise
+
+                delay = Retry.delay(attempt, e)
+                message = 'Error {}, retrying {} in {:.1f}s ({}/{})'.format(
+                    getattr(e, 'code', e.reason), url, delay, attempt, Retry.ATTEMPTS - 1)
+                (log or Retry.log)(message)
+                Retry.sleep(delay)
+                continue
+
+            Retry.circuit_success(host)
+            return ret
+
+    @staticmethod
+    def retryable(e, idempotent=True):
+        if isinstance(e, CircuitOpenError):
+            return False
+        if isinstance(e, urllib2.HTTPError):
+            return 500 <= e.code <= 599 or (idempotent and e.code == 429)
+        # Server could not be reached or the connection failed.
+        return idempotent
+
+    @staticmethod
+    def delay(attempt, e=None):
+        retry_after = Retry.retry_after(e) if isinstance(e, urllib2.HTTPError) else None
+        if retry_after is not None:
+            return min(retry_after, Retry.RETRY_AFTER_CAP)
+
+        return random.uniform(0, min(Retry.BACKOFF_CAP, Retry.BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def retry_after(e):
+        """
+        Return the delay in seconds requested by the Retry-After header.
+        """
+        value = e.hdrs.get('Retry-After') if e.hdrs else None
+        if not value:
+            return None
+
+        if value.strip().isdigit():
+            return int(value)
+
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, mktime_tz(date) - time.time())
+
+    @staticmethod
+    def circuit_check(host):
+        with Retry.lock:
+            circuit = Retry.circuits.get(host)
+            if circuit is None or circuit[1] is None:
+                return
+
+            elapsed = time.time() - circuit[1]
+            if elapsed < Retry.RESET_TIMEOUT:
+                raise CircuitOpenError(host, Retry.RESET_TIMEOUT - elapsed)
+
+            # Half-open: let this request through and keep the others out
+            # until it completes.
+            circuit[1] = time.time()
+
+    @staticmethod
+    def circuit_failure(host):
+        with Retry.lock:
+            circuit = Retry.circuits.setdefault(host, [0, None])
+            circuit[0] += 1
+            if circuit[0] >= Retry.FAILURE_THRESHOLD:
+                circuit[1] = time.time()
+
+    @staticmethod
+    def circuit_success(host):
+        with Retry.lock:
+            Retry.circuits.pop(host, None)
+
+    @staticmethod
+    def log(message):
+        print(message, file=sys.stderr)
@@ -50,6 +50,8 @@ from osclib.cache import Cache
 from osclib.comments import CommentAPI
 from osclib.ignore_command import IgnoreCommand
 from osclib.memoize import memoize
+from osclib.retry import Retry
+from osclib.xmlstream import iterelements
 
 
 class StagingAPI(object):
@@ -134,32 +136,17 @@ class StagingAPI(object):
         query = [] if not query else query
         return makeurl(self.apiurl, l, query)
 
-    def _retried_request(self, url, func, data=None):
-        retry_sleep_seconds = 1
-        while True:
-            try:
-                if data is not None:
-                    return func(url, data=data)
-                return func(url)
-            except urllib2.HTTPError, e:
-                if 500 <= e.code <= 599:
-                    print 'Error {}, retrying {} in {}s'.format(e.code, url, retry_sleep_seconds)
-                    time.sleep(retry_sleep_seconds)
-                    # increase sleep time up to one minute to avoid hammering
-                    # the server in case of real problems
-                    if (retry_sleep_seconds % 60):
-                        retry_sleep_seconds += 1
-                else:
-                    raise e
+    def _retried_request(self, url, func, data=None, idempotent=True):
+        return Retry.request(func, url, data, idempotent=idempotent)
 
     def retried_GET(self, url):
         return self._retried_request(url, http_GET)
 
     def retried_POST(self, url):
-        return self._retried_request(url, http_POST)
+        return self._retried_request(url, http_POST, idempotent=False)
 
     def retried_PUT(self, url, data):
-        return self._retried_request(url, http_PUT, data)
+        return self._retried_request(url, http_PUT, data, idempotent=False)
 
     def _generate_ring_packages(self, checklinks=False):
         """
@@ -179,9 +166,7 @@ class StagingAPI(object):
             }
 
             url = self.makeurl(['source', prj], query)
-            root = http_GET(url)
-
-            for si in ET.parse(root).getroot().findall('sourceinfo'):
+            for si in iterelements(http_GET(url), 'sourceinfo'):
                 pkg = si.get('package')
                 # XXX TODO - Test-DVD-x86_64 is hardcoded here
                 if pkg in ret and not pkg.startswith('Test-DVD-'):
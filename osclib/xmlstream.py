@@ -0,0 +1,40 @@
+from StringIO import StringIO
+
+try:
+    from xml.etree import cElementTree as ET
+except ImportError:
+    import cElementTree as ET
+
+
+def iterelements(source, tag):
+    """
+    Yield the children of the document root named tag as they are parsed.
+
+    Equivalent to ET.parse(source).getroot().findall(tag) without building the
+    whole tree: every child of the root is cleared and dropped once the loop
+    moves past it, so only one child is in memory at a time. Elements yielded
+    must thus not be kept, only the values read from them.
+
+    source is either a file-like object, like a response of http_GET(), or a
+    string containing the document.
+    """
+    if isinstance(source, basestring):
+        source = StringIO(source)
+
+    depth = 0
+    root = None
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if element.tag == tag:
+            yield element
+        element.clear()
+        del root[:]
@@ -0,0 +1,512 @@
+#!/usr/bin/python
+"""
+Generate a synthetic openSUSE:Factory the size of the real one to be served by
+the fake OBS of tests/obs.py.
+
+The fixtures under tests/fixtures model a handful of packages, which hides any
+cost growing with the size of the project. SyntheticFactory models instead, by
+default, 15000 packages spread over 3 rings, 26 letter stagings plus adi
+stagings, 500 open requests of which some are staged, a _builddepinfo with
+cycles and binary lists per architecture, all derived from a seed so that runs
+are comparable.
+
+The exchanges are in the format of the recordings of replay.py and may either
+be served directly, as scenario_benchmark.py --synthetic does, or written to a
+recording:
+
+    ./tests/benchmarks/fixture_generator.py --packages 15000 /tmp/factory.json
+"""
+
+from __future__ import print_function
+
+import argparse
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import random
+import string
+import sys
+import urllib
+from xml.sax.saxutils import escape
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import replay
+
+
+ARCHS = ('x86_64', 'i586')
+# Share of the packages in each ring, roughly that of openSUSE:Factory.
+RINGS = (
+    ('0-Bootstrap', 0.012),
+    ('1-MinimalX', 0.05),
+    ('2-TestDVD', 0.06),
+)
+# Packages only depend on packages of lower layers, apart from cycles, so the
+# depth of the dependency graph stays that of a real distribution.
+LAYERS = 12
+PREFIXES = ('', '', '', 'lib', 'python-', 'python3-', 'perl-', 'rubygem-', 'ghc-', 'golang-', 'kf5-', 'nodejs-')
+SUFFIXES = ('', '', '', '-utils', '-tools', '-devel-doc', '-plugins', '-bindings')
+DEVEL_PROJECTS = ('Base:System', 'devel:languages:python', 'devel:languages:perl', 'devel:languages:ruby',
+                  'devel:languages:haskell', 'devel:languages:go', 'KDE:Frameworks5', 'GNOME:Factory',
+                  'devel:tools', 'network', 'science', 'multimedia:libs', 'X11:XOrg', 'server:database')
+REVIEW_GROUPS = ('factory-auto', 'opensuse-review-team', 'legal-auto')
+# Share of the open requests staged by default, the rest waiting to be staged.
+STAGED = 0.3
+# Enough packages for the rings to hold the cycles and for the duplicates.
+PACKAGES_MIN = 100
+# Requests waiting to be staged taken by the select and adi scenarios.
+WAITING_MIN = 3
+STATES = ('acceptable', 'building', 'failed', 'review', 'testing')
+
+
+def md5(*values):
+    return hashlib.md5(':'.join(str(value) for value in values)).hexdigest()
+
+
+def timestamp(when):
+    return when.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class SyntheticFactory(object):
+    """
+    Deterministic model of a large project and its staging workflow, rendered
+    into the responses the OBS API would give through exchanges().
+
+    Unless given, the share STAGED of the open requests is staged.
+    """
+
+    def __init__(self, project='openSUSE:Factory', packages=15000, requests=500, staged=None,
+                 adi=10, cycles=12, seed=0):
+        staged = self.validate(packages, requests, staged)
+        self.project = project
+        self.seed = seed
+        self.cstaging = project + ':Staging'
+        self.crings = project + ':Rings'
+        self.rand = rand = random.Random(seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+
+        names = set()
+        while len(names) < packages:
+            names.add('{}{}{}'.format(rand.choice(PREFIXES), self.word(), rand.choice(SUFFIXES)))
+        self.packages = sorted(names)
+
+        # Rings hold the lowest layers since they are the base of everything.
+        order = list(self.packages)
+        rand.shuffle(order)
+        self.layer = dict((package, i * LAYERS // packages) for i, package in enumerate(order))
+        self.rings = []
+        start = 0
+        for name, share in RINGS:
+            end = start + max(1, int(packages * share))
+            self.rings.append(('{}:{}'.format(self.crings, name), sorted(order[start:end])))
+            start = end
+        self.ring = dict((package, ring) for ring, members in self.rings for package in members)
+
+        self.devel = dict((package, rand.choice(DEVEL_PROJECTS)) for package in self.packages)
+        self.subpkgs = {}
+        for package in self.packages:
+            subpkgs = [package]
+            for suffix in rand.sample(('-devel', '-doc', '-lang', '-32bit', '-debugsource', '-tests'),
+                                      rand.randint(0, 3)):
+                subpkgs.append(package + suffix)
+            self.subpkgs[package] = subpkgs
+
+        self.deps = {}
+        for package in self.packages:
+            # order is sorted by layer.
+            lower = order[:self.layer[package] * packages // LAYERS]
+            deps = rand.sample(lower, min(len(lower), rand.randint(2, 12)))
+            self.deps[package] = set(rand.choice(self.subpkgs[dep]) for dep in deps)
+
+        # Cycles among the ring packages, like those of the toolchain.
+        self.cycles = []
+        ring_packages = sorted(self.ring)
+        for i in range(cycles):
+            cycle = rand.sample(ring_packages, rand.randint(2, 4))
+            for package, dep in zip(cycle, cycle[1:] + cycle[:1]):
+                self.deps[package].add(self.subpkgs[dep][0])
+            self.cycles.append(cycle)
+
+        # Binaries built by more than one package.
+        self.duplicates = dict((package, rand.choice(self.packages)) for package in rand.sample(self.packages, 20))
+
+        self.requests_generate(requests, staged, adi)
+
+    @staticmethod
+    def validate(packages, requests, staged=None):
+        """Return the number of staged requests or raise ValueError for sizes not modeled."""
+        if staged is None:
+            staged = int(requests * STAGED)
+        if packages < PACKAGES_MIN:
+            raise ValueError('at least {} packages are needed, not {}'.format(PACKAGES_MIN, packages))
+        if requests > packages:
+            raise ValueError('{} open requests exceed the {} packages'.format(requests, packages))
+        if not 0 <= staged <= requests - WAITING_MIN:
+            raise ValueError('{} staged of {} open requests leaves less than {} waiting'.format(
+                staged, requests, WAITING_MIN))
+        return staged
+
+    def word(self):
+        return ''.join(self.rand.choice(string.ascii_lowercase) for i in range(self.rand.randint(3, 9)))
+
+    def requests_generate(self, count, staged, adi):
+        rand = self.rand
+        self.stagings = dict((letter, []) for letter in string.ascii_uppercase)
+        self.stagings.update(('adi:{}'.format(i + 1), []) for i in range(adi))
+        self.requests = []
+
+        # Letter stagings left empty for the splitter to fill.
+        empty = set(rand.sample(string.ascii_uppercase, 6))
+        letters = sorted(name for name in self.stagings if len(name) == 1 and name not in empty)
+        others = sorted(name for name in self.stagings if name not in empty)
+        for i, package in enumerate(rand.sample(self.packages, count)):
+            request = {
+                'id': 500000 + i,
+                'package': package,
+                'type': 'delete' if rand.random() < 0.03 else 'submit',
+                'source': self.devel[package] if rand.random() < 0.9 else 'home:{}'.format(self.word()),
+                'creator': self.word(),
+                'created': self.now - timedelta(seconds=rand.randint(600, 14 * 24 * 3600)),
+                'staging': None,
+            }
+            if i < staged:
+                # Ring packages are only staged in letter stagings.
+                staging = rand.choice(letters if package in self.ring else others)
+                request['staging'] = '{}:{}'.format(self.cstaging, staging)
+                self.stagings[staging].append(request)
+            self.requests.append(request)
+
+    def request_xml(self, request):
+        created = request['created']
+        lines = ['<request id="{}" creator="{}">'.format(request['id'], request['creator'])]
+        lines.append('  <action type="{}">'.format(request['type']))
+        if request['type'] == 'submit':
+            lines.append('    <source project="{}" package="{}" rev="{}"/>'.format(
+                request['source'], request['package'], md5(request['id'], 'rev')))
+        lines.append('    <target project="{}" package="{}"/>'.format(self.project, request['package']))
+        lines.append('  </action>')
+        lines.append('  <state name="review" who="{}" when="{}">'.format(request['creator'], timestamp(created)))
+        lines.append('    <comment/>')
+        lines.append('  </state>')
+
+        reviewed = timestamp(created + timedelta(minutes=5))
+        for group in REVIEW_GROUPS:
+            lines.append('  <review state="accepted" when="{0}" who="{1}" by_group="{1}">'.format(reviewed, group))
+            lines.append('    <comment>ok</comment>')
+            lines.append('  </review>')
+        lines.append('  <review state="{}" when="{}" who="{}" by_group="{}">'.format(
+            'accepted' if request['staging'] else 'new', reviewed, 'staging-bot', 'factory-staging'))
+        lines.append('    <comment/>')
+        lines.append('  </review>')
+        if request['staging']:
+            lines.append('  <review state="new" when="{}" by_project="{}">'.format(reviewed, request['staging']))
+            lines.append('    <comment>Being evaluated by staging project "{}"</comment>'.format(request['staging']))
+            lines.append('  </review>')
+        lines.append('  <review state="new" when="{}" by_user="factory-repo-checker">'.format(reviewed))
+        lines.append('    <comment/>')
+        lines.append('  </review>')
+
+        lines.append('  <history who="{}" when="{}">'.format(request['creator'], timestamp(created)))
+        lines.append('    <description>Request created</description>')
+        lines.append('  </history>')
+        lines.append('  <description>Update {} to {}.{}</description>'.format(
+            request['package'], request['id'] % 7, request['id'] % 13))
+        lines.append('</request>')
+        return '\n'.join(lines) + '\n'
+
+    def waiting(self):
+        """Return the open requests not yet staged."""
+        return [request for request in self.requests if not request['staging']]
+
+    def collection(self, requests):
+        return '<collection matches="{}">\n{}</collection>\n'.format(
+            len(requests), ''.join(self.request_xml(request) for request in requests))
+
+    def search_staging(self):
+        lines = ['<collection>']
+        for staging in sorted(self.stagings):
+            lines.append('  <project name="{}:{}"/>'.format(self.cstaging, staging))
+        lines.append('</collection>')
+        return '\n'.join(lines) + '\n'
+
+    def staging_random(self, staging):
+        # Independent of the order the responses are generated in.
+        return random.Random('{}:{}'.format(self.seed, staging))
+
+    def pseudometa(self, staging):
+        requests = self.stagings.get(staging, [])
+        data = {'requests': [{'id': request['id'], 'package': request['package'], 'author': request['creator']}
+                             for request in requests]}
+        if requests and not staging.startswith('adi:'):
+            data['splitter_info'] = {
+                'activated': timestamp(min(request['created'] for request in requests)),
+                'group': self.devel[requests[0]['package']],
+                'strategy': {'name': self.staging_random(staging).choice(('devel', 'quick', 'super', 'none'))},
+            }
+        return yaml.dump(data, default_flow_style=False)
+
+    def staging_status(self, staging):
+        requests = self.stagings[staging]
+        rand = self.staging_random(staging)
+        state = rand.choice(STATES) if requests else 'empty'
+        broken = []
+        if state == 'failed':
+            broken = [{'package': request['package'], 'project': '{}:{}'.format(self.cstaging, staging),
+                       'repository': 'standard', 'arch': rand.choice(ARCHS), 'state': 'failed'}
+                      for request in requests[:2]]
+        return {
+            'name': '{}:{}'.format(self.cstaging, staging),
+            'description': self.pseudometa(staging),
+            'overall_state': state,
+            'selected_requests': [{'id': request['id'], 'package': request['package']} for request in requests],
+            'broken_packages': broken,
+            'building_repositories': ([{'repository': 'standard', 'arch': arch, 'state': 'building'}
+                                       for arch in ARCHS] if state == 'building' else []),
+            'missing_reviews': [],
+            'obsolete_requests': [],
+            'untracked_requests': [],
+            'openqa_jobs': [],
+            'subprojects': [],
+        }
+
+    def staging_meta(self, staging):
+        project = '{}:{}'.format(self.cstaging, staging)
+        lines = ['<project name="{}">'.format(project)]
+        lines.append('  <title>Staging {}</title>'.format(staging))
+        lines.append('  <description>{}</description>'.format(escape(self.pseudometa(staging))))
+        if not staging.startswith('adi:'):
+            # Every other letter staging is bootstrapped.
+            if ord(staging) % 2:
+                lines.append('  <link project="{}"/>'.format(self.rings[0][0]))
+            lines.append('  <link project="{}"/>'.format(self.rings[1][0]))
+        lines.append('  <link project="{}"/>'.format(self.project))
+        lines.append('  <repository name="standard" rebuild="direct" linkedbuild="all">')
+        lines.append('    <path project="{}" repository="standard"/>'.format(self.project))
+        lines.extend('    <arch>{}</arch>'.format(arch) for arch in ARCHS)
+        lines.append('  </repository>')
+        lines.append('</project>')
+        return '\n'.join(lines) + '\n'
+
+    def staging_project(self, staging):
+        mtime = self.now - timedelta(days=self.staging_random(staging).choice((1, 3, 5, 8)))
+        return ('<directory name="_project">\n'
+                '  <entry name="_frozenlinks" md5="{}" size="81720" mtime="{}"/>\n'
+                '  <entry name="_meta" md5="{}" size="1200" mtime="{}"/>\n'
+                '</directory>\n').format(md5(staging, 'frozenlinks'), mtime.strftime('%s'),
+                                         md5(staging, 'meta'), mtime.strftime('%s'))
+
+    def staging_history(self, staging):
+        return ('<revisionlist>\n'
+                '  <revision rev="1" vrev="1">\n'
+                '    <srcmd5>{}</srcmd5>\n'
+                '    <version>unknown</version>\n'
+                '    <time>{}</time>\n'
+                '    <user>staging-bot</user>\n'
+                '  </revision>\n'
+                '</revisionlist>\n').format(md5(staging, 'meta'), self.now.strftime('%s'))
+
+    def project_meta(self):
+        lines = ['<project name="{}">'.format(self.project)]
+        lines.append('  <title>The next openSUSE distribution</title>')
+        lines.append('  <description/>')
+        for name in ('snapshot', 'standard'):
+            lines.append('  <repository name="{}">'.format(name))
+            lines.extend('    <arch>{}</arch>'.format(arch) for arch in ARCHS)
+            lines.append('  </repository>')
+        lines.append('</project>')
+        return '\n'.join(lines) + '\n'
+
+    def package_meta(self, project, package):
+        devel = ''
+        if project == self.project:
+            devel = '  <devel project="{}" package="{}"/>\n'.format(self.devel[package], package)
+        return ('<package name="{0}" project="{1}">\n'
+                '  <title>{0}</title>\n'
+                '  <description/>\n'
+                '{2}'
+                '</package>\n').format(package, project, devel)
+
+    def directory(self):
+        lines = ['<directory count="{}">'.format(len(self.packages))]
+        lines.extend('  <entry name="{}"/>'.format(package) for package in self.packages)
+        lines.append('</directory>')
+        return '\n'.join(lines) + '\n'
+
+    def ring_sourceinfo(self, members):
+        lines = ['<sourceinfolist>']
+        for package in members:
+            lines.append('  <sourceinfo package="{0}" rev="{1}" vrev="1" srcmd5="{2}" verifymd5="{3}">'.format(
+                package, len(package), md5(package, 'src'), md5(package, 'verify')))
+            lines.append('    <linked project="{}" package="{}"/>'.format(self.project, package))
+            lines.append('  </sourceinfo>')
+        lines.append('</sourceinfolist>')
+        return '\n'.join(lines) + '\n'
+
+    def source_info(self, project, package):
+        return ('<sourceinfo package="{0}" rev="{1}" vrev="1" srcmd5="{2}" verifymd5="{3}">\n'
+                '  <filename>{0}.spec</filename>\n'
+                '</sourceinfo>\n').format(package, len(package), md5(project, package, 'src'),
+                                           md5(project, package, 'verify'))
+
+    def source_directory(self, project, package):
+        return ('<directory name="{0}" rev="{1}" vrev="1" srcmd5="{2}">\n'
+                '  <entry name="{0}.changes" md5="{3}" size="{4}" mtime="1500000000"/>\n'
+                '  <entry name="{0}.spec" md5="{5}" size="{6}" mtime="1500000000"/>\n'
+                '</directory>\n').format(package, len(package), md5(project, package, 'src'),
+                                          md5(package, 'changes'), len(package) * 613,
+                                          md5(package, 'spec'), len(package) * 211)
+
+    def binarylist(self, package, arch):
+        version = '{}.{}-{}.1'.format(len(package) % 5, self.layer[package], len(self.subpkgs[package]))
+        files = ['{}-{}.src.rpm'.format(package, version)]
+        for subpkg in self.subpkgs[package]:
+            files.append('{}-{}.{}.rpm'.format(subpkg, version, 'noarch' if subpkg.endswith('-doc') else arch))
+        if package in self.duplicates:
+            files.append('{}-{}.{}.rpm'.format(self.duplicates[package], version, arch))
+        files.extend(('_statistics', 'rpmlint.log'))
+        return '<binarylist>\n{}</binarylist>\n'.format(''.join(
+            '  <binary filename="{}" size="{}" mtime="1500000000"/>\n'.format(filename, len(filename) * 997)
+            for filename in files))
+
+    def builddepinfo(self, extra=None):
+        """
+        Return the _builddepinfo document, extra mapping packages to further
+        dependencies like those introduced by a staging.
+        """
+        extra = extra or {}
+        lines = ['<builddepinfo>']
+        for package in self.packages:
+            lines.append('  <package name="{}">'.format(package))
+            lines.append('    <source>{}</source>'.format(package))
+            lines.extend('    <subpkg>{}</subpkg>'.format(subpkg) for subpkg in self.subpkgs[package])
+            deps = self.deps[package] | set(extra.get(package, ()))
+            lines.extend('    <pkgdep>{}</pkgdep>'.format(dep) for dep in sorted(deps))
+            lines.append('  </package>')
+        for cycle in self.cycles:
+            lines.append('  <cycle>')
+            lines.extend('    <package>{}</package>'.format(package) for package in sorted(cycle))
+            lines.append('  </cycle>')
+        lines.append('</builddepinfo>')
+        return '\n'.join(lines) + '\n'
+
+    def staging_cycle(self, staging):
+        """
+        Return the dependencies making packages of staging, or those of the
+        requests waiting to be staged if it is empty, a new cycle.
+        """
+        requests = self.stagings[staging] or self.waiting()
+        packages = [request['package'] for request in requests if request['type'] == 'submit'][:3]
+        return dict((package, [self.subpkgs[dep][0]])
+                    for package, dep in zip(packages, packages[1:] + packages[:1]))
+
+    def exchanges(self, staging='B'):
+        """
+        Yield (method, uri, status, content type, body) tuples for the fake
+        OBS. Queries of searches are replaced by * to match whatever xpath the
+        client builds and requests changing the state are all acknowledged.
+        The _builddepinfo of staging contains a new cycle for CycleDetector.
+        """
+        xml = 'application/xml'
+        project = self.project
+
+        def get(path, body, query=None, content_type=xml):
+            if query:
+                path += '?' + (query if query == '*' else urllib.urlencode(sorted(query.items())))
+            return ('GET', path, 200, content_type, body)
+
+        yield get('/source/{}/_meta'.format(project), self.project_meta())
+        yield get('/source/{}'.format(project), self.directory(), {'expand': 1})
+        # Only the requests waiting to be staged are searched for.
+        yield get('/search/request', self.collection(self.waiting()), '*')
+        query = {'states': 'new,review', 'project': project, 'view': 'collection'}
+        yield get('/request', self.collection(self.requests), query)
+        yield get('/search/project/id', self.search_staging(), '*')
+        yield get('/statistics/latest_updated', '<latest_updated/>\n', '*')
+        yield get('/source/{}/dashboard/ignored_requests'.format(self.cstaging), '', '*')
+        yield get('/source/{}/dashboard/config'.format(self.cstaging), '', '*')
+
+        for ring, members in self.rings:
+            yield get('/source/{}'.format(ring), self.ring_sourceinfo(members), {'view': 'info', 'nofilename': 1})
+
+        stagings = sorted(self.stagings)
+        yield get('/project/staging_projects/{}'.format(project),
+                  json.dumps([self.staging_status(name) for name in stagings]), {'format': 'json'},
+                  'application/json')
+        for name in stagings:
+            yield get('/project/staging_projects/{}/{}'.format(project, name),
+                      json.dumps(self.staging_status(name)), {'format': 'json'}, 'application/json')
+            yield get('/source/{}:{}/_project'.format(self.cstaging, name), self.staging_project(name),
+                      {'meta': 1})
+
+        # Including the adi staging AdiCommand creates, since writes change
+        # nothing.
+        created = 'adi:{}'.format(sum(name.startswith('adi:') for name in stagings) + 1)
+        for name in stagings + [created]:
+            prj = '{}:{}'.format(self.cstaging, name)
+            yield get('/source/{}/_meta'.format(prj), self.staging_meta(name))
+            yield get('/source/{}/_project/_history'.format(prj), self.staging_history(name), {'meta': 1})
+            yield get('/comments/project/{}'.format(prj), '<comments project="{}"/>\n'.format(prj))
+
+        for request in self.requests:
+            body = self.request_xml(request)
+            yield get('/request/{}'.format(request['id']), body)
+            yield get('/request/{}'.format(request['id']), body, {'withfullhistory': 1})
+            yield get('/request', self.collection([request]), dict(query, package=request['package']))
+            if request['type'] == 'submit':
+                yield get('/source/{}/{}'.format(request['source'], request['package']),
+                          self.source_info(request['source'], request['package']),
+                          {'rev': md5(request['id'], 'rev'), 'view': 'info'})
+                yield get('/source/{}/{}'.format(request['source'], request['package']),
+                          self.source_directory(request['source'], request['package']),
+                          {'rev': md5(request['id'], 'rev'), 'expand': 1})
+
+        for package in self.packages:
+            for prj in (project, self.devel[package]):
+                yield get('/source/{}/{}/_meta'.format(prj, package), self.package_meta(prj, package))
+            for arch in ARCHS:
+                yield get('/build/{}/standard/{}/{}'.format(project, arch, package), self.binarylist(package, arch))
+
+        builddepinfo = self.builddepinfo()
+        builddepinfo_staging = self.builddepinfo(self.staging_cycle(staging))
+        for arch in ARCHS:
+            yield get('/build/{}/standard/{}/_builddepinfo'.format(project, arch), builddepinfo)
+            yield get('/build/{}:{}/standard/{}/_builddepinfo'.format(self.cstaging, staging, arch),
+                      builddepinfo_staging)
+
+        for method in ('POST', 'PUT', 'DELETE'):
+            yield (method, '*', 200, xml, replay.WRITE_RESPONSE)
+
+
+def main(args):
+    factory = SyntheticFactory(args.project, args.packages, args.requests, args.staged, args.adi, seed=args.seed)
+    recorder = replay.Recorder()
+    for exchange in factory.exchanges():
+        recorder.add(*exchange)
+    recorder.save(args.output, {
+        'project': args.project,
+        'staging': 'B',
+        'requests': [request['package'] for request in factory.waiting()[:WAITING_MIN]],
+    })
+    print('{}: {} exchanges, {:.1f} MiB'.format(
+        args.output, len(recorder.exchanges), os.path.getsize(args.output) / 1024.0 ** 2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic large OBS project as a recording')
+    parser.add_argument('output', help='recording to write')
+    parser.add_argument('-p', '--project', default='openSUSE:Factory', help='project to generate')
+    parser.add_argument('--packages', type=int, default=15000, help='packages in the project')
+    parser.add_argument('--requests', type=int, default=500, help='open requests')
+    parser.add_argument('--staged', type=int,
+                        help='open requests already staged (default: {:.0f}%% of them)'.format(STAGED * 100))
+    parser.add_argument('--adi', type=int, default=10, help='adi stagings')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generator')
+    args = parser.parse_args()
+    try:
+        SyntheticFactory.validate(args.packages, args.requests, args.staged)
+    except ValueError as e:
+        parser.error(str(e))
+    main(args)
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""
+Benchmark memoize() call latency with concurrent processes.
+
+Each process calls the same persistently memoized function, as separate bots
+on a host would, with keys drawn from a shared key space so that calls are a
+mix of misses (writes) and hits (reads).
+
+    ./tests/benchmarks/memoize_benchmark.py --processes 1 4 16
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import osclib.memoize
+
+
+def worker(start, results, calls, keys, payload):
+    @osclib.memoize.memoize()
+    def benchmark_function(apiurl, key):
+        return payload
+
+    rand = random.Random(os.getpid())
+    latencies = []
+    start.wait()
+    for i in range(calls):
+        key = rand.randrange(keys)
+        before = time.time()
+        benchmark_function(None, key)
+        latencies.append(time.time() - before)
+    results.put(latencies)
+
+
+def run(processes, calls, keys, payload):
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker, args=(start, results, calls, keys, payload))
+               for i in range(processes)]
+    for process in workers:
+        process.start()
+
+    begin = time.time()
+    start.set()
+    latencies = []
+    for process in workers:
+        latencies.extend(results.get())
+    elapsed = time.time() - begin
+    for process in workers:
+        process.join()
+
+    return sorted(latencies), elapsed
+
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def main(args):
+    payload = 'x' * args.size
+    print('{:>9} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'processes', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'calls/s'))
+    for processes in args.processes:
+        osclib.memoize.CACHEDIR = tempfile.mkdtemp(prefix='memoize-benchmark-')
+        try:
+            latencies, elapsed = run(processes, args.calls, args.keys, payload)
+        finally:
+            shutil.rmtree(osclib.memoize.CACHEDIR)
+
+        print('{:>9} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>12.0f}'.format(
+            processes,
+            sum(latencies) / len(latencies) * 1000,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000,
+            len(latencies) / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark memoize() under concurrency')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 4, 16],
+                        help='number of concurrent processes to benchmark')
+    parser.add_argument('--calls', type=int, default=2000, help='calls made by each process')
+    parser.add_argument('--keys', type=int, default=512, help='number of distinct keys')
+    parser.add_argument('--size', type=int, default=1024, help='size of the memoized value')
+    args = parser.parse_args()
+    sys.exit(main(args))
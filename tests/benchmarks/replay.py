@@ -0,0 +1,146 @@
+"""
+Record OBS API traffic to fixtures and replay it through the fake OBS of
+tests/obs.py.
+
+A recording is a JSON document containing the arguments a scenario was run
+with and the exchanges made with the server in order:
+
+    {
+      "args": {"project": "openSUSE:Factory", ...},
+      "exchanges": [
+        {"method": "GET", "uri": "/source/openSUSE:Factory?expand=1",
+         "status": 200, "content_type": "application/xml", "body": "..."},
+        ...
+      ]
+    }
+
+Bodies that are not valid UTF-8 are stored base64 encoded along with
+"encoding": "base64".
+"""
+
+import base64
+import json
+import os
+import sys
+import threading
+import urllib2
+import urlparse
+
+from StringIO import StringIO
+
+import osc.core
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import obs
+
+
+RECORDINGS = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'replay')
+
+# Answer to requests changing the server state while recording, unless
+# writes are allowed.
+WRITE_RESPONSE = '<status code="ok">\n  <summary>Ok</summary>\n</status>\n'
+
+
+def recording_path(name):
+    return os.path.join(RECORDINGS, name + '.json')
+
+
+class Recorder(object):
+    """
+    Record the requests made through osc.core._http_request(), the function
+    called by osclib.cache for the requests actually sent to the server.
+
+    Requests other than GET are not sent but answered with WRITE_RESPONSE
+    unless allow_writes is set since scenarios like select would otherwise
+    change the server being recorded.
+    """
+
+    def __init__(self, allow_writes=False):
+        self.allow_writes = allow_writes
+        self.exchanges = []
+        self.lock = threading.Lock()
+
+    def install(self):
+        from osclib.cache import Cache
+        Cache.init()
+
+        http_request = osc.core._http_request
+
+        def record(method, url, headers={}, data=None, file=None):
+            if method != 'GET' and not self.allow_writes:
+                self.add(method, url, 200, 'application/xml', WRITE_RESPONSE)
+                return urllib2.addinfourl(StringIO(WRITE_RESPONSE), {}, url, 200)
+
+            try:
+                response = http_request(method, url, headers, data, file)
+            except urllib2.HTTPError as e:
+                body = e.read() if e.fp is not None else ''
+                self.add(method, url, e.code, e.hdrs.get('content-type') if e.hdrs else None, body)
+                raise urllib2.HTTPError(e.url, e.code, e.msg, e.hdrs, StringIO(body))
+
+            body = response.read()
+            self.add(method, url, response.code, response.info().get('content-type'), body)
+            return urllib2.addinfourl(StringIO(body), response.info(), url, response.code)
+
+        osc.core._http_request = record
+
+    def add(self, method, url, status, content_type, body):
+        uri = urlparse.urlsplit(url)
+        uri = urlparse.urlunsplit(('', '', uri.path, uri.query, ''))
+        exchange = {
+            'method': method,
+            'uri': uri,
+            'status': status,
+            'content_type': content_type or 'text/plain',
+        }
+        try:
+            exchange['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            exchange['body'] = base64.b64encode(body)
+            exchange['encoding'] = 'base64'
+
+        with self.lock:
+            self.exchanges.append(exchange)
+
+    def save(self, path, args):
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as f:
+            json.dump({'args': args, 'exchanges': self.exchanges}, f, indent=1, sort_keys=True)
+
+
+def load(path):
+    """Return the arguments and exchanges of a recording."""
+    with open(path) as f:
+        recording = json.load(f)
+
+    exchanges = []
+    for exchange in recording['exchanges']:
+        body = exchange['body']
+        if exchange.get('encoding') == 'base64':
+            body = base64.b64decode(body)
+        else:
+            body = body.encode('utf-8')
+        exchanges.append((exchange['method'], exchange['uri'], exchange['status'],
+                          exchange['content_type'], body))
+    return recording['args'], exchanges
+
+
+def replay(path=None, latency=0):
+    """
+    Start the fake OBS answering with the recording at path, if any, before
+    its own routes and waiting latency seconds before each response. Return
+    the arguments the recording was made with.
+    """
+    obs.DEBUG = False
+    obs.OBS()
+    obs.LATENCY = latency
+
+    if path is None:
+        return {}
+
+    args, exchanges = load(path)
+    obs.replay_load(exchanges)
+    return args
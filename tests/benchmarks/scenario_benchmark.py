@@ -0,0 +1,244 @@
+#!/usr/bin/python
+"""
+Benchmark end to end scenarios against recorded OBS traffic.
+
+Each scenario runs in a separate process with empty caches against the fake
+OBS of tests/obs.py, answering with the recording of the scenario from
+tests/fixtures/replay when available and otherwise with the fake routes
+alone. The wall time, number of requests sent and peak RSS are reported.
+
+Latency may be injected to approximate a remote server:
+
+    ./tests/benchmarks/scenario_benchmark.py --latency 50
+    ./tests/benchmarks/scenario_benchmark.py --latency 50 list select
+
+A synthetic project the size of openSUSE:Factory, see fixture_generator.py,
+may be served instead to see how the scenarios scale:
+
+    ./tests/benchmarks/scenario_benchmark.py --synthetic
+    ./tests/benchmarks/scenario_benchmark.py --synthetic --packages 30000 cycle
+
+Recordings are made by running the scenarios against a real server using the
+osc configuration of the user, requests changing the server state not being
+sent unless --allow-writes is given:
+
+    ./tests/benchmarks/scenario_benchmark.py --record https://api.opensuse.org \\
+        --project openSUSE:Factory --staging B --requests 123456
+
+Must be run from the root of the repository.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import osc.conf
+import osc.core
+
+import fixture_generator
+import replay
+
+
+def scenario_list(api, args):
+    from osclib.list_command import ListCommand
+    ListCommand(api).perform()
+
+
+def scenario_select(api, args):
+    from osclib.select_command import SelectCommand
+    SelectCommand(api, api.prj_from_letter(args['staging'])).perform(args['requests'])
+
+
+def scenario_adi(api, args):
+    from osclib.adi_command import AdiCommand
+    AdiCommand(api).perform(args['requests'])
+
+
+def scenario_repo_checker(api, args):
+    from repo_checker import RepoChecker
+    bot = RepoChecker(apiurl=api.apiurl, dryrun=True, logger=logging.getLogger('repo_checker'),
+                      user='factory-repo-checker')
+    bot.set_request_ids_search_review()
+    bot.prepare_review()
+
+
+def scenario_request_splitter(api, args):
+    from osclib.request_splitter import RequestSplitter
+    splitter = RequestSplitter(api, api.get_open_requests(), in_ring=True)
+    splitter.stagings_load(api.get_staging_projects_short())
+    splitter.strategies_try()
+    splitter.strategy_do('none')
+
+
+def scenario_check_duplicate_binaries(api, args):
+    from osclib.check_duplicate_binaries_command import CheckDuplicateBinariesCommand
+    CheckDuplicateBinariesCommand(api).perform()
+
+
+def scenario_cycle(api, args):
+    from osclib.cycle import CycleDetector
+    list(CycleDetector(api).cycles(api.prj_from_letter(args['staging'])))
+
+
+SCENARIOS = OrderedDict([
+    ('list', scenario_list),
+    ('select', scenario_select),
+    ('adi', scenario_adi),
+    ('repo_checker', scenario_repo_checker),
+    ('request_splitter', scenario_request_splitter),
+    ('check_duplicate_binaries', scenario_check_duplicate_binaries),
+    ('cycle', scenario_cycle),
+])
+
+# Matching the state of the fake OBS.
+DEFAULTS = {
+    'project': 'openSUSE:Factory',
+    'staging': 'B',
+    'requests': ['gcc'],
+}
+
+
+def worker(name, args, results):
+    # Separate caches so that each run starts cold.
+    cachedir = tempfile.mkdtemp(prefix='scenario-benchmark-')
+    import osclib.memoize
+    osclib.memoize.CACHEDIR = cachedir
+    from osclib.cache import Cache
+    Cache.CACHE_DIR = os.path.join(cachedir, 'cache')
+
+    from osclib.conf import Config
+    from osclib.stagingapi import StagingAPI
+
+    recorder = None
+    if args.record:
+        osc.conf.get_config(override_apiurl=args.record)
+        apiurl = osc.conf.config['apiurl']
+        recorder = replay.Recorder(args.allow_writes)
+        recorder.install()
+        scenario_args = dict((key, getattr(args, key)) for key in DEFAULTS)
+        mode = 'record'
+    elif args.synthetic:
+        replay.replay(None, args.latency / 1000.0)
+        factory = fixture_generator.SyntheticFactory(
+            packages=args.packages, requests=args.requests_open, staged=args.staged)
+        # Requests waiting to be staged for select and adi.
+        scenario_args = dict(DEFAULTS, requests=[
+            request['package'] for request in factory.waiting()[:fixture_generator.WAITING_MIN]])
+        replay.obs.replay_load(factory.exchanges(scenario_args['staging']))
+        del factory
+        apiurl = replay.obs.APIURL
+        mode = 'synthetic'
+    else:
+        path = replay.recording_path(name)
+        if not os.path.exists(path):
+            path = None
+        scenario_args = dict(DEFAULTS, **replay.replay(path, args.latency / 1000.0))
+        apiurl = replay.obs.APIURL
+        mode = 'replay' if path else 'fake'
+
+    # Count the requests sent rather than those answered by the cache.
+    Cache.init()
+    requests = [0]
+    lock = threading.Lock()
+    http_request = osc.core._http_request
+
+    def counted(*args, **kwargs):
+        with lock:
+            requests[0] += 1
+        return http_request(*args, **kwargs)
+
+    osc.core._http_request = counted
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = open(os.devnull, 'w')
+    if not args.verbose:
+        sys.stderr = sys.stdout
+    start = time.time()
+    try:
+        Config(scenario_args['project'])
+        api = StagingAPI(apiurl, scenario_args['project'])
+        SCENARIOS[name](api, scenario_args)
+        result = 'ok'
+    except Exception as e:
+        result = 'error: {}'.format(traceback.format_exception_only(type(e), e)[-1].strip())
+        if mode == 'fake':
+            result += ' (not recorded)'
+    finally:
+        elapsed = time.time() - start
+        sys.stdout, sys.stderr = stdout, stderr
+        shutil.rmtree(cachedir)
+
+    if recorder:
+        recorder.save(replay.recording_path(name), scenario_args)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((mode, elapsed, requests[0], peak, result))
+
+
+def run(name, args):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=worker, args=(name, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main(args):
+    print('{:<26} {:>9} {:>10} {:>9} {:>14}  {}'.format(
+        'scenario', 'mode', 'seconds', 'requests', 'peak RSS MiB', 'result'))
+    failed = False
+    for name in args.scenarios:
+        runs = [run(name, args) for i in range(args.repeat)]
+        mode, elapsed, requests, peak, result = min(runs, key=lambda run: run[1])
+        failed = failed or result != 'ok'
+        # ru_maxrss is in KiB on Linux.
+        print('{:<26} {:>9} {:>10.3f} {:>9} {:>14.1f}  {}'.format(
+            name, mode, elapsed, requests, peak / 1024.0, result))
+    return 1 if failed and args.record else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark scenarios against recorded OBS traffic')
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help='scenarios to run: {} (default: all)'.format(', '.join(SCENARIOS.keys())))
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to each response')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each scenario, the fastest is reported')
+    parser.add_argument('--record', metavar='APIURL', help='record the scenarios against APIURL')
+    parser.add_argument('--synthetic', action='store_true', help='serve a generated large project')
+    parser.add_argument('--packages', type=int, default=15000, help='packages of the synthetic project')
+    parser.add_argument('--requests-open', type=int, default=500, help='open requests of the synthetic project')
+    parser.add_argument('--staged', type=int, help='staged open requests of the synthetic project '
+                        '(default: {:.0f}%% of them)'.format(fixture_generator.STAGED * 100))
+    parser.add_argument('--allow-writes', action='store_true', help='send requests changing state while recording')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the errors logged by scenarios')
+    parser.add_argument('-p', '--project', default=DEFAULTS['project'], help='project to record with')
+    parser.add_argument('--staging', default=DEFAULTS['staging'], help='staging letter to record select with')
+    parser.add_argument('--requests', nargs='+', default=DEFAULTS['requests'],
+                        help='requests or packages to record select and adi with')
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario {}'.format(name))
+    if args.record and args.synthetic:
+        parser.error('--record and --synthetic are exclusive')
+    if args.synthetic:
+        try:
+            # The project itself is generated by each worker.
+            fixture_generator.SyntheticFactory.validate(args.packages, args.requests_open, args.staged)
+        except ValueError as e:
+            parser.error(str(e))
+    args.scenarios = args.scenarios or SCENARIOS.keys()
+    sys.exit(main(args))
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+"""
+Benchmark peak memory of loading a _builddepinfo with ET.fromstring() versus
+iterelements().
+
+A synthetic _builddepinfo the size of openSUSE:Factory is generated and loaded
+into Package objects, as CycleDetector does, each approach in a separate
+process so that the peak RSS of one does not hide the other.
+
+    ./tests/benchmarks/xmlstream_benchmark.py --packages 15000
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from xml.etree import cElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from osclib.cycle import Package
+from osclib.xmlstream import iterelements
+
+
+def builddepinfo(packages, subpkgs, pkgdeps):
+    rand = random.Random(0)
+    names = ['package-{}'.format(i) for i in range(packages)]
+    lines = ['<builddepinfo>']
+    for name in names:
+        lines.append('  <package name="{}">'.format(name))
+        lines.append('    <source>{}</source>'.format(name))
+        for i in range(subpkgs):
+            lines.append('    <subpkg>{}-sub{}</subpkg>'.format(name, i))
+        for dep in rand.sample(names, pkgdeps):
+            lines.append('    <pkgdep>{}-sub{}</pkgdep>'.format(dep, rand.randrange(subpkgs)))
+        lines.append('  </package>')
+    lines.append('</builddepinfo>')
+    return '\n'.join(lines)
+
+
+def load_tree(document):
+    root = ET.fromstring(document)
+    return [Package(element=e) for e in root.findall('package')]
+
+
+def load_stream(document):
+    return [Package(element=e) for e in iterelements(document, 'package')]
+
+
+def worker(load, document, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    packages = load(document)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((len(packages), elapsed, peak - before))
+
+
+def run(load, document):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=worker, args=(load, document, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main(args):
+    document = builddepinfo(args.packages, args.subpkgs, args.pkgdeps)
+    print('_builddepinfo: {} packages, {:.1f} MiB'.format(args.packages, len(document) / 1024.0 ** 2))
+    print('{:>8} {:>10} {:>10} {:>16}'.format('method', 'packages', 'seconds', 'peak RSS MiB'))
+    for name, load in (('tree', load_tree), ('stream', load_stream)):
+        count, elapsed, peak = run(load, document)
+        # ru_maxrss is in KiB on Linux.
+        print('{:>8} {:>10} {:>10.2f} {:>16.1f}'.format(name, count, elapsed, peak / 1024.0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark streaming XML parsing memory')
+    parser.add_argument('--packages', type=int, default=15000, help='number of packages')
+    parser.add_argument('--subpkgs', type=int, default=5, help='subpackages per package')
+    parser.add_argument('--pkgdeps', type=int, default=30, help='dependencies per package')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,84 @@
+from StringIO import StringIO
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from osclib import bulk_fetch as module
+from osclib.bulk_fetch import bulk_fetch
+from osclib.bulk_fetch import prefetch
+
+
+APIURL = 'https://api.example.com'
+
+
+class TestBulkFetch(unittest.TestCase):
+    def setUp(self):
+        module._hosts.clear()
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def call(self, apiurl, value):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        return value * 2
+
+    def test_calls(self):
+        specs = [(self.call, APIURL, i) for i in range(20)]
+        results = dict(bulk_fetch(specs))
+        self.assertEqual(results, dict((spec, spec[2] * 2) for spec in specs))
+        self.assertTrue(1 < self.peak <= module.THREADS)
+
+    def test_host_limit(self):
+        with patch.object(module, 'HOST_LIMIT', 2):
+            results = list(bulk_fetch([(self.call, APIURL, i) for i in range(10)]))
+        self.assertEqual(len(results), 10)
+        self.assertEqual(self.peak, 2)
+
+    def test_host(self):
+        self.assertEqual(module._host(APIURL + '/source'), 'api.example.com')
+        self.assertEqual(module._host((self.call, 1, 'http://other.example.com/build')), 'other.example.com')
+        with patch.dict('osc.conf.config', {'apiurl': APIURL}):
+            self.assertEqual(module._host((self.call, 'openSUSE:Factory')), 'api.example.com')
+
+    def test_error(self):
+        def fail(apiurl, value):
+            if value == 3:
+                raise ValueError(value)
+            return value
+
+        with self.assertRaises(ValueError):
+            list(bulk_fetch([(fail, APIURL, i) for i in range(10)]))
+
+    @patch('osc.core.http_GET')
+    def test_urls(self, http_GET):
+        http_GET.side_effect = lambda url: StringIO('<directory name="{}" />'.format(url))
+        urls = ['{}/source/{}'.format(APIURL, i) for i in range(5)]
+        results = dict((url, root.get('name')) for url, root in bulk_fetch(urls))
+        self.assertEqual(results, dict((url, url) for url in urls))
+
+        results = dict(bulk_fetch(urls, parse=lambda response: response.read()))
+        self.assertEqual(results[urls[0]], '<directory name="{}" />'.format(urls[0]))
+
+    def test_prefetch(self):
+        fetched = []
+
+        def call(apiurl, value):
+            with self.lock:
+                fetched.append(value)
+            return value * 2
+
+        results = prefetch([(call, APIURL, i) for i in range(20)], lookahead=3)
+        self.assertEqual(next(results)[1], 0)
+        time.sleep(0.1)
+        # The one yielded and the three following it.
+        self.assertEqual(sorted(fetched), [0, 1, 2, 3])
+
+        self.assertEqual([result for _, result in results], [i * 2 for i in range(1, 20)])
+        self.assertEqual(len(fetched), 20)
@@ -0,0 +1,342 @@
+from httplib import HTTPMessage
+from StringIO import StringIO
+import os
+import threading
+import time
+import unittest
+import urllib2
+
+from mock import patch
+import osc.core
+from osc.core import makeurl
+from osclib.cache import Cache
+from osclib.cache import http_request
+from osclib.cache_store import MemoryStore
+from osclib.cache_store import SingleFlight
+
+from obs import APIURL
+from obs import OBS
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.obs = OBS()
+        Cache.init()
+
+    def url(self, *path):
+        return makeurl(APIURL, path)
+
+    def put(self, url, text):
+        return Cache.put(url, StringIO(text)).read()
+
+    def test_put_get(self):
+        url = self.url('source', 'openSUSE:Factory', '_meta')
+        self.assertIsNone(Cache.get(url))
+        self.assertEqual(self.put(url, '<project/>'), '<project/>')
+        self.assertEqual(Cache.get(url).read(), '<project/>')
+
+        entry = Cache.store_get().get(Cache.key(url))
+        self.assertEqual(entry['project'], 'openSUSE:Factory')
+        self.assertEqual(entry['size'], len('<project/>'))
+
+    def test_revalidate(self):
+        url = self.url('source', 'openSUSE:Factory', '_meta')
+        response = StringIO('<project/>')
+        response.info = lambda: HTTPMessage(StringIO('ETag: "abc"\r\n\r\n'))
+        Cache.put(url, response)
+
+        # Expire the entry so that a request must be made.
+        key = Cache.key(url)
+        Cache.store_get().touch(key, 0)
+        Cache.memory.touch(key, 0)
+        self.assertIsNone(Cache.get(url))
+        self.assertEqual(Cache.validators(url), {'If-None-Match': '"abc"'})
+
+        not_modified = urllib2.HTTPError(url, 304, 'Not Modified', {}, None)
+        with patch.object(osc.core, '_http_request', side_effect=not_modified) as request:
+            self.assertEqual(http_request('GET', url).read(), '<project/>')
+            self.assertEqual(request.call_args[0][2], {'If-None-Match': '"abc"'})
+
+        self.assertNotEqual(Cache.store_get().get(key)['mtime'], 0)
+        self.assertEqual(Cache.get(url).read(), '<project/>')
+
+    def test_memory(self):
+        url = self.url('source', 'openSUSE:Factory', '_meta')
+        self.put(url, '<project/>')
+
+        hits = Cache.stats()['memory']['hits']
+        self.assertEqual(Cache.get(url).read(), '<project/>')
+        self.assertEqual(Cache.stats()['memory']['hits'], hits + 1)
+
+        # Entry is still served by the store once evicted from memory.
+        Cache.memory.clear()
+        hits = Cache.stats()['store']['hits']
+        self.assertEqual(Cache.get(url).read(), '<project/>')
+        self.assertEqual(Cache.stats()['store']['hits'], hits + 1)
+        self.assertIsNotNone(Cache.memory.get(Cache.key(url)))
+
+        Cache.delete_project(APIURL, 'openSUSE:Factory')
+        self.assertIsNone(Cache.memory.get(Cache.key(url)))
+
+    def test_stats_flush(self):
+        url = self.url('source', 'openSUSE:Factory', '_meta')
+        Cache.stats_flush()
+        store = Cache.store_get()
+        store.stats_reset()
+
+        self.assertIsNone(Cache.get(url))
+        self.put(url, '<project/>')
+        Cache.get(url)
+        Cache.stats_flush()
+        self.assertEqual(Cache.counters, {})
+
+        pattern = Cache.match(url)[0]
+        stats = {row[:3]: row[3] for row in store.stats_get()}
+        self.assertEqual(stats[(pattern, 'openSUSE:Factory', 'miss')], 1)
+        self.assertEqual(stats[(pattern, 'openSUSE:Factory', 'hit_memory')], 1)
+        self.assertEqual(stats[(pattern, 'openSUSE:Factory', 'bytes_served')], len('<project/>'))
+
+        self.assertEqual(store.entries_summary(), (1, len('<project/>'), len('<project/>')))
+
+    def test_single_flight(self):
+        url = self.url('source', 'openSUSE:Factory', '_meta')
+        calls = []
+
+        def request(method, url, headers, data, file):
+            calls.append(url)
+            time.sleep(0.2)
+            return StringIO('<project/>')
+
+        # Load latest_updated beforehand since the mocked API is not thread-safe.
+        self.assertIsNone(Cache.get(url))
+        with patch.object(osc.core, '_http_request', side_effect=request):
+            threads = [threading.Thread(target=http_request, args=('GET', url)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(Cache.get(url).read(), '<project/>')
+
+    def test_single_flight_process(self):
+        flights = SingleFlight(Cache.CACHE_DIR)
+        key = Cache.key(self.url('source', 'openSUSE:Factory', '_meta'))
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child holds the lock until the parent gives up waiting.
+            with SingleFlight(Cache.CACHE_DIR).acquire(key, 1):
+                os.write(write, 'x')
+                time.sleep(0.5)
+            os._exit(0)
+
+        os.read(read, 1)
+        start = time.time()
+        with flights.acquire(key, 0.2) as waited:
+            self.assertTrue(waited)
+        self.assertLess(time.time() - start, 0.5)
+
+        with flights.acquire(key, 1) as waited:
+            self.assertTrue(waited)
+        os.waitpid(pid, 0)
+
+        with flights.acquire(key, 1) as waited:
+            self.assertFalse(waited)
+        flights.close()
+
+    def test_single_flight_collision(self):
+        # Distinct keys sharing a byte of the lock file exclude each other
+        # within a process as well since record locks belong to the process.
+        flights = SingleFlight(Cache.CACHE_DIR)
+        key = '{:08x}'.format(1) + '0' * 56
+        colliding = '{:08x}'.format(1 + SingleFlight.RANGE) + '0' * 56
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with flights.acquire(key, 1):
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        try:
+            with flights.acquire(colliding, 0.1) as waited:
+                self.assertTrue(waited)
+        finally:
+            release.set()
+            thread.join()
+
+        with flights.acquire(colliding, 1) as waited:
+            self.assertFalse(waited)
+        flights.close()
+
+    def test_negative(self):
+        url = self.url('source', 'openSUSE:Factory', 'wine', '_meta')
+        body = '<status code="unknown_package"/>'
+
+        def request(method, url, headers, data, file):
+            raise urllib2.HTTPError(url, 404, 'Not Found', HTTPMessage(StringIO()), StringIO(body))
+
+        for i in range(2):
+            with patch.object(osc.core, '_http_request', side_effect=request) as mock:
+                with self.assertRaises(urllib2.HTTPError) as context:
+                    http_request('GET', url)
+                self.assertEqual(context.exception.code, 404)
+                self.assertEqual(context.exception.read(), body)
+                self.assertEqual(mock.call_count, 1 - i)
+
+        # Creating the package expires the not found response.
+        Cache.delete(url)
+        self.assertIsNone(Cache.get(url))
+
+        # Not found responses are only cached for the configured paths.
+        url = self.url('source', 'openSUSE:Factory', 'wine', 'wine.spec')
+        error = urllib2.HTTPError(url, 404, 'Not Found', HTTPMessage(StringIO()), StringIO(body))
+        with patch.object(osc.core, '_http_request', side_effect=error):
+            with self.assertRaises(urllib2.HTTPError) as context:
+                http_request('GET', url)
+        # The original error is raised as is.
+        self.assertIs(context.exception, error)
+        self.assertEqual(context.exception.read(), body)
+        self.assertIsNone(Cache.store_get().get(Cache.key(url)))
+
+    def test_memory_limit(self):
+        memory = MemoryStore(10)
+        entry = {'host': 'localhost', 'project': 'openSUSE:Factory', 'package': None,
+                 'mtime': 0, 'etag': None, 'last_modified': None, 'encoding': None, 'size': 4,
+                 'status': 200}
+        memory.put('a', dict(entry, data='aaaa'))
+        memory.put('b', dict(entry, data='bbbb'))
+        memory.get('a')
+        memory.put('c', dict(entry, data='cccc'))
+        self.assertEqual(list(memory.entries), ['a', 'c'])
+        self.assertEqual(memory.bytes, 8)
+
+        memory.put('d', dict(entry, data='d' * 11))
+        self.assertIsNone(memory.get('d'))
+
+        memory.delete_project('localhost', 'openSUSE:Factory')
+        self.assertEqual(memory.bytes, 0)
+
+    def test_compression(self):
+        url = self.url('source', 'openSUSE:Factory', '_meta')
+        text = '<project>\n' + '  <package name="wine"/>\n' * 1000 + '</project>\n'
+        self.assertEqual(self.put(url, text), text)
+
+        entry = Cache.store_get().get(Cache.key(url))
+        self.assertEqual(entry['encoding'], Cache.COMPRESSION)
+        self.assertEqual(entry['size'], len(text))
+        self.assertLess(entry['stored_size'], len(text))
+
+        self.assertEqual(Cache.get(url).read(), text)
+        Cache.memory.clear()
+        self.assertEqual(Cache.get(url).readlines(), text.splitlines(True))
+
+        # Small responses are not worth compressing.
+        self.put(url, '<project/>')
+        self.assertIsNone(Cache.store_get().get(Cache.key(url))['encoding'])
+
+    def test_not_cached(self):
+        url = self.url('build', 'openSUSE:Factory', '_result')
+        self.put(url, '<resultlist/>')
+        self.assertIsNone(Cache.store_get().get(Cache.key(url)))
+
+    def test_delete_project(self):
+        url_factory = self.url('source', 'openSUSE:Factory', '_meta')
+        url_staging = self.url('source', 'openSUSE:Factory:Staging:A', '_meta')
+        self.put(url_factory, '<project name="openSUSE:Factory"/>')
+        self.put(url_staging, '<project name="openSUSE:Factory:Staging:A"/>')
+
+        Cache.delete_project(APIURL, 'openSUSE:Factory:Staging:A')
+        self.assertIsNone(Cache.get(url_staging))
+        self.assertIsNotNone(Cache.get(url_factory))
+
+    def last_updated_load(self):
+        Cache.last_updated.pop(APIURL, None)
+        Cache.last_updated_load(APIURL)
+        return Cache.last_updated[APIURL]
+
+    def test_last_updated_persist(self):
+        last_updated = self.last_updated_load()
+        self.assertEqual(last_updated, {'notreal': '2016-12-18T11:49:37Z',
+                                        'notreal/notreal': '2016-12-18T11:49:37Z',
+                                        '__oldest': '2016-12-18T11:49:37Z'})
+
+        # Within the TTL the persisted statistics are used as is.
+        with patch.object(Cache, 'last_updated_fetch') as fetch:
+            self.assertEqual(self.last_updated_load(), last_updated)
+            self.assertFalse(fetch.called)
+
+    def test_last_updated_incremental(self):
+        self.last_updated_load()
+        store = Cache.store_get()
+        host = Cache.host(APIURL)
+        watermark = store.watermark_get(host)
+        store.watermark_set(host, watermark['updated'], watermark['oldest'], 0)
+
+        increment = ({'notreal': '2017-01-02T00:00:00Z', 'other': '2017-01-01T00:00:00Z'},
+                     '2017-01-02T00:00:00Z', '2016-12-18T11:49:37Z', Cache.LAST_UPDATED_INCREMENT)
+        with patch.object(Cache, 'last_updated_fetch', return_value=increment) as fetch:
+            last_updated = self.last_updated_load()
+            fetch.assert_called_once_with(APIURL, Cache.LAST_UPDATED_INCREMENT)
+
+        self.assertEqual(last_updated, {'notreal': '2017-01-02T00:00:00Z',
+                                        'notreal/notreal': '2016-12-18T11:49:37Z',
+                                        'other': '2017-01-01T00:00:00Z',
+                                        '__oldest': '2016-12-18T11:49:37Z'})
+        self.assertEqual(store.watermark_get(host)['updated'], '2017-01-02T00:00:00Z')
+
+        # Trimming the history moves the oldest guarantee forward.
+        store.watermark_set(host, '2017-01-02T00:00:00Z', '2016-12-18T11:49:37Z', 0)
+        increment = ({}, None, None, 0)
+        with patch.object(Cache, 'last_updated_fetch', return_value=increment), \
+             patch.object(Cache, 'LAST_UPDATED_HISTORY', 2):
+            last_updated = self.last_updated_load()
+
+        self.assertEqual(last_updated, {'notreal': '2017-01-02T00:00:00Z',
+                                        'other': '2017-01-01T00:00:00Z',
+                                        '__oldest': '2016-12-18T11:49:37Z'})
+
+    def test_delete_package(self):
+        project = 'openSUSE:Factory'
+        url_list = makeurl(APIURL, ['source', project], {'view': 'info'})
+        url_wine = self.url('source', project, 'wine', '_meta')
+        url_gcc = self.url('source', project, 'gcc', '_meta')
+        for url in (url_list, url_wine, url_gcc):
+            self.put(url, '<entry/>')
+
+        entry = Cache.store_get().get(Cache.key(url_wine))
+        self.assertEqual((entry['project'], entry['package']), (project, 'wine'))
+
+        # Changing a package only expires the package and project level entries.
+        Cache.delete(self.url('source', project, 'wine', '_meta'))
+        self.assertIsNone(Cache.get(url_wine))
+        self.assertIsNone(Cache.get(url_list))
+        self.assertIsNotNone(Cache.get(url_gcc))
+
+        # Project level files are not treated as packages.
+        self.assertEqual(Cache.match(self.url('source', project, '_meta'))[1:], (project, None))
+
+    def test_unchanged_since(self):
+        Cache.last_updated[APIURL] = {
+            '__oldest': '2017-01-01T00:00:00Z',
+            'openSUSE:Factory': '2017-01-04T00:00:00Z',
+            'openSUSE:Factory/_project': '2017-01-02T00:00:00Z',
+            'openSUSE:Factory/wine': '2017-01-03T00:00:00Z',
+            'openSUSE:Factory/gcc': '2017-01-04T00:00:00Z',
+        }
+        project = 'openSUSE:Factory'
+        self.assertEqual(Cache.unchanged_since(APIURL, project), '2017-01-04T00:00:00Z')
+        self.assertEqual(Cache.unchanged_since(APIURL, project, 'wine'), '2017-01-03T00:00:00Z')
+        self.assertEqual(Cache.unchanged_since(APIURL, project, 'mariadb'), '2017-01-02T00:00:00Z')
+        self.assertEqual(Cache.unchanged_since(APIURL, 'home:Admin'), '2017-01-01T00:00:00Z')
+        del Cache.last_updated[APIURL]
+
+    def test_delete_all(self):
+        url = self.url('source', 'openSUSE:Factory', '_meta')
+        self.put(url, '<project/>')
+        Cache.delete_all()
+        self.assertIsNone(Cache.get(url))
@@ -0,0 +1,34 @@
+import unittest
+
+from obs import APIURL
+from obs import OBS
+from osclib.cache import Cache
+from osclib.cache_warm_command import CacheWarmCommand
+from osclib.conf import Config
+from osclib.stagingapi import StagingAPI
+
+
+class TestCacheWarm(unittest.TestCase):
+    def setUp(self):
+        self.obs = OBS()
+        Config('openSUSE:Factory')
+        self.api = StagingAPI(APIURL, 'openSUSE:Factory')
+
+    def test_urls(self):
+        command = CacheWarmCommand(self.api)
+        urls = command.urls(['openSUSE:Factory:Staging:A'], ['config'])
+        self.assertIn(self.api.makeurl(['source', 'openSUSE:Factory:Staging:A', '_meta']), urls)
+        self.assertIn(self.api.makeurl(['source', 'openSUSE:Factory:Staging', 'dashboard', 'config?expand=1']), urls)
+
+        # Only URLs cached for TTL_LONG are requested.
+        for url in urls:
+            match = Cache.match(url)[0]
+            self.assertTrue(match and Cache.PATTERNS[match] >= Cache.TTL_LONG, url)
+
+    def test_perform(self):
+        url = self.api.makeurl(['source', 'openSUSE:Factory:Staging:A', '_meta'])
+        self.assertIsNone(Cache.get(url))
+
+        # The mocked API is not thread-safe.
+        CacheWarmCommand(self.api).perform(threads=1)
+        self.assertIsNotNone(Cache.get(url))
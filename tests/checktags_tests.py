@@ -44,6 +44,10 @@ class TestTagChecker(unittest.TestCase):
         """
 
         Cache.last_updated[APIURL] = {'__oldest': '2016-12-18T11:49:37Z'}
+        # Responses for the same URLs differ between tests so start with an
+        # empty cache.
+        Cache.init()
+        Cache.delete_all()
         httpretty.reset()
         httpretty.enable()
 
@@ -0,0 +1,167 @@
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+import httplib
+import threading
+import time
+import unittest
+import urllib2
+
+import httpretty
+import mock
+import osc
+
+from osclib.connection_pool import ConnectionPool
+from osclib.connection_pool import PooledHandler
+from osclib.connection_pool import https_connection
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        status = 404 if self.path == '/missing' else 200
+        body = self.path * 1000
+        self.send_response(status)
+        self.send_header('Content-Length', len(body))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class M2HTTPSHandler(urllib2.BaseHandler):
+    """Stands in for osc.oscssl.myHTTPSHandler which needs M2Crypto."""
+
+    handler_order = 499
+
+    def __init__(self, ssl_context=None, appname='generic'):
+        self.ctx = ssl_context
+        self.appname = appname
+
+    def https_open(self, req):
+        raise AssertionError('request not pooled')
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        # Other tests leave the socket module patched.
+        self.httpretty = httpretty.is_enabled()
+        httpretty.disable()
+
+        self.server = Server(('127.0.0.1', 0), RequestHandler)
+        self.server.connections = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.idle_timeout = ConnectionPool.IDLE_TIMEOUT
+        ConnectionPool.close()
+        ConnectionPool.counters.clear()
+        self.opener = urllib2.build_opener(PooledHandler(None))
+
+    def tearDown(self):
+        ConnectionPool.close()
+        ConnectionPool.IDLE_TIMEOUT = self.idle_timeout
+        RequestHandler.timeout = None
+        self.server.shutdown()
+        self.server.server_close()
+        if self.httpretty:
+            httpretty.enable()
+
+    def get(self, path):
+        url = 'http://127.0.0.1:{}{}'.format(self.server.server_port, path)
+        return self.opener.open(url)
+
+    def test_reuse(self):
+        for i in range(5):
+            self.assertEqual(self.get('/foo').read(), '/foo' * 1000)
+        self.assertEqual(self.server.connections, 1)
+
+        stats = ConnectionPool.stats()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 4)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['reuse_ratio'], 0.8)
+
+    def test_partial_read(self):
+        response = self.get('/foo')
+        response.read(10)
+        response.close()
+        self.assertEqual(ConnectionPool.stats()['idle'], 0)
+
+        self.get('/foo').read()
+        self.assertEqual(self.server.connections, 2)
+
+    def test_concurrent(self):
+        # Connections in use are not shared.
+        first = self.get('/foo')
+        second = self.get('/bar')
+        self.assertEqual(second.read(), '/bar' * 1000)
+        self.assertEqual(first.read(), '/foo' * 1000)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(ConnectionPool.stats()['idle'], 2)
+
+    def test_connection_close(self):
+        self.get('/close').read()
+        self.get('/foo').read()
+        self.assertEqual(self.server.connections, 2)
+
+    def test_error(self):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.get('/missing')
+        self.assertEqual(context.exception.read(), '/missing' * 1000)
+
+        self.get('/foo').read()
+        self.assertEqual(self.server.connections, 1)
+
+    def test_idle_timeout(self):
+        ConnectionPool.IDLE_TIMEOUT = 0
+        self.get('/foo').read()
+        self.get('/foo').read()
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(ConnectionPool.stats()['expired'], 1)
+
+    def test_closed_by_server(self):
+        RequestHandler.timeout = 0.1
+        self.get('/foo').read()
+        time.sleep(0.3)
+
+        # Retried on a new connection.
+        self.assertEqual(self.get('/foo').read(), '/foo' * 1000)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(ConnectionPool.stats()['retried'], 1)
+
+    def test_m2crypto(self):
+        ctx = object()
+        connections = []
+
+        def connection(host, appname, ssl_context):
+            # Plain HTTP to the test server in place of M2Crypto.
+            connections.append((host, appname, ssl_context))
+            return httplib.HTTPConnection(host)
+
+        oscssl = mock.Mock(myHTTPSConnection=connection)
+        with mock.patch.object(osc, 'oscssl', oscssl, create=True):
+            opener = urllib2.build_opener(M2HTTPSHandler(ssl_context=ctx, appname='osc'))
+            opener.add_handler(PooledHandler(https_connection(opener)))
+            url = 'https://127.0.0.1:{}/foo'.format(self.server.server_port)
+            for i in range(3):
+                self.assertEqual(opener.open(url).read(), '/foo' * 1000)
+
+        host = '127.0.0.1:{}'.format(self.server.server_port)
+        self.assertEqual(connections, [(host, 'osc', ctx)])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(ConnectionPool.stats()['reused'], 2)
@@ -0,0 +1,122 @@
+from StringIO import StringIO
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib2
+
+from mock import patch
+import osc.core
+from osclib.cache import Cache
+from osclib.cache import http_request
+from osclib.http_metrics import HTTPMetrics
+from osclib.http_metrics import _wrap
+from osclib.http_metrics import template
+
+from obs import APIURL
+from obs import OBS
+
+
+class TestHTTPMetrics(unittest.TestCase):
+    def setUp(self):
+        HTTPMetrics.reset()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        HTTPMetrics.reset()
+        shutil.rmtree(self.dir)
+
+    def endpoint(self, method, path):
+        return dict((m, e) for m, p, e in HTTPMetrics.snapshot() if p == path)[method]
+
+    def test_template(self):
+        self.assertEqual(template(APIURL + '/source/openSUSE:Factory/_meta'), '/source/{project}/_meta')
+        self.assertEqual(template(APIURL + '/source/openSUSE:Factory/wine/_history?rev=1'),
+                         '/source/{project}/{package}/_history')
+        self.assertEqual(template(APIURL + '/source/openSUSE:Factory/wine/a/b/wine.spec'),
+                         '/source/{project}/{package}/{file}')
+        self.assertEqual(template(APIURL + '/source/openSUSE:Factory?view=info&nofilename=1'),
+                         '/source/{project}?view=info')
+        self.assertEqual(template(APIURL + '/build/openSUSE:Factory/standard/x86_64/_builddepinfo'),
+                         '/build/{project}/{repository}/{arch}/_builddepinfo')
+        self.assertEqual(template(APIURL + "/search/request?match=state/@name='review'"), '/search/request')
+        self.assertEqual(template(APIURL + '/comments/request/123'), '/comments/request/{name}')
+        self.assertEqual(template(APIURL + '/unknown/a/b'), '/unknown/{name}')
+        self.assertEqual(template(APIURL), '/')
+
+    def test_record(self):
+        responses = {
+            'GET': StringIO('<directory/>'),
+            'POST': urllib2.HTTPError(APIURL, 500, 'error', {}, None),
+        }
+
+        def request(method, url, headers={}, data=None, file=None):
+            # Nested requests are part of the outer one.
+            if url == APIURL + '/source/openSUSE:Factory/wine':
+                wrapped('GET', APIURL + '/source/openSUSE:Factory/_meta')
+            ret = responses[method]
+            if isinstance(ret, Exception):
+                raise ret
+            return ret
+
+        wrapped = _wrap(request)
+        url = APIURL + '/source/openSUSE:Factory/wine'
+        wrapped('GET', url)
+        wrapped('GET', url)
+        with self.assertRaises(urllib2.HTTPError):
+            wrapped('POST', url + '?cmd=diff')
+
+        self.assertEqual([(m, p) for m, p, e in HTTPMetrics.snapshot()],
+                         [('GET', '/source/{project}/{package}'), ('POST', '/source/{project}/{package}?cmd=diff')])
+        endpoint = self.endpoint('GET', '/source/{project}/{package}')
+        self.assertEqual(endpoint['requests'], 2)
+        self.assertEqual(endpoint['errors'], 0)
+        self.assertEqual(endpoint['cache'], {'uncached': 2})
+        self.assertEqual(sum(endpoint['buckets']), 2)
+        self.assertEqual(self.endpoint('POST', '/source/{project}/{package}?cmd=diff')['errors'], 1)
+
+    def test_cache_status(self):
+        OBS()
+        Cache.init()
+        Cache.delete_all()
+        url = APIURL + '/source/openSUSE:Factory/_meta'
+        wrapped = _wrap(http_request)
+        with patch.object(osc.core, '_http_request', side_effect=lambda *args: StringIO('<project/>')):
+            wrapped('GET', url).read()
+            wrapped('GET', url).read()
+
+        endpoint = self.endpoint('GET', '/source/{project}/_meta')
+        self.assertEqual(endpoint['cache'], {'miss': 1, 'hit': 1})
+        self.assertEqual(endpoint['bytes'], 2 * len('<project/>'))
+
+    def test_histogram(self):
+        for elapsed in (0.001, 0.02, 0.02, 0.2, 100):
+            HTTPMetrics.record('GET', APIURL + '/source', elapsed, 'miss', 10)
+        endpoint = self.endpoint('GET', '/source')
+        self.assertEqual(endpoint['buckets'][:4], [1, 2, 0, 0])
+        self.assertEqual(endpoint['buckets'][-1], 1)
+        self.assertEqual(HTTPMetrics.percentile(endpoint, 50), 0.025)
+        self.assertEqual(HTTPMetrics.percentile(endpoint, 95), float('inf'))
+
+        summary = StringIO()
+        HTTPMetrics.summary(summary)
+        self.assertIn('/source', summary.getvalue().splitlines()[1])
+
+    def test_write(self):
+        HTTPMetrics.record('GET', APIURL + '/source/openSUSE:Factory/_meta', 0.2, 'hit', 10)
+
+        output = os.path.join(self.dir, 'metrics.prom')
+        HTTPMetrics.write(output)
+        text = open(output).read()
+        self.assertIn('# TYPE osc_http_request_duration_seconds histogram', text)
+        self.assertIn('osc_http_requests_total{cache="hit",endpoint="/source/{project}/_meta",method="GET",', text)
+        self.assertIn('le="0.25",method="GET",', text)
+        self.assertIn('le="+Inf",method="GET",', text)
+
+        output = os.path.join(self.dir, 'metrics.json')
+        HTTPMetrics.write(output)
+        metrics = json.load(open(output))
+        self.assertEqual(metrics['endpoints'][0]['endpoint'], '/source/{project}/_meta')
+        self.assertEqual(metrics['endpoints'][0]['bytes'], 10)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['metrics.json', 'metrics.prom'])
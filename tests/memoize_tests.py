@@ -0,0 +1,266 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import timeit
+import unittest
+import warnings
+
+import mock
+
+import osclib.memoize
+from osclib.memoize import _key
+from osclib.memoize import memoize
+from osclib.memoize import new_cycle
+from osclib.memoize import session_stats
+
+
+class TestMemoize(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = osclib.memoize.CACHEDIR
+        osclib.memoize.CACHEDIR = tempfile.mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(osclib.memoize.CACHEDIR)
+        osclib.memoize.CACHEDIR = self.cachedir
+
+    def test_persistent(self):
+        @memoize()
+        def double(apiurl, a):
+            self.calls.append(a)
+            return a * 2
+
+        self.assertEqual(double(None, 2), 4)
+        self.assertEqual(double(None, 2), 4)
+        self.assertEqual(self.calls, [2])
+        self.assertTrue(os.path.exists(os.path.join(osclib.memoize.CACHEDIR, 'double.sqlite')))
+
+        # A new process sees the stored values.
+        @memoize()
+        def double(apiurl, a):
+            self.calls.append(a)
+            return a * 2
+
+        self.assertEqual(double(None, 2), 4)
+        self.assertEqual(self.calls, [2])
+
+    def test_ttl(self):
+        @memoize(ttl=1)
+        def double(a):
+            self.calls.append(a)
+            return a * 2
+
+        double(2)
+        double._memoize_cache.connection().execute('UPDATE memoize SET timestamp = 0')
+        double(2)
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_invalidate(self):
+        class API(object):
+            @memoize(add_invalidate=True)
+            def double(self, a):
+                calls.append(a)
+                return a * 2
+
+        calls = self.calls
+        api = API()
+        api.double(2)
+        api.double(3)
+        api._invalidate_double(2)
+        api.double(2)
+        api.double(3)
+        self.assertEqual(calls, [2, 3, 2])
+
+        api._invalidate_all()
+        api.double(3)
+        self.assertEqual(calls, [2, 3, 2, 3])
+
+    def test_slots(self):
+        for session in (False, True):
+            # The first argument is not part of the key.
+            @memoize(session=session)
+            def identity(apiurl, a):
+                return a
+
+            cache = identity._memoize_cache
+            for i in range(4095):
+                identity(None, i)
+            self.assertEqual(len(cache), 4095)
+
+            identity(None, 4095)
+            self.assertEqual(len(cache), 3072)
+
+    def test_slots_configurable(self):
+        @memoize(slots=8, nclean=2)
+        def identity(apiurl, a):
+            return a
+
+        cache = identity._memoize_cache
+        for i in range(8):
+            identity(None, i)
+        self.assertEqual(len(cache), 6)
+        # The oldest entries were removed.
+        self.assertIsNone(cache.get(identity._memoize_key(((0,), {}))))
+        self.assertIsNotNone(cache.get(identity._memoize_key(((7,), {}))))
+
+    def test_session_lru(self):
+        @memoize(session=True, slots=4, nclean=1)
+        def identity(apiurl, a):
+            self.calls.append(a)
+            return a
+
+        for i in range(3):
+            identity(None, i)
+        identity(None, 0)
+        identity(None, 3)
+        # Recently used 0 is kept while 1 was evicted.
+        identity(None, 0)
+        identity(None, 1)
+        self.assertEqual(self.calls, [0, 1, 2, 3, 1])
+
+    def test_counters(self):
+        for session in (False, True):
+            @memoize(session=session, slots=4, nclean=2)
+            def identity(apiurl, a):
+                return a
+
+            for i in range(4):
+                identity(None, i)
+            identity(None, 3)
+            self.assertEqual(dict(identity._memoize_counters), {'hit': 1, 'miss': 4, 'evicted': 2})
+
+    def test_new_cycle(self):
+        @memoize(session=True)
+        def identity(apiurl, a):
+            self.calls.append(a)
+            return a
+
+        @memoize()
+        def persistent(apiurl, a):
+            self.calls.append(a)
+            return a
+
+        identity(None, 1)
+        identity(None, 1)
+        persistent(None, 2)
+        stats = session_stats()['{}.identity'.format(__name__)]
+        self.assertEqual(stats, {'hit': 1, 'miss': 1, 'size': 1})
+
+        # Only session caches start over, counters are kept.
+        new_cycle()
+        identity(None, 1)
+        persistent(None, 2)
+        self.assertEqual(self.calls, [1, 2, 1])
+        self.assertEqual(identity._memoize_counters['miss'], 2)
+
+    def test_key(self):
+        url = 'https://api.opensuse.org/source/openSUSE:Factory/wine?view=info'
+        self.assertEqual(len(_key(((url,), {}))), 20)
+        self.assertEqual(_key(((), {'a': 1, 'b': 2})), _key(((), dict([('b', 2), ('a', 1)]))))
+        self.assertEqual(_key(((url, [1]), {})), _key(((url, [1]), {})))
+
+        distinct = [(1,), ('1',), (u'1',), (1.0,), (True,), (None,), ('a', 'b'), ('ab',),
+                    (['a', 'b'],), ({'a': 'b'},)]
+        self.assertEqual(len(set(_key((value, {})) for value in distinct)), len(distinct))
+
+    def test_key_tuple(self):
+        with mock.patch('osclib.memoize.pickle.dumps') as dumps:
+            key = _key(((('openSUSE:Factory', 'standard', 'x86_64'), (1, (None, u'a'))), {'arch': ('i586',)}))
+            self.assertFalse(dumps.called)
+        self.assertEqual(len(key), 20)
+
+        self.assertEqual(_key((((['a'],),), {})), _key((((['a'],),), {})))
+        self.assertNotEqual(_key(((('a', 'b'),), {})), _key(((['a', 'b'],), {})))
+        self.assertNotEqual(_key(((('a', 'b'),), {})), _key((('a', 'b'), {})))
+
+    def test_key_fallback(self):
+        # Instances are refused by marshal.
+        with mock.patch('osclib.memoize.pickle.dumps', wraps=osclib.memoize.pickle.dumps) as dumps:
+            key = _key(((None, Exception('a')), {}))
+            self.assertTrue(dumps.called)
+        self.assertEqual(len(key), 20)
+        self.assertNotEqual(key, _key(((None, Exception('b')), {})))
+
+    def test_key_benchmark(self):
+        url = 'https://api.opensuse.org/source/openSUSE:Factory/wine?view=info'
+        for args in (((url, 42), {'deleted': 1}), ((url,), {})):
+            # Previous key derivation.
+            def pickled():
+                key = osclib.memoize.pickle.dumps(args, protocol=-1)
+                return osclib.memoize.pickle.dumps(osclib.memoize.pickle.loads(key), protocol=-1)
+
+            previous = min(timeit.repeat(pickled, number=2000, repeat=5))
+            current = min(timeit.repeat(lambda: _key(args), number=2000, repeat=5))
+            self.assertLessEqual(current, previous)
+            self.assertLess(len(_key(args)), len(pickled()))
+
+    def wait_refresh(self, fn):
+        for i in range(100):
+            if not fn._memoize_refreshing:
+                return
+            time.sleep(0.01)
+        self.fail('refresh did not finish')
+
+    def test_stale_ttl(self):
+        @memoize(ttl=1, stale_ttl=60)
+        def double(apiurl, a):
+            self.calls.append(a)
+            if len(self.calls) == 3:
+                raise Exception('unavailable')
+            return a * 2 + len(self.calls)
+
+        expire = lambda: double._memoize_cache.connection().execute(
+            'UPDATE memoize SET timestamp = timestamp - 2')
+
+        self.assertEqual(double(None, 2), 5)
+        expire()
+
+        # Stale value is served while refreshed in the background.
+        self.assertEqual(double(None, 2), 5)
+        self.wait_refresh(double)
+        self.assertEqual(double(None, 2), 6)
+        self.assertEqual(len(self.calls), 2)
+
+        # Failed refresh keeps the stale value.
+        expire()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(double(None, 2), 6)
+            self.wait_refresh(double)
+        self.assertIn('unavailable', str(caught[0].message))
+        key = double._memoize_key(((2,), {}))
+        self.assertEqual(double._memoize_cache.get(key)[1], 6)
+
+        # Beyond the stale window the value is fetched again.
+        double._memoize_cache.connection().execute('UPDATE memoize SET timestamp = 0')
+        self.assertEqual(double(None, 2), 8)
+
+    def test_stale_invalidate(self):
+        fetching = threading.Event()
+        release = threading.Event()
+
+        class API(object):
+            @memoize(ttl=1, stale_ttl=60, add_invalidate=True)
+            def value(_self, a):
+                self.calls.append(a)
+                if len(self.calls) == 2:
+                    fetching.set()
+                    release.wait(5)
+                return len(self.calls)
+
+        api = API()
+        self.assertEqual(api.value(1), 1)
+        API.value._memoize_cache.connection().execute('UPDATE memoize SET timestamp = timestamp - 2')
+
+        # Invalidated while the refresh is fetching, like after a write.
+        self.assertEqual(api.value(1), 1)
+        fetching.wait(5)
+        api._invalidate_value(1)
+        release.set()
+        self.wait_refresh(API.value)
+
+        # The value fetched before the invalidation is not stored.
+        self.assertIsNone(API.value._memoize_cache.get(API.value._memoize_key(((1,), {}))))
+        self.assertEqual(api.value(1), 3)
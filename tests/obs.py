@@ -14,11 +14,14 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import copy
 from datetime import datetime, timedelta
 import os
 import re
 import string
+import threading
 import time
+import urllib
 import urllib2
 import urlparse
 import xml.etree.cElementTree as ET
@@ -35,6 +38,12 @@ FIXTURES = os.path.join(os.getcwd(), 'tests/fixtures')
 
 DEBUG = True
 
+# Seconds waited before answering each request to simulate a remote server.
+LATENCY = 0
+
+# Recorded responses served before the routes below, see replay_load().
+_replay = {}
+
 
 # The idiotic routing system of httpretty use a hash table.  Because
 # we have a default() handler, we need a deterministic routing
@@ -47,8 +56,35 @@ _table = {
 }
 
 
+# httpretty attaches each request to the entry of the route shared by all of
+# them, so concurrent requests, like those of osclib.bulk_fetch, would receive
+# the responses of others.  Give each request its own copy of the entry.
+_entry_lock = threading.Lock()
+_get_next_entry = httpretty.core.URIMatcher.get_next_entry
+
+
+def get_next_entry(self, method, info, request):
+    with _entry_lock:
+        return copy.copy(_get_next_entry(self, method, info, request))
+
+httpretty.core.URIMatcher.get_next_entry = get_next_entry
+
+
 def router_handler(route_table, method, request, uri, headers):
     """Route the URLs in a deterministic way."""
+    if LATENCY:
+        time.sleep(LATENCY)
+
+    key = replay_key(uri)
+    responses = (_replay.get((method, key)) or
+                 _replay.get((method, key.split('?', 1)[0] + '?*')) or
+                 _replay.get((method, '*')))
+    if responses:
+        # Answer in the recorded order and keep repeating the last response.
+        status, content_type, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        headers['content-type'] = content_type
+        return (status, headers, body)
+
     uri_parsed = urlparse.urlparse(uri)
     for path, fn in route_table:
         match = False
@@ -77,6 +113,25 @@ def router_handler_DELETE(request, uri, headers):
     return router_handler(_table[httpretty.DELETE], 'DELETE', request, uri, headers)
 
 
+def replay_key(uri):
+    """Return the path and sorted query of uri used to match responses."""
+    uri_parsed = urlparse.urlparse(uri)
+    query = sorted(urlparse.parse_qsl(uri_parsed.query, keep_blank_values=True))
+    return uri_parsed.path + ('?' + urllib.urlencode(query) if query else '')
+
+
+def replay_load(exchanges):
+    """
+    Serve the exchanges, a list of (method, uri, status, content type, body)
+    tuples, instead of the routes below for matching requests. A uri ending in
+    ?* matches the path with any query and * matches any request of method.
+    """
+    for method, uri, status, content_type, body in exchanges:
+        if uri != '*' and not uri.endswith('?*'):
+            uri = replay_key(uri)
+        _replay.setdefault((method, uri), []).append((status, content_type, body))
+
+
 def method_decorator(method, path):
     def _decorator(fn):
         def _fn(*args, **kwargs):
@@ -112,6 +167,7 @@ class OBS(object):
             OBS._self = super(OBS, cls).__new__(cls, *args, **kwargs)
 
         Cache.delete_all()
+        _replay.clear()
         httpretty.reset()
         httpretty.enable()
 
@@ -14,11 +14,20 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import glob
+import hashlib
 import os
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import shelve
 import shutil
+import time
 import unittest
 
 from mock import MagicMock
+from mock import patch
 
 import osclib.pkgcache
 from osclib.pkgcache import PkgCache
@@ -40,68 +49,283 @@ class TestPkgCache(unittest.TestCase):
 
     def test_insertion(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertEqual(open('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a').read(), 'file_a\n')
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+        self.assertEqual(open('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda').read(), 'file_a\n')
         self.cache[('file_b', 1)] = '/tmp/file_b'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/a7/004efbb89078ebcc8f21d55354e2f3'))
-        self.assertEqual(open('/tmp/cache/pkgcache/a7/004efbb89078ebcc8f21d55354e2f3').read(), 'file_b\n')
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/26/09c7f7ac4f0ce2dd7ed703bd7be0023b6ae5e978f59b5339989ff1dab03aae'))
+        self.assertEqual(open('/tmp/cache/pkgcache/26/09c7f7ac4f0ce2dd7ed703bd7be0023b6ae5e978f59b5339989ff1dab03aae').read(), 'file_b\n')
         self.cache[('file_c', 1)] = '/tmp/file_c'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/22/ee05516c08f3672cb25e03ce7f045f'))
-        self.assertEqual(open('/tmp/cache/pkgcache/22/ee05516c08f3672cb25e03ce7f045f').read(), 'file_c\n')
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/38/8bfc7541395b9dbb5463ab37679821c706dab57abe044a42a48aef16152729'))
+        self.assertEqual(open('/tmp/cache/pkgcache/38/8bfc7541395b9dbb5463ab37679821c706dab57abe044a42a48aef16152729').read(), 'file_c\n')
 
     def test_index(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
-        self.assertEqual(self.cache[('file_a', 1)], ('c7f33375edf32d8fb62d4b505c74519a', 'file_a'))
+        self.assertEqual(self.cache[('file_a', 1)], ('1847a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda', 'file_a'))
         self.cache[('file_b', 1)] = '/tmp/file_b'
-        self.assertEqual(self.cache[('file_b', 1)], ('a7004efbb89078ebcc8f21d55354e2f3', 'file_b'))
+        self.assertEqual(self.cache[('file_b', 1)], ('2609c7f7ac4f0ce2dd7ed703bd7be0023b6ae5e978f59b5339989ff1dab03aae', 'file_b'))
         self.cache[('file_c', 1)] = '/tmp/file_c'
-        self.assertEqual(self.cache[('file_c', 1)], ('22ee05516c08f3672cb25e03ce7f045f', 'file_c'))
+        self.assertEqual(self.cache[('file_c', 1)], ('388bfc7541395b9dbb5463ab37679821c706dab57abe044a42a48aef16152729', 'file_c'))
         self.assertEqual(set(self.cache.keys()), set((('file_a', 1), ('file_b', 1), ('file_c', 1))))
 
     def test_delete(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
         del self.cache[('file_a', 1)]
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/18'))
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache'))
 
         self.cache[('file_b', 1)] = '/tmp/file_b'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/a7/004efbb89078ebcc8f21d55354e2f3'))
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/26/09c7f7ac4f0ce2dd7ed703bd7be0023b6ae5e978f59b5339989ff1dab03aae'))
         del self.cache[('file_b', 1)]
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/a7/004efbb89078ebcc8f21d55354e2f3'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/a7'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/26/09c7f7ac4f0ce2dd7ed703bd7be0023b6ae5e978f59b5339989ff1dab03aae'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/26'))
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache'))
 
         self.cache[('file_c', 1)] = '/tmp/file_c'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/22/ee05516c08f3672cb25e03ce7f045f'))
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/38/8bfc7541395b9dbb5463ab37679821c706dab57abe044a42a48aef16152729'))
         del self.cache[('file_c', 1)]
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/22/ee05516c08f3672cb25e03ce7f045f'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/22'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/38/8bfc7541395b9dbb5463ab37679821c706dab57abe044a42a48aef16152729'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/38'))
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache'))
 
+    def refcount(self, digest):
+        row = self.cache.conn.execute('SELECT refcount FROM content WHERE hash = ?', (digest,)).fetchone()
+        return row[0] if row else 0
+
     def test_collision(self):
+        digest = '1847a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'
+        self.cache[('a', 'file_a', 1)] = '/tmp/file_a'
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+        self.cache[('b', 'file_a', 1)] = '/tmp/file_a'
+        self.cache[('c', 'file_a', 1)] = '/tmp/file_a'
+        self.assertEqual(self.refcount(digest), 3)
+        # A single file is shared by all the keys.
+        self.assertEqual(os.listdir('/tmp/cache/pkgcache/18'), ['47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'])
+
+        del self.cache[('b', 'file_a', 1)]
+        self.assertEqual(self.refcount(digest), 2)
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+
+        del self.cache[('a', 'file_a', 1)]
+        self.assertEqual(self.refcount(digest), 1)
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+
+        del self.cache[('c', 'file_a', 1)]
+        self.assertEqual(self.refcount(digest), 0)
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/18'))
+
+    def test_refcount(self):
+        # More references than the former three digit suffix allowed.
+        for i in range(1000):
+            self.cache[(str(i), 'file_a', 1)] = '/tmp/file_a'
+        self.assertEqual(self.refcount('1847a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'), 1000)
+        self.assertEqual(len(self.cache), 1000)
+
+    def test_replace(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
+        # Same key with a different content.
+        self.cache[('file_a', 1)] = '/tmp/file_b'
+        self.assertEqual(self.cache[('file_a', 1)], ('2609c7f7ac4f0ce2dd7ed703bd7be0023b6ae5e978f59b5339989ff1dab03aae', 'file_b'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/18'))
+
+        # A newer mtime replaces the entry with the same prefix.
         self.cache[('file_a', 2)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.cache[('file_a', 3)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertEqual(self.cache.keys(), [('file_a', 2)])
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/26'))
 
-        del self.cache[('file_a', 2)]
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        # An older one is not stored.
+        self.cache[('file_a', 0)] = '/tmp/file_b'
+        self.assertEqual(self.cache.keys(), [('file_a', 2)])
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/26'))
 
-        del self.cache[('file_a', 1)]
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+    def test_digest(self):
+        with open('/tmp/file_a', 'w') as f:
+            f.write('x' * 1000)
+        self.assertEqual(osclib.pkgcache._digest('/tmp/file_a', chunk_size=64),
+                         hashlib.sha256('x' * 1000).hexdigest())
+
+    def test_md5(self):
+        # Entry addressed by md5 in a cache from before the switch to sha256.
+        md5 = 'c7f33375edf32d8fb62d4b505c74519a'
+        now = int(time.time())
+        shutil.rmtree('/tmp/cache')
+        os.makedirs('/tmp/cache/pkgcache/c7')
+        os.link('/tmp/file_a', '/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a')
+        index = shelve.open('/tmp/cache/pkgcache/index.db', protocol=-1)
+        index[pickle.dumps(('file_a', now - 1), protocol=-1)] = pickle.dumps((md5, 'file_a'), protocol=-1)
+        index.close()
+        self.cache = PkgCache('/tmp/cache')
+
+        self.assertEqual(self.cache[('file_a', now - 1)], (md5, 'file_a'))
+        self.cache.linkto(('file_a', now - 1), '/tmp/file_a_')
+        self.assertEqual(open('/tmp/file_a_').read(), 'file_a\n')
+        os.unlink('/tmp/file_a_')
+
+        # Replaced by the sha256 addressed content.
+        self.cache[('file_a', now)] = '/tmp/file_a'
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+
+    def test_upgrade(self):
+        # Cache from before the SQLite index, with a collision and an orphan.
+        shutil.rmtree('/tmp/cache')
+        os.makedirs('/tmp/cache/pkgcache/c7')
+        os.makedirs('/tmp/cache/pkgcache/ff')
+        md5 = 'c7f33375edf32d8fb62d4b505c74519a'
+        now = int(time.time())
+        os.link('/tmp/file_a', '/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a')
+        os.link('/tmp/file_a', '/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001')
+        open('/tmp/cache/pkgcache/ff/ff', 'w').close()
+        index = shelve.open('/tmp/cache/pkgcache/index.db', protocol=-1)
+        for key in (('a', 'file_a', now - 1), ('a', 'file_a', now), ('b', 'file_a', now - 1)):
+            index[pickle.dumps(key, protocol=-1)] = pickle.dumps((md5, 'file_a'), protocol=-1)
+        index.close()
+        open('/tmp/cache/pkgcache/index.db.lck', 'w').close()
+
+        self.cache = PkgCache('/tmp/cache')
+        self.assertEqual(sorted(self.cache.keys()), [('a', 'file_a', now), ('b', 'file_a', now - 1)])
+        self.assertEqual(self.cache[('a', 'file_a', now)], (md5, 'file_a'))
+        self.assertEqual(self.cache.stats()['references'], 2)
+        self.assertEqual(os.listdir('/tmp/cache/pkgcache/c7'), ['f33375edf32d8fb62d4b505c74519a'])
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/ff'))
+        self.assertEqual(glob.glob('/tmp/cache/pkgcache/index.db*'), [])
+
+        # Migrated once.
+        os.makedirs('/tmp/cache/pkgcache/ff')
+        open('/tmp/cache/pkgcache/ff/ff', 'w').close()
+        PkgCache('/tmp/cache')
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/ff/ff'))
 
-        del self.cache[('file_a', 3)]
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+    def test_upgrade_unreadable(self):
+        shutil.rmtree('/tmp/cache')
+        os.makedirs('/tmp/cache/pkgcache/c7')
+        open('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001', 'w').close()
+        open('/tmp/cache/pkgcache/index.db', 'w').close()
+
+        self.cache = PkgCache('/tmp/cache')
+        self.assertEqual(len(self.cache), 0)
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/index.db'))
+
+    def test_concurrent_setup(self):
+        # Contents without an index yet, like while another process sets up
+        # the cache.
+        digest = '1847a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'
+        self.cache[('file_a', int(time.time()))] = '/tmp/file_a'
+        for filename in glob.glob('/tmp/cache/pkgcache/index.sqlite*'):
+            os.unlink(filename)
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            with self.cache._locked():
+                os.write(write, 'x')
+                time.sleep(0.2)
+                self.cache._open_index()
+                self.cache.conn.execute('INSERT INTO content VALUES (?, 1, 7)', (digest,))
+            os._exit(0)
+
+        os.read(read, 1)
+        self.cache = PkgCache('/tmp/cache')
+        os.waitpid(pid, 0)
+        self.assertTrue(os.path.exists(self.cache._cache_fn(digest)))
+
+    def test_quota(self):
+        # Each file is 7 bytes.
+        self.cache.quota = 14
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_b', 1)] = '/tmp/file_b'
+        self.cache.linkto(('file_a', 1), '/tmp/file_a_')
+        os.unlink('/tmp/file_a_')
+
+        # Least recently accessed file_b is evicted.
+        self.cache[('file_c', 1)] = '/tmp/file_c'
+        self.assertEqual(sorted(self.cache.keys()), [('file_a', 1), ('file_c', 1)])
+        self.assertEqual(self.cache.stats()['bytes'], 14)
+        self.assertEqual(self.cache.stats()['evicted'], 1)
+
+        # Shared content is only counted once.
+        self.cache[('a', 'file_a', 1)] = '/tmp/file_a'
+        self.assertEqual(len(self.cache), 3)
+
+    def test_quota_constructor(self):
+        self.cache[('file_a', int(time.time()))] = '/tmp/file_a'
+        self.cache[('file_b', int(time.time()))] = '/tmp/file_b'
+        self.cache.close()
+
+        self.cache = PkgCache('/tmp/cache', quota=7)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.stats()['evicted'], 1)
+
+    def test_inspect(self):
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_b', int(time.time()))] = '/tmp/file_b'
+        self.cache.close()
+
+        for i in range(2):
+            cache = PkgCache('/tmp/cache', quota=1, clean=False)
+            self.assertEqual(cache.stats()['entries'], 2)
+            cache.close()
+
+        # Expired and evicted otherwise.
+        self.assertEqual(len(PkgCache('/tmp/cache', quota=1)), 0)
+
+    def test_pending(self):
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        changes = self.cache.conn.total_changes
+
+        # Lookups are not written until the next change.
+        self.assertTrue(('file_a', 1) in self.cache)
+        self.assertFalse(('file_b', 1) in self.cache)
+        self.assertEqual(self.cache.conn.total_changes, changes)
+        self.assertEqual((self.cache.stats()['hit'], self.cache.stats()['miss']), (1, 1))
+
+        self.cache.close()
+        stats = PkgCache('/tmp/cache').stats()
+        self.assertEqual((stats['hit'], stats['miss']), (1, 1))
+
+    def test_gc(self):
+        now = int(time.time())
+        self.cache[('file_a', now)] = '/tmp/file_a'
+        self.cache[('file_b', now)] = '/tmp/file_b'
+        os.unlink('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda')
+        os.makedirs('/tmp/cache/pkgcache/ff')
+        open('/tmp/cache/pkgcache/ff/ff', 'w').close()
+
+        result = self.cache.gc()
+        self.assertEqual(result, {'expired': 0, 'missing': 1, 'orphaned': 1, 'evicted': 0})
+        self.assertEqual(self.cache.keys(), [('file_b', now)])
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/ff'))
+        self.assertEqual(self.cache.stats()['bytes'], 7)
+
+        # Deleting the remaining entry works despite the repair.
+        del self.cache[('file_b', now)]
+        self.assertEqual(self.cache.stats()['bytes'], 0)
+
+    def test_stats(self):
+        self.cache[('a', 'file_a', 1)] = '/tmp/file_a'
+        self.cache[('b', 'file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_b', 1)] = '/tmp/file_b'
+        self.assertTrue(('a', 'file_a', 1) in self.cache)
+        self.assertFalse(('c', 'file_a', 1) in self.cache)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['contents'], 2)
+        self.assertEqual(stats['references'], 3)
+        self.assertEqual(stats['bytes'], 14)
+        self.assertEqual((stats['hit'], stats['miss']), (1, 1))
+        # Cached files are still linked from where they were added.
+        self.assertEqual(stats['links'], 4)
+        self.assertEqual(stats['bytes_linked'], 28)
+
+    def test_missing(self):
+        self.assertFalse(('file_a', 1) in self.cache)
+        self.assertRaises(KeyError, self.cache.__getitem__, ('file_a', 1))
+        with self.assertRaises(KeyError):
+            del self.cache[('file_a', 1)]
 
     def test_linkto(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
@@ -109,7 +333,14 @@ class TestPkgCache(unittest.TestCase):
         self.assertEqual(open('/tmp/file_a_').read(), 'file_a\n')
 
         os.unlink('/tmp/file_a_')
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda'))
+
+        # Removed behind the back of the index.
+        os.unlink('/tmp/cache/pkgcache/18/47a8dc0377647aeb6c2e354f01aac1eb9c268347924de8d85952e2b7312dda')
+        self.assertRaises(KeyError, self.cache.linkto, ('file_a', 1), '/tmp/file_a_')
+        self.assertFalse(os.path.exists('/tmp/file_a_'))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['bytes'], 0)
 
     def test_clean(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
@@ -119,8 +350,9 @@ class TestPkgCache(unittest.TestCase):
         self.cache[('file_b', 1)] = '/tmp/file_b'
         self.cache[('file_c', 1)] = '/tmp/file_c'
 
-        osclib.pkgcache.time.time = MagicMock(return_value=3)
-        self.cache._clean_cache(ttl=2)
+        with patch('osclib.pkgcache.time.time', MagicMock(return_value=3)):
+            self.cache._clean_cache(ttl=2)
+        self.assertEqual(len(self.cache), 1)
         self.assertFalse(('file_a', 1) in self.cache)
         self.assertFalse(('file_a', 2) in self.cache)
         self.assertTrue(('file_a', 3) in self.cache)
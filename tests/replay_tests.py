@@ -0,0 +1,159 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+import osc.core
+import osclib.memoize
+from osclib.cache import Cache
+from osclib.conf import Config
+from osclib.cycle import CycleDetector
+from osclib.list_command import ListCommand
+from osclib.request_splitter import RequestSplitter
+from osclib.stagingapi import StagingAPI
+
+import obs
+from obs import APIURL
+from obs import OBS
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'benchmarks'))
+import fixture_generator
+import replay
+import scenario_benchmark
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.obs = OBS()
+        self.dir = tempfile.mkdtemp()
+        osclib.memoize.new_cycle()
+        Cache.init()
+        self.http_request = osc.core._http_request
+
+    def tearDown(self):
+        # Leave no session cached state of the synthetic project to other tests.
+        osclib.memoize.new_cycle()
+        obs.LATENCY = 0
+        osc.core._http_request = self.http_request
+        shutil.rmtree(self.dir)
+
+    def test_replay_load(self):
+        url = APIURL + '/source/openSUSE:Factory/_meta'
+        obs.replay_load([
+            ('GET', '/source/openSUSE:Factory/_meta', 200, 'application/xml', '<project name="a"/>'),
+            ('GET', '/source/openSUSE:Factory/_meta', 200, 'application/xml', '<project name="b"/>'),
+            ('GET', '/search/request?b=2&a=1', 404, 'text/plain', 'missing'),
+        ])
+        get = lambda url: osc.core._http_request('GET', url).read()
+        self.assertEqual(get(url), '<project name="a"/>')
+        self.assertEqual(get(url), '<project name="b"/>')
+        self.assertEqual(get(url), '<project name="b"/>')
+
+        # Query parameters match in any order.
+        with self.assertRaises(urllib2.HTTPError) as context:
+            get(APIURL + '/search/request?a=1&b=2')
+        self.assertEqual(context.exception.code, 404)
+
+        obs.LATENCY = 0.05
+        start = time.time()
+        get(url)
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_replay_wildcard(self):
+        obs.replay_load([
+            ('GET', '/search/request?*', 200, 'application/xml', '<collection/>'),
+            ('POST', '*', 200, 'application/xml', '<status code="ok"/>'),
+        ])
+        self.assertEqual(osc.core._http_request('GET', APIURL + '/search/request?match=a').read(),
+                         '<collection/>')
+        self.assertEqual(osc.core._http_request('GET', APIURL + '/search/request').read(), '<collection/>')
+        self.assertEqual(osc.core._http_request('POST', APIURL + '/request/1?cmd=changestate').read(),
+                         '<status code="ok"/>')
+
+    def test_replay_concurrent(self):
+        bodies = ['<binarylist>{}</binarylist>'.format('x' * i) for i in range(100)]
+        obs.replay_load([('GET', '/build/{}'.format(i), 200, 'application/xml', body)
+                         for i, body in enumerate(bodies)])
+        get = lambda i: osc.core._http_request('GET', APIURL + '/build/{}'.format(i)).read()
+        pool = ThreadPool(8)
+        try:
+            self.assertEqual(pool.map(get, range(100)), bodies)
+        finally:
+            pool.terminate()
+
+    def test_synthetic(self):
+        factory = fixture_generator.SyntheticFactory(packages=300, requests=40, staged=10, adi=2)
+        self.assertEqual(len(factory.packages), 300)
+        self.assertEqual(len(factory.stagings), 28)
+        obs.replay_load(factory.exchanges('B'))
+        Config('openSUSE:Factory')
+        api = StagingAPI(APIURL, 'openSUSE:Factory')
+
+        self.assertEqual(len(api.get_open_requests()), 30)
+        self.assertEqual(len(api.get_staging_projects_short()), 26)
+        self.assertEqual(sorted(api.ring_packages), sorted(factory.ring))
+
+        splitter = RequestSplitter(api, api.get_open_requests(), in_ring=True)
+        splitter.stagings_load(api.get_staging_projects_short())
+        splitter.strategy_do('none')
+        self.assertEqual(sum(len(proposal['requests']) for proposal in splitter.proposal.values()),
+                         len([request for request in factory.waiting() if request['package'] in factory.ring or
+                              request['type'] == 'delete']))
+
+        # The persistent cache is keyed by project, whatever the server.
+        builddepinfo = CycleDetector._builddepinfo._memoize_cache
+        builddepinfo.clear()
+        try:
+            cycles = list(CycleDetector(api).cycles(api.prj_from_letter('B')))
+        finally:
+            builddepinfo.clear()
+        self.assertEqual(len(cycles), 1)
+        self.assertTrue(set(factory.staging_cycle('B')).issubset(cycles[0][0]))
+
+    def test_synthetic_small(self):
+        factory = fixture_generator.SyntheticFactory(packages=200, requests=50)
+        self.assertEqual(len(factory.waiting()), 35)
+        requests = [request['package'] for request in factory.waiting()[:fixture_generator.WAITING_MIN]]
+        obs.replay_load(factory.exchanges('B'))
+        Config('openSUSE:Factory')
+        api = StagingAPI(APIURL, 'openSUSE:Factory')
+
+        builddepinfo = CycleDetector._builddepinfo._memoize_cache
+        builddepinfo.clear()
+        try:
+            for name, scenario in scenario_benchmark.SCENARIOS.items():
+                scenario(api, dict(scenario_benchmark.DEFAULTS, requests=requests))
+        finally:
+            builddepinfo.clear()
+
+        self.assertRaises(ValueError, fixture_generator.SyntheticFactory, packages=200, requests=300)
+        self.assertRaises(ValueError, fixture_generator.SyntheticFactory, packages=200, requests=50, staged=50)
+        self.assertRaises(ValueError, fixture_generator.SyntheticFactory, packages=50, requests=10)
+
+    def test_record(self):
+        Config('openSUSE:Factory')
+        recorder = replay.Recorder()
+        recorder.install()
+        ListCommand(StagingAPI(APIURL, 'openSUSE:Factory')).perform()
+        path = os.path.join(self.dir, 'list.json')
+        recorder.save(path, {'project': 'openSUSE:Factory'})
+        self.assertTrue(len(recorder.exchanges) > 0)
+        self.assertTrue(all(exchange['method'] == 'GET' for exchange in recorder.exchanges))
+
+        # Replayed without reaching the routes of the fake.
+        osc.core._http_request = self.http_request
+        args = replay.replay(path)
+        self.assertEqual(args, {'project': 'openSUSE:Factory'})
+        Config('openSUSE:Factory')
+        routes = dict(obs._table)
+        for method in obs._table:
+            obs._table[method] = []
+        try:
+            Cache.delete_all()
+            ListCommand(StagingAPI(APIURL, 'openSUSE:Factory')).perform()
+        finally:
+            obs._table.update(routes)
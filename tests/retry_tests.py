@@ -0,0 +1,116 @@
+from email.utils import formatdate
+import time
+import unittest
+import urllib2
+
+from mimetools import Message
+from StringIO import StringIO
+
+from osclib.retry import CircuitOpenError
+from osclib.retry import Retry
+
+
+URL = 'https://api.example.com/source/openSUSE:Factory'
+
+
+def error(code, headers=''):
+    return urllib2.HTTPError(URL, code, 'error', Message(StringIO(headers)), StringIO())
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        Retry.circuits.clear()
+        self.sleep = Retry.sleep
+        self.delays = []
+        Retry.sleep = staticmethod(self.delays.append)
+        self.calls = []
+        self.messages = []
+
+    def tearDown(self):
+        Retry.sleep = staticmethod(self.sleep)
+        Retry.circuits.clear()
+
+    def func(self, errors):
+        errors = list(errors)
+
+        def func(url, data=None):
+            self.calls.append((url, data))
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+        return func
+
+    def request(self, errors, data=None, idempotent=True):
+        return Retry.request(self.func(errors), URL, data, log=self.messages.append, idempotent=idempotent)
+
+    def test_success(self):
+        self.assertEqual(self.request([error(500), error(503), urllib2.URLError('refused')], 'data'), 'ok')
+        self.assertEqual(self.calls, [(URL, 'data')] * 4)
+        self.assertEqual(len(self.messages), 3)
+        for attempt, delay in enumerate(self.delays, 1):
+            self.assertTrue(0 <= delay <= Retry.BACKOFF_BASE * 2 ** attempt)
+
+    def test_backoff_cap(self):
+        for attempt in range(20):
+            self.assertTrue(Retry.delay(attempt) <= Retry.BACKOFF_CAP)
+
+    def test_attempts(self):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.request([error(502)] * Retry.ATTEMPTS)
+        self.assertEqual(context.exception.code, 502)
+        self.assertEqual(len(self.calls), Retry.ATTEMPTS)
+        self.assertEqual(len(self.delays), Retry.ATTEMPTS - 1)
+
+    def test_not_retryable(self):
+        with self.assertRaises(urllib2.HTTPError):
+            self.request([error(404)])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_not_idempotent(self):
+        self.assertEqual(self.request([error(500), error(503)], 'data', idempotent=False), 'ok')
+        self.assertEqual(len(self.calls), 3)
+
+        # The request may have reached the server before the connection failed.
+        for e in (urllib2.URLError('timed out'), error(429)):
+            self.calls[:] = []
+            with self.assertRaises(urllib2.URLError):
+                self.request([e], 'data', idempotent=False)
+            self.assertEqual(len(self.calls), 1)
+
+    def test_retry_after(self):
+        self.request([error(503, 'Retry-After: 7\n'), error(429, 'Retry-After: 1000\n')])
+        self.assertEqual(self.delays, [7, Retry.RETRY_AFTER_CAP])
+
+        self.delays[:] = []
+        date = formatdate(time.time() + 30, usegmt=True)
+        self.request([error(503, 'Retry-After: {}\n'.format(date))])
+        self.assertTrue(28 <= self.delays[0] <= 30)
+
+    def test_circuit(self):
+        threshold = Retry.FAILURE_THRESHOLD
+        with self.assertRaises(urllib2.HTTPError):
+            self.request([error(500)] * Retry.ATTEMPTS)
+        # Opens once the failures of several requests add up.
+        with self.assertRaises(CircuitOpenError):
+            self.request([error(500)] * (threshold - Retry.ATTEMPTS))
+        self.assertEqual(len(self.calls), threshold)
+
+        # Fails without a request while open.
+        with self.assertRaises(urllib2.URLError):
+            self.request([])
+        self.assertEqual(len(self.calls), threshold)
+
+        # Other hosts are not affected.
+        self.assertEqual(Retry.request(self.func([]), 'https://other.example.com/'), 'ok')
+
+        # A probe is let through once the timeout passed and closes the
+        # circuit on success.
+        Retry.circuits['api.example.com'][1] -= Retry.RESET_TIMEOUT
+        self.assertEqual(self.request([]), 'ok')
+        self.assertEqual(Retry.circuits, {})
+
+    def test_circuit_probe_failure(self):
+        Retry.circuits['api.example.com'] = [Retry.FAILURE_THRESHOLD, time.time() - Retry.RESET_TIMEOUT]
+        with self.assertRaises(CircuitOpenError):
+            self.request([error(500)])
+        self.assertEqual(len(self.calls), 1)
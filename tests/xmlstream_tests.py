@@ -0,0 +1,46 @@
+from StringIO import StringIO
+import unittest
+
+from osclib.xmlstream import iterelements
+
+
+BUILDDEPINFO = """
+<builddepinfo>
+  <package name="a">
+    <source>a</source>
+    <subpkg>a-devel</subpkg>
+    <pkgdep>b</pkgdep>
+  </package>
+  <package name="b">
+    <source>b</source>
+    <pkgdep>a-devel</pkgdep>
+  </package>
+  <cycle>
+    <package>a</package>
+    <package>b</package>
+  </cycle>
+</builddepinfo>
+"""
+
+
+class TestXMLStream(unittest.TestCase):
+    def test_children(self):
+        packages = [(e.get('name'), [d.text for d in e.findall('pkgdep')])
+                    for e in iterelements(BUILDDEPINFO, 'package')]
+        self.assertEqual(packages, [('a', ['b']), ('b', ['a-devel'])])
+
+        cycles = [[p.text for p in e.findall('package')]
+                  for e in iterelements(StringIO(BUILDDEPINFO), 'cycle')]
+        self.assertEqual(cycles, [['a', 'b']])
+
+    def test_clear(self):
+        elements = []
+        for e in iterelements(BUILDDEPINFO, 'package'):
+            self.assertEqual(e.find('source').text, e.get('name'))
+            elements.append(e)
+        for e in elements:
+            self.assertEqual(len(e), 0)
+            self.assertEqual(e.get('name'), None)
+
+    def test_empty(self):
+        self.assertEqual(list(iterelements('<builddepinfo />', 'package')), [])
@@ -27,6 +27,7 @@ import osc
 logger = logging.getLogger()
 
 from osclib.conf import Config
+from osclib.http_metrics import HTTPMetrics
 from osclib.stagingapi import StagingAPI
 from osc.core import makeurl
 
@@ -721,6 +722,7 @@ class CommandlineInterface(cmdln.Cmdln):
                 totest.totest()
             except Exception, e:
                 logger.error(e)
+            HTTPMetrics.write()
 
             if opts.interval:
                 if os.isatty(0):
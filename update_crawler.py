@@ -26,7 +26,6 @@ import itertools
 import logging
 import sys
 import urllib2
-import time
 from xml.etree import cElementTree as ET
 
 import osc.conf
@@ -37,6 +36,7 @@ import re
 from urllib import quote_plus
 
 from osclib.memoize import memoize
+from osclib.retry import Retry
 from osclib.conf import Config
 from osclib.stagingapi import StagingAPI
 
@@ -82,7 +82,7 @@ class UpdateCrawler(object):
                 packages.add(title[3:].split(' ')[0])
         return sorted(packages)
 
-    @memoize()
+    @memoize(stale_ttl=60*60)
     def _cached_GET(self, url):
         return self.retried_GET(url).read()
 
@@ -92,14 +92,7 @@ class UpdateCrawler(object):
         return self.retried_GET(url).read()
 
     def retried_GET(self, url):
-        try:
-            return http_GET(url)
-        except urllib2.HTTPError, e:
-            if 500 <= e.code <= 599:
-                print 'Retrying {}'.format(url)
-                time.sleep(1)
-                return self.retried_GET(url)
-            raise e
+        return Retry.request(http_GET, url)
 
     def get_project_meta(self, prj):
         url = makeurl(self.apiurl, ['source', prj, '_meta'])